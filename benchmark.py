@@ -0,0 +1,239 @@
+"""
+    BENCHMARK SEM JANELA
+    Renderiza uma cena em um framebuffer, com um caminho de câmera e um relógio de
+    animação determinísticos, e emite as estatísticas em JSON
+    Apenas o JSON vai para stdout; as mensagens de carregamento e os relatórios vão
+    para stderr (python benchmark.py > resultado.json gera um JSON válido)
+
+    Uso: python benchmark.py [--scene main] [--frames 300] [--backend egl|osmesa|glfw]
+                             [--output resultado.json] [--baseline anterior.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+parser = argparse.ArgumentParser(description='Offscreen rendering benchmark')
+parser.add_argument('--scene', default='main')
+parser.add_argument('--frames', type=int, default=300)
+parser.add_argument('--warmup', type=int, default=10, help='frames rendered before measuring')
+parser.add_argument('--width', type=int, default=1280)
+parser.add_argument('--height', type=int, default=720)
+parser.add_argument('--backend', default='egl', choices=('egl', 'osmesa', 'glfw'), help='egl/osmesa need no window or GPU')
+parser.add_argument('--output', help='also write the JSON to this file')
+parser.add_argument('--baseline', help='JSON of a previous run; exits with 1 if p95 got slower than --tolerance')
+parser.add_argument('--tolerance', type=float, default=0.10)
+parser.add_argument('--streaming', action='store_true', help='load the large models in the background (streaming.py) while rendering')
+parser.add_argument('--budget', type=float, default=2.0, help='per-frame GPU upload budget in ms with --streaming')
+parser.add_argument('--collision', action='store_true', help='also time the camera collision and ground queries (spatial_index.py) each frame')
+parser.add_argument('--archive', help='load the models baked in this .pack file (scene_archive.py) instead of models/')
+parser.add_argument('--lights', type=int, default=0, help='add this many random point lights (lights.py) over the scene')
+parser.add_argument('--profile', help='write per-phase and per-model CPU/GPU timings (FrameProfiler) to this file')
+args = parser.parse_args()
+
+# A plataforma do PyOpenGL precisa ser definida antes de importar OpenGL.GL
+if args.backend != 'glfw':
+    os.environ.setdefault('PYOPENGL_PLATFORM', args.backend)
+
+import numpy as np
+import glm
+import math
+from OpenGL.GL import *
+from glfw_instance import GlfwInstance as GI
+from model_manager import ModelManager
+from mesh_cache import MeshCache
+from texture_manager import TextureManager
+from offscreen import Framebuffer
+from scenes import load_scene
+from profiler import FrameProfiler
+from gl_counter import GLCounter
+from streaming import StreamingLoader
+from spatial_index import SpatialIndex
+from shader_manager import ShaderManager
+from scene_archive import SceneArchive
+import model, model_manager, gpu_buffer, shader_program, render_queue, texture_manager, lights
+
+# Caminho da câmera em função do progresso t (0 a 1): uma volta ao redor da torre
+# subindo e descendo, seguida de uma aproximação pelo terreno
+def camera_path(t):
+    if t < 0.5:
+        a = t / 0.5 * 2 * math.pi
+        position = glm.vec3(math.cos(a) * 14, 6 + 2 * math.sin(2 * a), math.sin(a) * 14)
+        target = glm.vec3(0, 4, 0)
+    else:
+        u = (t - 0.5) / 0.5
+        position = glm.vec3(-12 + 16 * u, 2 + 3 * u, 12 - 10 * u)
+        target = position + glm.vec3(0.6, -0.1, -1)
+    return position, target
+
+# Percentil de uma lista de tempos em milissegundos
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+# stdout -> destino do JSON (as demais mensagens são redirecionadas para stderr)
+def main(stdout=sys.stdout):
+    # O caminho "glfw" usa uma janela oculta; os outros não precisam de janela
+    GI.initialize(args.width, args.height, offscreen=None if args.backend == 'glfw' else args.backend)
+    renderer = glGetString(GL_RENDERER).decode()
+    version = glGetString(GL_VERSION).decode()
+
+    start = time.perf_counter()
+    if args.archive:
+        ModelManager.use_archive(args.archive)
+    StreamingLoader.budget_ms = args.budget
+    scene = load_scene(args.scene, streaming=args.streaming)
+    if args.lights:
+        rng = np.random.default_rng(0) # Mesmas luzes em todas as execuções
+        ModelManager.add_lights(
+            [f'benchmark{i}' for i in range(args.lights)],
+            rng.uniform((-10, 0.3, -10), (10, 4, 10), (args.lights, 3)),
+            rng.uniform(0.3, 1.0, (args.lights, 3)),
+            0.8,
+            rng.uniform(1.0, 3.0, args.lights),
+        )
+    ModelManager.send_to_GPU()
+    glFinish()
+    load_time = time.perf_counter() - start
+
+    if args.collision:
+        start = time.perf_counter()
+        spatial_index = SpatialIndex.from_models(scene['colliders'])
+        index_time = time.perf_counter() - start
+
+    framebuffer = Framebuffer(args.width, args.height)
+    framebuffer.bind()
+    glEnable(GL_DEPTH_TEST)
+    glClearColor(0.2, 0.2, 0.2, 1)
+    mat_projection = np.array(glm.perspective(glm.radians(45), args.width / args.height, 0.1, 1000))
+
+    if args.profile:
+        FrameProfiler.window = args.frames
+        FrameProfiler.enable(sys.modules[__name__], model, model_manager, gpu_buffer, shader_program, render_queue, texture_manager, lights)
+
+    frame_times = []
+    draw_calls = []
+    models_drawn = []
+    triangles = []
+    streaming_ms = []
+    collision_ms = []
+    light_ms = []
+    previous_pos = None
+    streamed_frame = None # Primeiro quadro com todos os modelos carregados
+    total = args.warmup + args.frames
+    for frame in range(total):
+        frame_start = time.perf_counter()
+        FrameProfiler.begin_frame()
+
+        if args.streaming:
+            with FrameProfiler.scope('streaming'):
+                StreamingLoader.update()
+            streaming_ms.append(StreamingLoader.frame_ms)
+            if streamed_frame == None and StreamingLoader.pending() == 0:
+                streamed_frame = frame
+
+        # Mesmo relógio de animação de main.py
+        with FrameProfiler.scope('animate'):
+            ang = 0.1 + 0.201 * (frame + 1)
+            scene['animate'](ang)
+
+        with FrameProfiler.scope('uniforms'):
+            camera_pos, target = camera_path(frame / max(total - 1, 1))
+            mat_view = np.array(glm.lookAt(camera_pos, target, glm.vec3(0, 1, 0)))
+            GI.frame.set(mat_view, mat_projection, camera_pos, ModelManager.light_position())
+            ModelManager.update_lights(mat_view, mat_projection)
+            if ModelManager.clusters != None:
+                light_ms.append(ModelManager.clusters.assign_ms)
+
+        # Mesmas consultas de main.move_camera, com a câmera do caminho
+        if args.collision:
+            with FrameProfiler.scope('collision'):
+                query_start = time.perf_counter()
+                position = spatial_index.move_sphere(previous_pos if previous_pos is not None else tuple(camera_pos), tuple(camera_pos), 0.25)
+                spatial_index.ground_height(position)
+                collision_ms.append((time.perf_counter() - query_start) * 1000)
+            previous_pos = tuple(camera_pos)
+
+        with FrameProfiler.scope('draw'):
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            ModelManager.draw_models(ka=0.3, kd=0.9, ks=0.9, ns=1, view_projection=mat_projection @ mat_view)
+        with FrameProfiler.scope('finish'):
+            glFinish() # Inclui o tempo da GPU no quadro
+
+        if GLCounter.installed:
+            GLCounter.end_frame()
+        FrameProfiler.end_frame()
+
+        if frame >= args.warmup:
+            frame_times.append((time.perf_counter() - frame_start) * 1000)
+            draw_calls.append(ModelManager.draw_call_count)
+            models_drawn.append(ModelManager.drawn_count)
+            triangles.append(ModelManager.triangle_count)
+
+    result = {
+        'scene': args.scene,
+        'frames': args.frames,
+        'resolution': [args.width, args.height],
+        'backend': args.backend,
+        'renderer': renderer,
+        'gl_version': version,
+        'load_time_s': round(load_time, 4),
+        'frame_time_ms': {
+            'mean': round(float(np.mean(frame_times)), 3),
+            'p50': round(percentile(frame_times, 50), 3),
+            'p95': round(percentile(frame_times, 95), 3),
+            'p99': round(percentile(frame_times, 99), 3),
+            'max': round(float(np.max(frame_times)), 3),
+        },
+        'draw_calls': {'mean': round(float(np.mean(draw_calls)), 2), 'max': int(np.max(draw_calls))},
+        'models_drawn': {'mean': round(float(np.mean(models_drawn)), 2), 'max': int(np.max(models_drawn))},
+        'triangles': {'mean': round(float(np.mean(triangles)), 1), 'max': int(np.max(triangles))},
+        'mesh_cache': {'hits': MeshCache.hits, 'misses': MeshCache.misses},
+        'texture_bytes': TextureManager.resident_bytes,
+        'shaders': ShaderManager.report(),
+        'memory': ModelManager.memory_report()['total'],
+    }
+    if args.streaming:
+        result['streaming'] = {
+            'budget_ms': args.budget,
+            'update_ms': {'mean': round(float(np.mean(streaming_ms)), 3), 'max': round(float(np.max(streaming_ms)), 3)},
+            'complete_frame': streamed_frame,
+        }
+    if light_ms:
+        result['lights'] = ModelManager.light_report()
+        result['lights']['assign_ms'] = {'mean': round(float(np.mean(light_ms)), 3), 'max': round(float(np.max(light_ms)), 3)}
+    if args.archive:
+        result['archive'] = SceneArchive.report(args.archive)
+    if args.collision:
+        result['collision'] = {
+            'triangles': len(spatial_index.triangles),
+            'build_s': round(index_time, 4),
+            'query_ms': {'mean': round(float(np.mean(collision_ms)), 3), 'p95': round(percentile(collision_ms, 95), 3)},
+        }
+    StreamingLoader.shutdown()
+
+    if args.profile:
+        FrameProfiler.report()
+        FrameProfiler.export(args.profile)
+
+    output = json.dumps(result, indent=2)
+    print(output, file=stdout)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+    # Compara com uma execução anterior para detectar regressões
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        before = baseline['frame_time_ms']['p95']
+        after = result['frame_time_ms']['p95']
+        if before > 0 and after > before * (1 + args.tolerance):
+            print(f'Regression: p95 frame time {before:.3f} ms -> {after:.3f} ms', file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        main(stdout)
@@ -0,0 +1,51 @@
+import numpy as np
+
+# Extrai os seis planos do frustum (esquerda, direita, baixo, cima, perto, longe)
+# de uma matriz projection * view (formato de np.array(glm.mat4), linha por linha)
+#   Cada plano (a, b, c, d) é normalizado e aponta para dentro do frustum
+def frustum_planes(view_projection):
+    m = np.asarray(view_projection, dtype=np.float64)
+    planes = np.array([
+        m[3] + m[0],
+        m[3] - m[0],
+        m[3] + m[1],
+        m[3] - m[1],
+        m[3] + m[2],
+        m[3] - m[2],
+    ])
+    planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+    return planes
+
+# Caixas e esferas envolventes em coordenadas do mundo, dadas as matrizes Model (n, 4, 4)
+#   Retorna centros e meias-extensões das caixas, centros e raios das esferas
+def world_bounds(matrices, bounds_min, bounds_max, sphere_centers, sphere_radii):
+    rotation = matrices[:, :3, :3]
+    translation = matrices[:, :3, 3]
+
+    box_centers = np.einsum('nij,nj->ni', rotation, (bounds_min + bounds_max) / 2) + translation
+    box_extents = np.einsum('nij,nj->ni', np.abs(rotation), (bounds_max - bounds_min) / 2)
+
+    centers = np.einsum('nij,nj->ni', rotation, sphere_centers) + translation
+    radii = sphere_radii * np.linalg.norm(rotation, axis=1).max(axis=1) # maior escala entre os eixos
+    return box_centers, box_extents, centers, radii
+
+# Testa vários volumes contra o frustum de uma vez
+#   Primeiro as esferas (mais baratas); as que passam são testadas pelas caixas
+#   Retorna uma máscara com os volumes visíveis (ou parcialmente visíveis)
+def visible(planes, box_centers, box_extents, centers, radii):
+    normals, offsets = planes[:, :3], planes[:, 3]
+    sphere_distances = centers @ normals.T + offsets
+    result = np.all(sphere_distances >= -radii[:, None], axis=1)
+
+    box_distances = box_centers @ normals.T + offsets
+    box_radii = box_extents @ np.abs(normals).T
+    result &= np.all(box_distances >= -box_radii, axis=1)
+    return result
+
+# Tamanho aproximado das esferas na tela, como fração da metade da altura da janela
+#   O fator de escala vertical da projeção é a norma da segunda linha de projection * view
+#   e a distância até a câmera é a coordenada w dos centros no espaço de recorte
+def screen_sizes(view_projection, centers, radii):
+    m = np.asarray(view_projection, dtype=np.float64)
+    w = centers @ m[3, :3] + m[3, 3]
+    return radii * np.linalg.norm(m[1, :3]) / np.maximum(w, 1e-6)
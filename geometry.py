@@ -0,0 +1,256 @@
+import numpy as np
+from collections import deque
+
+# Seleciona as linhas de um array a partir de índices do .obj (a partir de 1)
+#   Índices ausentes (0) resultam em zeros
+def gather(values, indices):
+    if len(values) == 0:
+        return np.zeros((len(indices), values.shape[1]), dtype=np.float32)
+    result = values[indices - 1]
+    result[indices == 0] = 0
+    return result
+
+# Agrupa os vértices das faces com a mesma tripla (v, vt, vn)
+#   Retorna as triplas únicas, na ordem da primeira ocorrência, e o índice de cada vértice
+def deduplicate_vertices(corners):
+    if len(corners) == 0:
+        return corners, np.zeros(0, dtype=np.uint32)
+    dims = corners.max(axis=0).astype(np.int64) + 1
+    keys = np.ravel_multi_index(corners.T.astype(np.int64), dims)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return corners[first[order]], rank[inverse.ravel()].astype(np.uint32)
+
+# Espalha os 10 bits menos significativos de x, deixando dois zeros entre cada bit
+def spread_bits(x):
+    x = x & 0x3ff
+    x = (x | (x << 16)) & 0x30000ff
+    x = (x | (x << 8)) & 0x300f00f
+    x = (x | (x << 4)) & 0x30c30c3
+    x = (x | (x << 2)) & 0x9249249
+    return x
+
+# Reordena os triângulos pela curva de Morton dos seus centróides, aproximando
+# triângulos vizinhos no espaço para aproveitar o cache de vértices da GPU
+def morton_order(positions):
+    centroids = positions.reshape(-1, 3, 3).mean(axis=1)
+    low, high = centroids.min(axis=0), centroids.max(axis=0)
+    cells = ((centroids - low) / np.maximum(high - low, 1e-12) * 1023).astype(np.int64)
+    codes = spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << 1) | (spread_bits(cells[:, 2]) << 2)
+    return np.argsort(codes, kind='stable')
+
+# Simula um cache FIFO de vértices transformados e retorna a média de
+# vértices processados por triângulo (ACMR)
+def cache_miss_ratio(indices, cache_size=32):
+    if len(indices) == 0:
+        return 0.0
+    cache = deque()
+    cached = set()
+    misses = 0
+    for index in indices.tolist():
+        if index not in cached:
+            misses += 1
+            if len(cache) == cache_size:
+                cached.discard(cache.popleft())
+            cache.append(index)
+            cached.add(index)
+    return misses / (len(indices) // 3)
+
+# Divide faces de qualquer quantidade de vértices em leque: (v0, v1, v2), (v0, v2, v3), ...
+#   corners -> vértices das faces em sequência; face_sizes -> quantidade de vértices de cada face
+#   Faces com menos de 3 vértices são descartadas
+#   Retorna os vértices dos triângulos e a face de origem de cada triângulo
+def triangulate(corners, face_sizes):
+    face_sizes = np.asarray(face_sizes, dtype=np.int64)
+    counts = np.maximum(face_sizes - 2, 0)
+    faces = np.repeat(np.arange(len(face_sizes)), counts)
+    first = (np.cumsum(face_sizes) - face_sizes)[faces]
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    triangles = np.stack([first, first + step, first + step + 1], axis=1)
+    return corners[triangles.ravel()], faces
+
+# Material de cada triângulo de um .obj (0: sem material; i: obj['materials'][i - 1])
+#   faces -> face de origem de cada triângulo (ver triangulate)
+def triangle_materials(obj, faces):
+    if 'face_materials' not in obj or len(obj['face_materials']) == 0:
+        return np.zeros(len(faces), dtype=np.int32)
+    return (obj['face_materials'][faces] + 1).astype(np.int32)
+
+# Vetores (..., 3) com comprimento 1; vetores nulos continuam nulos
+def normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
+
+# Normal de cada triângulo (t, 3, 3), com comprimento igual ao dobro da sua área
+def face_normals(triangles):
+    return np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+
+# Ângulo interno de cada vértice dos triângulos (t, 3, 3) em radianos
+def corner_angles(triangles):
+    to_next = normalize(np.roll(triangles, -1, axis=1) - triangles)
+    to_previous = normalize(np.roll(triangles, 1, axis=1) - triangles)
+    return np.arccos(np.clip(np.sum(to_next * to_previous, axis=2), -1.0, 1.0))
+
+# Gera as normais dos vértices dos triângulos que não têm vn
+#   corners -> (t * 3, 3) índices (v, vt, vn) dos triângulos (ver triangulate)
+#   mode -> 'smooth' (média das faces que compartilham a posição) ou 'flat' (normal da face)
+#   weighting -> peso de cada face na média: 'angle' (ângulo no vértice, não depende de
+#   como a face foi dividida), 'area' ou 'uniform'
+#   faces -> face de origem de cada triângulo; no modo 'flat' os triângulos de uma
+#   mesma face compartilham a normal
+#   Retorna as normais com as geradas acrescentadas ao fim e os índices com o vn preenchido
+def generate_normals(positions, normals, corners, faces=None, mode='smooth', weighting='angle'):
+    missing = corners[:, 2] == 0
+    if not missing.any() or len(positions) == 0:
+        return normals, corners
+    triangles = gather(positions, corners[:, 0]).reshape(-1, 3, 3).astype(np.float64)
+    normals_of_faces = face_normals(triangles)
+    if mode == 'flat':
+        faces = np.arange(len(normals_of_faces)) if faces is None else np.asarray(faces, dtype=np.int64)
+        generated = normalize(np.stack([np.bincount(faces, normals_of_faces[:, axis]) for axis in range(3)], axis=1))
+        normal_of = np.repeat(faces, 3)
+    elif mode == 'smooth':
+        if weighting == 'angle':
+            weights = normalize(normals_of_faces)[:, None, :] * corner_angles(triangles)[:, :, None]
+        elif weighting == 'area':
+            weights = np.repeat(normals_of_faces[:, None, :], 3, axis=1)
+        elif weighting == 'uniform':
+            weights = np.repeat(normalize(normals_of_faces)[:, None, :], 3, axis=1)
+        else:
+            raise ValueError(f'Unknown normal weighting: {weighting}')
+        normal_of = corners[:, 0].astype(np.int64) - 1
+        weights = weights.reshape(-1, 3)
+        generated = normalize(np.stack([np.bincount(normal_of, weights[:, axis], minlength=len(positions)) for axis in range(3)], axis=1))
+    else:
+        raise ValueError(f'Unknown normal mode: {mode}')
+    corners = corners.copy()
+    corners[missing, 2] = len(normals) + normal_of[missing] + 1
+    return np.concatenate([normals.reshape(-1, 3), generated.astype(np.float32)]), corners
+
+# Tangentes dos vértices para mapas de normais (n, 4): direção de u da textura no
+# plano perpendicular à normal e, em w, o sentido da direção de v (1 ou -1)
+#   Vértices sem coordenadas de textura usam uma direção qualquer perpendicular à normal
+def vertex_tangents(positions, texture_coords, normals, indices):
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    points = np.asarray(positions, dtype=np.float64)[triangles]
+    coords = np.asarray(texture_coords, dtype=np.float64)[triangles]
+    edge1, edge2 = points[:, 1] - points[:, 0], points[:, 2] - points[:, 0]
+    delta1, delta2 = coords[:, 1] - coords[:, 0], coords[:, 2] - coords[:, 0]
+    determinant = delta1[:, 0] * delta2[:, 1] - delta2[:, 0] * delta1[:, 1]
+    inverse = np.divide(1.0, determinant, out=np.zeros_like(determinant), where=np.abs(determinant) > 1e-20)[:, None]
+    face_tangents = (edge1 * delta2[:, 1:] - edge2 * delta1[:, 1:]) * inverse
+    face_bitangents = (edge2 * delta1[:, :1] - edge1 * delta2[:, :1]) * inverse
+
+    # Soma das faces de cada vértice, ortogonalizada em relação à normal (Gram-Schmidt)
+    vertex_of = triangles.ravel()
+    sums = [np.stack([np.bincount(vertex_of, np.repeat(vectors[:, axis], 3), minlength=len(positions)) for axis in range(3)], axis=1)
+            for vectors in (face_tangents, face_bitangents)]
+    normals = np.asarray(normals, dtype=np.float64)
+    tangents = sums[0] - normals * np.sum(normals * sums[0], axis=1, keepdims=True)
+    degenerate = np.linalg.norm(tangents, axis=1) <= 1e-6 * np.linalg.norm(sums[0], axis=1) # Sem u ou u paralelo à normal
+    tangents = normalize(tangents)
+    if degenerate.any():
+        fallback = np.cross(normals[degenerate], [0.0, 1.0, 0.0])
+        fallback[~fallback.any(axis=1)] = np.cross(normals[degenerate][~fallback.any(axis=1)], [1.0, 0.0, 0.0])
+        tangents[degenerate] = normalize(fallback)
+    handedness = np.where(np.sum(np.cross(normals, tangents) * sums[1], axis=1) < 0, -1.0, 1.0)
+    return np.column_stack([tangents, handedness]).astype(np.float32)
+
+# Gera a malha indexada de um .obj: vértices únicos, um buffer de índices e
+# buffers de índices simplificados (lod1, lod2, ...) sobre os mesmos vértices
+#   Os triângulos são agrupados por material com uma única ordenação, de modo que
+#   cada material ocupa um intervalo contíguo dos índices ('materials' guarda o
+#   material de cada triângulo e 'lodN_materials' o de cada nível)
+#   As faces com mais de 3 vértices são divididas em triângulos e os vértices sem
+#   normal recebem normais geradas (ver generate_normals, com normals e weighting)
+#   optimize -> reordena os triângulos de cada material quando isso reduz o ACMR
+#   tangents -> acrescenta 'tangents' (n, 4) para mapas de normais (ver vertex_tangents)
+def build_mesh(obj, optimize=True, normals='smooth', weighting='angle', tangents=False):
+    face_sizes = obj['face_sizes'] if 'face_sizes' in obj else np.full(len(obj['indices']) // 3, 3)
+    corners, faces = triangulate(obj['indices'], face_sizes)
+    materials = triangle_materials(obj, faces)
+    vertex_normals, corners = generate_normals(obj['vertices'], obj['normals'], corners, faces, normals, weighting)
+    if len(corners) > 0:
+        order = np.argsort(materials, kind='stable')
+        triangles = corners.reshape(-1, 3, 3)
+        unique, indices = deduplicate_vertices(triangles[order].reshape(-1, 3))
+
+        if optimize and len(corners) >= 3:
+            morton = morton_order(gather(obj['vertices'], corners[:, 0]))
+            morton = morton[np.argsort(materials[morton], kind='stable')]
+            sorted_unique, sorted_indices = deduplicate_vertices(triangles[morton].reshape(-1, 3))
+            if cache_miss_ratio(sorted_indices) < cache_miss_ratio(indices):
+                unique, indices, order = sorted_unique, sorted_indices, morton
+        materials = materials[order]
+    else:
+        unique, indices = deduplicate_vertices(corners)
+
+    mesh = {}
+    mesh['vertices'] = gather(obj['vertices'], unique[:, 0])
+    mesh['texture_coords'] = gather(obj['texture_coords'], unique[:, 1])
+    mesh['normals'] = gather(vertex_normals, unique[:, 2])
+    mesh['indices'] = indices
+    mesh['materials'] = materials
+    mesh['material_names'] = np.array(obj.get('materials', []), dtype=str)
+    if tangents:
+        mesh['tangents'] = vertex_tangents(mesh['vertices'], mesh['texture_coords'], mesh['normals'], indices)
+    for level, (lod, lod_materials) in enumerate(build_lods(mesh['vertices'], indices, materials), start=1):
+        mesh[f'lod{level}'] = lod
+        mesh[f'lod{level}_materials'] = lod_materials
+    return mesh
+
+# Simplifica uma malha por agrupamento de vértices em uma grade
+#   resolution -> quantidade de células no maior eixo da caixa envolvente
+#   Cada célula é representada pelo vértice mais próximo da média da célula, de
+#   modo que os índices gerados continuam apontando para os vértices originais.
+#   Triângulos degenerados ou repetidos são removidos.
+#   Retorna os índices e, para cada triângulo mantido, o triângulo de origem
+def cluster_vertices(positions, indices, resolution):
+    positions = np.asarray(positions, dtype=np.float64)
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    cell_size = max((high - low).max(), 1e-12) / resolution
+    cells = np.floor((positions - low) / cell_size).astype(np.int64)
+    cells = np.minimum(cells, resolution - 1)
+    _, cell_of = np.unique(cells[:, 0] * resolution * resolution + cells[:, 1] * resolution + cells[:, 2], return_inverse=True)
+    cell_of = cell_of.ravel()
+
+    # Vértice mais próximo da média de cada célula
+    counts = np.bincount(cell_of)
+    means = np.stack([np.bincount(cell_of, positions[:, axis]) for axis in range(3)], axis=1) / counts[:, None]
+    distances = np.linalg.norm(positions - means[cell_of], axis=1)
+    order = np.lexsort((distances, cell_of))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = cell_of[order[1:]] != cell_of[order[:-1]]
+    representative = np.empty(len(counts), dtype=np.uint32)
+    representative[cell_of[order[first]]] = order[first]
+
+    triangles = representative[cell_of[indices]].reshape(-1, 3)
+    keep = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])
+    source = np.flatnonzero(keep)
+    triangles = triangles[keep]
+    _, unique = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    unique = np.sort(unique)
+    return triangles[unique].ravel(), source[unique]
+
+# Gera os níveis de detalhe (LOD) de uma malha, do mais detalhado ao mais simples
+#   Um nível só é mantido se tiver no máximo max_ratio dos triângulos do anterior
+#   Retorna (índices, material de cada triângulo) de cada nível; a ordem dos
+#   triângulos é preservada, então os materiais continuam agrupados
+def build_lods(positions, indices, materials=None, resolutions=(48, 24, 12), max_ratio=0.75, min_triangles=16):
+    lods = []
+    previous = len(indices) // 3
+    if len(indices) == 0 or len(indices) % 3 != 0:
+        return lods
+    if materials is None:
+        materials = np.zeros(previous, dtype=np.int32)
+    for resolution in resolutions:
+        lod, source = cluster_vertices(positions, indices, resolution)
+        triangles = len(lod) // 3
+        if triangles < min_triangles:
+            break
+        if triangles <= previous * max_ratio:
+            lods.append((lod, materials[source]))
+            previous = triangles
+    return lods
@@ -0,0 +1,49 @@
+import functools
+
+# Conta as chamadas OpenGL feitas por módulos do projeto
+#   install() troca as funções gl* importadas nos módulos por versões que contam
+#   as chamadas; sem install() não há nenhum custo
+class GLCounter:
+
+    "static"
+    installed = False
+    calls = {}
+    last_frame = {}
+    frames = 0
+    total = 0
+
+    @staticmethod
+    def wrap(name, function):
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            GLCounter.calls[name] = GLCounter.calls.get(name, 0) + 1
+            return function(*args, **kwargs)
+        counted.counted = True
+        return counted
+
+    @staticmethod
+    def install(*modules):
+        for module in modules:
+            for name, value in list(vars(module).items()):
+                if name.startswith('gl') and name[2:3].isupper() and callable(value) and not hasattr(value, 'counted'):
+                    setattr(module, name, GLCounter.wrap(name, value))
+        GLCounter.installed = True
+
+    # Encerra o quadro atual e retorna a quantidade de chamadas feitas nele
+    @staticmethod
+    def end_frame():
+        count = sum(GLCounter.calls.values())
+        GLCounter.frames += 1
+        GLCounter.total += count
+        GLCounter.last_frame = GLCounter.calls
+        GLCounter.calls = {}
+        return count
+
+    # Exibe as chamadas do último quadro, agrupadas por função
+    @staticmethod
+    def report():
+        calls = GLCounter.last_frame
+        average = GLCounter.total / max(GLCounter.frames, 1)
+        summary = ', '.join(f'{name}: {count}' for name, count in sorted(calls.items(), key=lambda item: -item[1]))
+        print(f'GL calls: {sum(calls.values())} last frame, {average:.1f} per frame on average ({summary})')
+        return calls
@@ -0,0 +1,229 @@
+import numpy as np
+from OpenGL.GL import *
+from shader_manager import ATTRIBUTE_LOCATIONS
+
+# Atributos intercalados de cada vértice: (nome no shader, quantidade de floats)
+VERTEX_LAYOUT = (('position', 3), ('texture_coord', 2), ('normals', 3))
+VERTEX_SIZE = sum(size for _, size in VERTEX_LAYOUT) * 4 # bytes por vértice
+INDEX_SIZE = 4 # índices de 32 bits
+
+# Formatos de vértice das arenas: (nome no shader, componentes, tipo, normalizado, bytes por componente)
+FLOAT_FORMAT = tuple((name, size, GL_FLOAT, False, 4) for name, size in VERTEX_LAYOUT)
+# Formato compacto do arquivo .pack (ver scene_archive.py): posição em meia precisão,
+# coordenadas de textura quantizadas no intervalo do modelo e normal octaédrica,
+# decodificadas no vertex shader (variante QUANTIZED)
+PACKED_FORMAT = (
+    ('position', 4, GL_HALF_FLOAT, False, 2),
+    ('texture_coord', 2, GL_UNSIGNED_SHORT, True, 2),
+    ('normals', 2, GL_SHORT, True, 2),
+)
+
+# Bytes por vértice de um formato
+def format_size(vertex_format):
+    return sum(count * size for _, count, _, _, size in vertex_format)
+
+# Intercala posição, coordenada de textura e normal em um único array (n, 8)
+def interleave(vertices, texture_coords, normals):
+    data = np.empty((len(vertices), VERTEX_SIZE // 4), dtype=np.float32)
+    data[:, 0:3] = vertices
+    data[:, 3:5] = texture_coords
+    data[:, 5:8] = normals
+    return data
+
+# Região contígua da GPU com um buffer de vértices intercalados, um buffer de
+# índices e um VAO que guarda a configuração dos atributos
+#   Novos modelos são acrescentados com glBufferSubData; quando falta espaço os
+#   buffers dobram de tamanho e o conteúdo antigo é copiado dentro da própria GPU
+class BufferArena:
+
+    bound = None # Objeto cujo VAO está ativo
+
+    # vertex_format -> FLOAT_FORMAT (vértices de interleave) ou PACKED_FORMAT
+    def __init__(self, vertex_capacity=1 << 16, index_capacity=1 << 18, vertex_format=FLOAT_FORMAT):
+        self.vertex_format = vertex_format
+        self.vertex_size = format_size(vertex_format)
+        self.vao = glGenVertexArrays(1)
+        self.vbo = None
+        self.ebo = None
+        self.vertex_capacity = 0
+        self.index_capacity = 0
+        self.vertex_count = 0
+        self.index_count = 0
+        self.generation = 0 # Incrementado quando os buffers são recriados
+        self.free_vertices = [] # Intervalos (início, quantidade) liberados por free()
+        self.free_indices = []
+        self.reserve(vertex_capacity, index_capacity)
+
+    # Ativa o VAO da arena, evitando trocas redundantes
+    def bind(self):
+        if BufferArena.bound is not self:
+            glBindVertexArray(self.vao)
+            BufferArena.bound = self
+
+    # Cria um buffer com a capacidade pedida, copiando o conteúdo do buffer antigo
+    @staticmethod
+    def grow_buffer(old_buffer, used_bytes, capacity_bytes):
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        glBufferData(GL_COPY_WRITE_BUFFER, capacity_bytes, None, GL_STATIC_DRAW)
+        if old_buffer != None:
+            if used_bytes > 0:
+                glBindBuffer(GL_COPY_READ_BUFFER, old_buffer)
+                glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, used_bytes)
+            glDeleteBuffers(1, [old_buffer])
+        return buffer
+
+    # Garante espaço para a quantidade de vértices e índices pedida
+    def reserve(self, vertex_capacity, index_capacity):
+        if vertex_capacity <= self.vertex_capacity and index_capacity <= self.index_capacity:
+            return
+        if vertex_capacity > self.vertex_capacity:
+            self.vertex_capacity = max(vertex_capacity, 2 * self.vertex_capacity)
+            self.vbo = BufferArena.grow_buffer(self.vbo, self.vertex_count * self.vertex_size, self.vertex_capacity * self.vertex_size)
+        if index_capacity > self.index_capacity:
+            self.index_capacity = max(index_capacity, 2 * self.index_capacity)
+            self.ebo = BufferArena.grow_buffer(self.ebo, self.index_count * INDEX_SIZE, self.index_capacity * INDEX_SIZE)
+
+        # O VAO referencia os buffers, então precisa ser reconfigurado
+        self.generation += 1
+        self.bind()
+        self.setup_attributes()
+
+    # Configura os atributos de vértice e o buffer de índices no VAO ativo
+    #   Usado também pelos VAOs de outros objetos que desenham a partir da arena
+    def setup_attributes(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        offset = 0
+        for name, count, gl_type, normalized, size in self.vertex_format:
+            loc = ATTRIBUTE_LOCATIONS[name]
+            glEnableVertexAttribArray(loc)
+            glVertexAttribPointer(loc, count, gl_type, normalized, self.vertex_size, ctypes.c_void_p(offset))
+            offset += count * size
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+
+    # Liga um buffer de matrizes (n, 4, 4), transpostas, ao atributo instance_model do
+    # VAO ativo, avançando uma matriz por instância
+    @staticmethod
+    def setup_instance_attribute(buffer):
+        glBindBuffer(GL_ARRAY_BUFFER, buffer)
+        loc = ATTRIBUTE_LOCATIONS["instance_model"]
+        for column in range(4):
+            glEnableVertexAttribArray(loc + column)
+            glVertexAttribPointer(loc + column, 4, GL_FLOAT, False, 64, ctypes.c_void_p(16 * column))
+            glVertexAttribDivisor(loc + column, 1)
+
+    # Retira count elementos de uma lista de intervalos livres [(início, quantidade)]
+    #   Retorna o início do primeiro intervalo que comporta count, ou None
+    @staticmethod
+    def take_free(free, count):
+        for i, (start, size) in enumerate(free):
+            if size >= count:
+                if size == count:
+                    free.pop(i)
+                else:
+                    free[i] = (start + count, size - count)
+                return start
+        return None
+
+    # Devolve um intervalo à lista de intervalos livres, juntando vizinhos
+    @staticmethod
+    def give_free(free, start, count):
+        free.append((start, count))
+        free.sort()
+        merged = [free[0]]
+        for start, size in free[1:]:
+            last_start, last_size = merged[-1]
+            if last_start + last_size == start:
+                merged[-1] = (last_start, last_size + size)
+            else:
+                merged.append((start, size))
+        free[:] = merged
+
+    # Reserva espaço para vertex_count vértices e index_count índices e retorna
+    # (primeiro vértice, primeiro índice); reutiliza intervalos liberados por free()
+    def allocate(self, vertex_count, index_count):
+        vertex_start = BufferArena.take_free(self.free_vertices, vertex_count)
+        index_start = BufferArena.take_free(self.free_indices, index_count)
+        new_vertices = vertex_count if vertex_start == None else 0
+        new_indices = index_count if index_start == None else 0
+        self.reserve(self.vertex_count + new_vertices, self.index_count + new_indices)
+        if vertex_start == None:
+            vertex_start = self.vertex_count
+            self.vertex_count += vertex_count
+        if index_start == None:
+            index_start = self.index_count
+            self.index_count += index_count
+        return vertex_start, index_start
+
+    # Libera o espaço de um modelo para ser reutilizado por outros
+    def free(self, model):
+        vertex_count = model.vertex_count
+        index_count = sum(count for _, count in model.lod_ranges)
+        if vertex_count > 0:
+            BufferArena.give_free(self.free_vertices, model.start_vertex, vertex_count)
+        if index_count > 0:
+            BufferArena.give_free(self.free_indices, model.start_index, index_count)
+        model.arena = None
+
+    # Vértices de um modelo no formato da arena
+    #   Modelos do arquivo .pack já trazem os vértices compactados (vista do arquivo mapeado)
+    def vertex_data(self, model):
+        if self.vertex_format == PACKED_FORMAT:
+            return model.packed
+        return interleave(model.vertices, model.texture_coords, model.normals)
+
+    # Escreve vértices no formato da arena (ver vertex_data) a partir do vértice start
+    def write_vertices(self, start, vertices):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, start * self.vertex_size, vertices.nbytes, vertices)
+
+    # Escreve índices (já deslocados para os vértices do modelo) a partir do índice start
+    def write_indices(self, start, indices):
+        self.bind()
+        indices = np.ascontiguousarray(indices, dtype=np.uint32)
+        glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, start * INDEX_SIZE, indices.nbytes, indices)
+
+    # Registra no modelo a posição da sua geometria na arena
+    def assign(self, model, vertex_start, index_start):
+        model.arena = self
+        model.start_vertex = vertex_start
+        model.start_index = index_start
+        model.lod_ranges = []
+        start_index = index_start
+        for lod in model.lods:
+            model.lod_ranges.append((start_index, len(lod)))
+            start_index += len(lod)
+        model.build_parts()
+
+    # Envia a geometria de um modelo para a arena
+    #   Os índices de todos os níveis de detalhe são enviados em sequência e
+    #   deslocados para apontar para os vértices do modelo
+    def upload(self, model):
+        vertices = self.vertex_data(model)
+        vertex_start, index_start = self.allocate(len(vertices), sum(len(lod) for lod in model.lods))
+        self.write_vertices(vertex_start, vertices)
+        self.write_indices(index_start, np.concatenate(model.lods) + np.uint32(vertex_start))
+        self.assign(model, vertex_start, index_start)
+
+    # Substitui a geometria de um modelo da arena pela de uma nova versão (ver
+    # ModelManager.replace_model)
+    #   Quando os dados novos cabem no intervalo do antigo, são escritos nele com
+    #   glBufferSubData e a sobra volta para os intervalos livres; senão o intervalo
+    #   antigo é liberado e o modelo é enviado como um novo
+    def replace(self, old, model):
+        vertices = self.vertex_data(model)
+        indices = np.concatenate(model.lods)
+        old_indices = sum(count for _, count in old.lod_ranges)
+        if len(vertices) > old.vertex_count or len(indices) > old_indices:
+            self.free(old)
+            self.upload(model)
+            return
+        vertex_start, index_start = old.start_vertex, old.start_index
+        self.write_vertices(vertex_start, vertices)
+        self.write_indices(index_start, indices + np.uint32(vertex_start))
+        if old.vertex_count > len(vertices):
+            BufferArena.give_free(self.free_vertices, vertex_start + len(vertices), old.vertex_count - len(vertices))
+        if old_indices > len(indices):
+            BufferArena.give_free(self.free_indices, index_start + len(indices), old_indices - len(indices))
+        old.arena = None
+        self.assign(model, vertex_start, index_start)
@@ -0,0 +1,223 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from model import *
+from model_manager import ModelManager
+from texture_manager import TextureManager
+from scene_graph import SceneGraph
+from streaming import StreamingLoader
+from scenes import read_scene, model_name
+
+# Argumentos de load_model aplicados no lugar, sem ler o modelo de novo
+TRANSFORM_DEFAULTS = {'angle': 0, 'r': Coord3d(0.0,1.0,0.0), 't': Coord3d(0.0,0.0,0.0), 's': Coord3d(1.0,1.0,1.0), 'parent': None}
+
+# Recarrega a cena enquanto a janela está aberta
+#   update(), chamado uma vez por quadro, verifica a cada interval segundos a data e o
+#   tamanho do arquivo da cena e dos arquivos dos diretórios dos seus modelos (dos modelos
+#   do arquivo .pack, apenas as imagens) e aplica apenas o que mudou:
+#     - arquivo da cena: compara com a versão anterior pelo nome de cada modelo e luz;
+#       transformações e luzes são alteradas no lugar, modelos novos são carregados,
+#       removidos saem da arena e os demais argumentos (diretório, textures, materials,
+#       light_source) fazem o modelo ser lido de novo
+#     - .obj ou .mtl: o modelo é lido de novo e sua geometria substitui a antiga no mesmo
+#       intervalo da arena quando cabe nele (ver ModelManager.replace_model)
+#     - imagem: a textura é decodificada de novo e trocada nos modelos do diretório
+#   A leitura dos arquivos acontece em threads; as tarefas prontas são aplicadas na
+#   thread do OpenGL, na ordem em que foram pedidas, até gastar budget_ms do quadro
+class SceneWatcher:
+
+    interval = 0.5 # Segundos entre as verificações dos arquivos
+    budget_ms = 4.0 # Tempo por quadro para aplicar as mudanças (ao menos uma por quadro)
+    workers = 2
+
+    # scene -> cena retornada por scenes.load_scene (atualizada no lugar a cada mudança)
+    def __init__(self, scene):
+        self.scene = scene
+        self.executor = ThreadPoolExecutor(max_workers=SceneWatcher.workers)
+        self.tasks = deque() # (nome do modelo ou None, {arquivo: Future}, função que aplica a mudança)
+        self.stamps = self.scan()
+        self.last_check = time.perf_counter()
+        self.reloads = 0
+
+    # Data de modificação e tamanho de cada arquivo observado
+    def scan(self):
+        files = [self.scene['path']]
+        for model_dir in sorted({model_dir for model_dir, _ in self.scene['models']}):
+            directory = os.path.join(ModelManager.main_dir, model_dir)
+            if os.path.isdir(directory):
+                archived = ModelManager.in_archive(model_dir) # Geometria e materiais vêm do .pack
+                files += [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if not archived or filename.endswith(('.jpg', '.png'))]
+        stamps = {}
+        for filepath in files:
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            stamps[filepath] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    # Pede as tarefas dos arquivos alterados desde a última verificação
+    def check(self):
+        stamps = self.scan()
+        changed = sorted(filepath for filepath in set(stamps) | set(self.stamps) if stamps.get(filepath) != self.stamps.get(filepath))
+        self.stamps = stamps
+        reloading = set()
+        if self.scene['path'] in changed:
+            reloading |= self.scene_changed()
+            self.stamps = self.scan() # Diretórios de modelos novos passam a ser observados
+        for filepath in changed:
+            if filepath != self.scene['path']:
+                self.file_changed(filepath, reloading)
+
+    # Aplica as mudanças do arquivo da cena; retorna os modelos que serão lidos de novo
+    def scene_changed(self):
+        try:
+            scene = read_scene(self.scene['path'])
+        except Exception as error: # Arquivo inválido ou ainda sendo gravado: mantém a cena atual
+            print(f'Scene {self.scene["path"]} not reloaded: {error}')
+            return set()
+        print(f'Reloading scene {self.scene["path"]}')
+        old = {model_name(model_dir, kwargs): (model_dir, kwargs) for model_dir, kwargs in self.scene['models']}
+        new = {model_name(model_dir, kwargs): (model_dir, kwargs) for model_dir, kwargs in scene['models']}
+
+        for name in old:
+            if name not in new and name in ModelManager.models:
+                ModelManager.remove_model(name)
+                StreamingLoader.entries.pop(name, None)
+        ModelManager.keep_geometry.update(scene['colliders'])
+
+        reloading = set()
+        for name, (model_dir, kwargs) in new.items():
+            old_dir, old_kwargs = old.get(name, (None, {}))
+            rebuild = old_dir != model_dir or any(old_kwargs.get(key) != kwargs.get(key) for key in ('light_source', 'textures', 'materials'))
+            if name not in ModelManager.models or (rebuild and SceneWatcher.loaded(name)):
+                self.reload_model(name, model_dir, kwargs, ModelManager.submit_jobs(self.executor, model_dir, {}))
+                reloading.add(name)
+            elif any(old_kwargs.get(key) != kwargs.get(key) for key in TRANSFORM_DEFAULTS):
+                self.tasks.append((name, {}, lambda name=name, kwargs=kwargs: SceneWatcher.apply_transform(ModelManager.models[name], kwargs)))
+
+        # Luzes depois dos modelos (podem estar presas a um modelo novo)
+        old_lights = dict(self.scene['lights'])
+        self.tasks.append((None, {}, lambda: SceneWatcher.apply_lights(old_lights, scene['lights'])))
+        self.scene.update(scene)
+        return reloading
+
+    # Pede a tarefa de um arquivo alterado de um diretório de modelo
+    #   reloading -> modelos que já serão lidos de novo por inteiro
+    def file_changed(self, filepath, reloading):
+        model_dir = os.path.basename(os.path.dirname(filepath))
+        entries = [(model_name(directory, kwargs), kwargs) for directory, kwargs in self.scene['models'] if directory == model_dir]
+        entries = [(name, kwargs) for name, kwargs in entries if name not in reloading and SceneWatcher.loaded(name)]
+        if not entries:
+            return
+        if filepath.endswith(('.jpg', '.png')) and filepath in TextureManager.by_path and os.path.exists(filepath):
+            job = self.executor.submit(TextureManager.read, filepath)
+            names = [name for name, _ in entries]
+            self.tasks.append((names[0], {filepath: job}, lambda: SceneWatcher.apply_texture(filepath, *job.result(), names)))
+        elif filepath.endswith(('.obj', '.mtl', '.jpg', '.png')) and not ModelManager.in_archive(model_dir): # Imagens novas ou apagadas mudam os materiais
+            jobs = {}
+            if filepath.endswith('.obj') and os.path.exists(filepath):
+                jobs[filepath] = self.executor.submit(ModelManager.load_mesh, filepath)
+            for name, kwargs in entries:
+                self.reload_model(name, model_dir, kwargs, jobs)
+                reloading.add(name)
+
+    # Modelo presente na cena e, com streaming, já carregado (o StreamingLoader lê os
+    # arquivos atuais ao terminar)
+    @staticmethod
+    def loaded(name):
+        entry = StreamingLoader.entries.get(name)
+        return name in ModelManager.models and (entry == None or entry.state == 'ready')
+
+    # Pede a leitura de um modelo e a sua troca (ou inclusão) na cena
+    #   jobs -> leituras já em andamento; os demais arquivos são lidos na thread do OpenGL
+    #   (texturas inalteradas são reaproveitadas pelo hash do arquivo)
+    def reload_model(self, name, model_dir, kwargs, jobs):
+        self.tasks.append((name, jobs, lambda: self.apply_model(name, model_dir, kwargs, jobs)))
+
+    def apply_model(self, name, model_dir, kwargs, jobs):
+        old = ModelManager.models.get(name)
+        node = old.node if old != None and not isinstance(old, InstancedModel) else None
+        model_class = LightModel if kwargs.get('light_source', False) else Model
+        model = ModelManager.read_model_dir(
+            model_dir,
+            lambda mesh: model_class(mesh, node=node),
+            jobs,
+            kwargs.get('textures'),
+            kwargs.get('materials'),
+        )
+        SceneWatcher.apply_transform(model, kwargs)
+        if old != None:
+            ModelManager.replace_model(name, model)
+        else:
+            ModelManager.add_model(name, model)
+        if name in StreamingLoader.entries:
+            StreamingLoader.entries[name].model = model
+        self.reloads += 1
+
+    # Altera no lugar a transformação e o pai de um modelo
+    @staticmethod
+    def apply_transform(model, kwargs):
+        transform = {key: kwargs.get(key, default) for key, default in TRANSFORM_DEFAULTS.items()}
+        parent = ModelManager.models[transform['parent']] if transform['parent'] != None else None
+        model.parent = parent
+        parent_node = parent.node if parent != None else -1
+        if SceneGraph.parents[model.node] != parent_node:
+            SceneGraph.set_parent(model.node, parent_node)
+        model.transform(r=transform['r'], t=transform['t'], s=transform['s'])
+        model.rotate(transform['angle'])
+
+    # Troca a textura de um arquivo nos modelos que a usam
+    @staticmethod
+    def apply_texture(filepath, image, file_key, names):
+        old, texture = TextureManager.reload(filepath, image, file_key)
+        for name in names:
+            model = ModelManager.models[name]
+            if model.texture is old:
+                model.texture = texture
+            model.materials = [material._replace(texture=texture) if material.texture is old else material for material in model.materials]
+
+    # Acrescenta, remove e altera as luzes pontuais
+    #   old, new -> {nome: argumentos de add_light} das duas versões da cena
+    @staticmethod
+    def apply_lights(old, new):
+        new = dict(new)
+        for name in old:
+            if name not in new or old[name].get('parent') != new[name].get('parent'):
+                ModelManager.remove_light(name)
+        for name, kwargs in new.items():
+            if name not in ModelManager.lights:
+                ModelManager.add_light(name, **kwargs)
+            elif kwargs != old[name]:
+                ModelManager.set_light(
+                    name, kwargs['position'], kwargs.get('color', (1.0, 1.0, 1.0)), kwargs.get('intensity', 1.0), kwargs.get('radius', 5.0)
+                )
+
+    # Verifica os arquivos e aplica as tarefas prontas, na ordem pedida
+    #   Retorna os nomes dos modelos alterados neste quadro
+    def update(self):
+        start = time.perf_counter()
+        if start - self.last_check >= SceneWatcher.interval:
+            self.last_check = start
+            self.check()
+        changed = set()
+        while self.tasks and all(job.done() for job in self.tasks[0][1].values()):
+            name, _, apply = self.tasks.popleft()
+            try:
+                apply()
+            except Exception as error: # Arquivo inválido ou ainda sendo gravado: mantém a versão atual
+                print(f'Reload of {name or "lights"} failed: {error}')
+            else:
+                if name != None:
+                    changed.add(name)
+            if (time.perf_counter() - start) * 1000 >= SceneWatcher.budget_ms:
+                break
+        return changed
+
+    # Tarefas ainda não aplicadas
+    def pending(self):
+        return len(self.tasks)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
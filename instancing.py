@@ -0,0 +1,55 @@
+import numpy as np
+
+# Matrizes model (n, 4, 4) de várias instâncias de uma vez, na mesma ordem de
+# Model.model_matrix: translação, rotação em torno de um eixo e escala
+#   translations -> (n, 3); angles -> graus (n,) ou escalar; axis -> (n, 3) ou (3,)
+#   scales -> (n, 3), (n,) ou escalar
+def instance_matrices(translations, angles=0.0, axis=(0.0, 1.0, 0.0), scales=1.0):
+    translations = np.asarray(translations, dtype=np.float64).reshape(-1, 3)
+    count = len(translations)
+    angles = np.radians(np.broadcast_to(np.asarray(angles, dtype=np.float64), (count,)))
+    scales = np.asarray(scales, dtype=np.float64)
+    scales = np.broadcast_to(scales[..., None] if scales.ndim == 1 else scales, (count, 3))
+
+    # Fórmula de Rodrigues para a rotação de cada instância
+    axis = np.broadcast_to(np.asarray(axis, dtype=np.float64), (count, 3))
+    x, y, z = (axis / np.linalg.norm(axis, axis=1, keepdims=True)).T
+    c, s = np.cos(angles), np.sin(angles)
+    C = 1 - c
+    rotation = np.empty((count, 3, 3))
+    rotation[:, 0] = np.stack([c + x*x*C, x*y*C - z*s, x*z*C + y*s], axis=1)
+    rotation[:, 1] = np.stack([y*x*C + z*s, c + y*y*C, y*z*C - x*s], axis=1)
+    rotation[:, 2] = np.stack([z*x*C - y*s, z*y*C + x*s, c + z*z*C], axis=1)
+
+    matrices = np.zeros((count, 4, 4), dtype=np.float32)
+    matrices[:, :3, :3] = rotation * scales[:, None, :]
+    matrices[:, :3, 3] = translations
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+# Sorteia pontos sobre a superfície de um modelo (em coordenadas do mundo), com
+# probabilidade proporcional à área dos triângulos
+#   max_slope -> ângulo máximo (graus) entre a normal do triângulo e o eixo y, para
+#   espalhar objetos apenas nas partes planas de um terreno
+#   O modelo precisa manter seus arrays (ModelManager.keep_geometry)
+def scatter_on_model(model, count, seed=None, max_slope=None):
+    model.require_geometry()
+    rng = np.random.default_rng(seed)
+    matrix = model.model_matrix()
+    positions = np.asarray(model.vertices, dtype=np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+    triangles = positions[np.asarray(model.indices).reshape(-1, 3)]
+
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    areas = np.linalg.norm(cross, axis=1) / 2
+    if max_slope != None:
+        up = np.abs(cross[:, 1]) / np.maximum(2 * areas, 1e-12)
+        areas = np.where(up >= np.cos(np.radians(max_slope)), areas, 0.0)
+    if areas.sum() == 0:
+        return np.zeros((0, 3))
+
+    chosen = rng.choice(len(triangles), size=count, p=areas / areas.sum())
+    u, v = rng.random(count), rng.random(count)
+    flip = u + v > 1 # Mantém os pontos dentro do triângulo
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    a, b, c = triangles[chosen, 0], triangles[chosen, 1], triangles[chosen, 2]
+    return a + u[:, None] * (b - a) + v[:, None] * (c - a)
@@ -0,0 +1,233 @@
+import time
+import numpy as np
+from OpenGL.GL import *
+from scene_graph import SceneGraph
+from shader_manager import SAMPLER_UNITS
+
+# Luzes pontuais da cena, guardadas em arrays com uma linha por luz
+#   position -> posição relativa ao nó node (coordenadas do mundo quando node é -1)
+#   color, intensity -> cor (RGB de 0 a 1) e multiplicador da luz
+#   radius -> distância em que a contribuição da luz chega a zero
+class LightList:
+
+    def __init__(self):
+        self.names = []
+        self.positions = np.zeros((0, 3))
+        self.colors = np.zeros((0, 3))
+        self.intensities = np.zeros(0)
+        self.radii = np.zeros(0)
+        self.nodes = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    # Acrescenta várias luzes de uma vez
+    #   positions -> (n, 3); colors (n, 3), intensities e radii (n) aceitam um único valor
+    def add(self, names, positions, colors=(1.0, 1.0, 1.0), intensities=1.0, radii=5.0, node=-1):
+        names = list(names)
+        repeated = [name for name in names if name in self.names]
+        if repeated or len(set(names)) != len(names):
+            raise ValueError(f'Light names already in use: {repeated or names}')
+        count = len(names)
+        self.names += names
+        self.positions = np.vstack([self.positions, np.asarray(positions, dtype=np.float64).reshape(count, 3)])
+        self.colors = np.vstack([self.colors, np.broadcast_to(np.asarray(colors, dtype=np.float64), (count, 3))])
+        self.intensities = np.append(self.intensities, np.broadcast_to(intensities, count))
+        self.radii = np.append(self.radii, np.broadcast_to(radii, count))
+        self.nodes = np.append(self.nodes, np.full(count, node, dtype=np.int64))
+
+    def remove(self, name):
+        index = self.names.index(name)
+        self.names.pop(index)
+        self.positions = np.delete(self.positions, index, axis=0)
+        self.colors = np.delete(self.colors, index, axis=0)
+        self.intensities = np.delete(self.intensities, index)
+        self.radii = np.delete(self.radii, index)
+        self.nodes = np.delete(self.nodes, index)
+
+    # Altera uma luz (None mantém o valor atual)
+    def set(self, name, position=None, color=None, intensity=None, radius=None):
+        index = self.names.index(name)
+        if position is not None:
+            self.positions[index] = tuple(position)
+        if color is not None:
+            self.colors[index] = tuple(color)
+        if intensity is not None:
+            self.intensities[index] = intensity
+        if radius is not None:
+            self.radii[index] = radius
+
+    # Posições no mundo (n, 3), aplicando as matrizes do mundo dos nós das luzes
+    def world_positions(self):
+        positions = self.positions.copy()
+        attached = self.nodes >= 0
+        if attached.any():
+            matrices = SceneGraph.world_matrices(self.nodes[attached]).astype(np.float64)
+            positions[attached] = np.einsum('nij,nj->ni', matrices[:, :3, :3], positions[attached]) + matrices[:, :3, 3]
+        return positions
+
+# Atribuição das luzes pontuais aos clusters da tela (clustered shading)
+#   O frustum é dividido em tiles_x x tiles_y blocos da tela e em slices fatias de
+#   profundidade (espaçadas em escala logarítmica de min_depth a max_depth). A cada quadro a
+#   esfera de alcance de cada luz é projetada, de forma vetorizada, no intervalo de
+#   clusters que ela cobre, e são enviados para a GPU:
+#     - os dados das luzes (posição e raio, cor e intensidade)
+#     - a lista de luzes de cada cluster, em sequência
+#     - o intervalo (início, quantidade) da lista de cada cluster
+#   Os três ficam em buffer textures, e cada fragmento percorre apenas as luzes do
+#   seu cluster (ver FRAGMENT_SOURCE em shader_manager.py)
+class LightClusters:
+
+    tiles_x = 16
+    tiles_y = 9
+    slices = 24
+    min_depth = 1.0 # Fragmentos mais próximos usam a primeira fatia (evita fatias finas perto da câmera)
+    max_depth = 100.0 # Fragmentos mais distantes usam a última fatia
+
+    def __init__(self):
+        self.buffers = {}
+        self.textures = {}
+        for name, internal_format in (('lightData', GL_RGBA32F), ('clusterRanges', GL_RG32UI), ('lightIndices', GL_R32UI)):
+            self.buffers[name] = glGenBuffers(1)
+            glBindBuffer(GL_TEXTURE_BUFFER, self.buffers[name])
+            glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_STREAM_DRAW)
+            self.textures[name] = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_BUFFER, self.textures[name])
+            glTexBuffer(GL_TEXTURE_BUFFER, internal_format, self.buffers[name])
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+        self.light_count = 0 # Luzes que alcançam algum cluster no último quadro
+        self.pair_count = 0 # Pares (cluster, luz) do último quadro
+        self.max_lights = 0 # Maior quantidade de luzes em um cluster
+        self.assign_ms = 0.0
+
+    @property
+    def cluster_count(self):
+        return LightClusters.tiles_x * LightClusters.tiles_y * LightClusters.slices
+
+    # Escala e deslocamento da fatia: fatia = floor(log(profundidade) * escala + deslocamento)
+    @staticmethod
+    def slice_scale():
+        scale = LightClusters.slices / np.log(LightClusters.max_depth / LightClusters.min_depth)
+        return scale, -np.log(LightClusters.min_depth) * scale
+
+    # Intervalo de clusters ([x0, x1], [y0, y1], [z0, z1]) coberto por cada luz
+    #   centers -> posições no espaço da câmera (n, 3); as luzes fora do frustum
+    #   ficam de fora da máscara retornada
+    @staticmethod
+    def cluster_ranges(centers, radii, projection, near, far):
+        tiles = np.array([LightClusters.tiles_x, LightClusters.tiles_y])
+        depth = -centers[:, 2]
+        nearest = depth - radii
+        farthest = depth + radii
+        mask = (farthest > near) & (nearest < far)
+
+        # Caixa da esfera projetada na tela; quem cruza o plano near cobre a tela toda
+        corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64)
+        points = centers[:, None, :] + corners * radii[:, None, None]
+        clip = np.concatenate([points, np.ones(points.shape[:2] + (1,))], axis=2) @ np.asarray(projection, dtype=np.float64).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ndc = clip[:, :, :2] / clip[:, :, 3:]
+        crossing = nearest <= near
+        low = np.where(crossing[:, None], -1.0, ndc.min(axis=1))
+        high = np.where(crossing[:, None], 1.0, ndc.max(axis=1))
+        mask &= (high > -1).all(axis=1) & (low < 1).all(axis=1)
+        first = np.clip(np.floor((low + 1) / 2 * tiles), 0, tiles - 1).astype(np.int64)
+        last = np.clip(np.floor((high + 1) / 2 * tiles), 0, tiles - 1).astype(np.int64)
+
+        scale, bias = LightClusters.slice_scale()
+        depth_range = np.log(np.maximum(np.column_stack([nearest, farthest]), near)) * scale + bias
+        slices = np.clip(np.floor(depth_range), 0, LightClusters.slices - 1).astype(np.int64)
+        return np.column_stack([first[:, 0], last[:, 0], first[:, 1], last[:, 1], slices[:, 0], slices[:, 1]]), mask
+
+    # Lista de luzes de cada cluster
+    #   Retorna os intervalos (início, quantidade) de cada cluster e os índices das luzes
+    @staticmethod
+    def bin_lights(ranges):
+        tiles_x, tiles_y = LightClusters.tiles_x, LightClusters.tiles_y
+        ranges = ranges.astype(np.int32)
+        x0, x1, y0, y1, z0, z1 = ranges.T
+        width_x = x1 - x0 + 1
+        area = width_x * (y1 - y0 + 1)
+        counts = area * (z1 - z0 + 1)
+
+        # Um par (cluster, luz) para cada cluster do intervalo de cada luz: a posição
+        # do par dentro do intervalo da sua luz vira o deslocamento em x, y e z
+        lights = np.repeat(np.arange(len(ranges), dtype=np.int32), counts)
+        local = np.arange(counts.sum(), dtype=np.int32) - np.repeat(np.cumsum(counts, dtype=np.int32) - counts, counts)
+        width_x = np.repeat(width_x, counts)
+        area = np.repeat(area, counts)
+        dz, rest = np.divmod(local, area)
+        dy, dx = np.divmod(rest, width_x)
+        clusters = np.repeat((z0 * tiles_y + y0) * tiles_x + x0, counts) + (dz * tiles_y + dy) * tiles_x + dx
+
+        # Ordenação estável por cluster (radix sort com chaves de 16 bits)
+        cluster_count = tiles_x * tiles_y * LightClusters.slices
+        keys = clusters.astype(np.uint16) if cluster_count <= 1 << 16 else clusters
+        order = np.argsort(keys, kind='stable')
+        per_cluster = np.bincount(clusters, minlength=cluster_count)
+        cluster_ranges = np.column_stack([np.cumsum(per_cluster) - per_cluster, per_cluster]).astype(np.uint32)
+        return cluster_ranges, lights[order].astype(np.uint32)
+
+    # Envia os dados a um buffer texture (com ao menos um elemento)
+    def upload(self, name, data):
+        data = np.ascontiguousarray(data)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffers[name])
+        glBufferData(GL_TEXTURE_BUFFER, max(data.nbytes, 16), data if data.nbytes > 0 else None, GL_STREAM_DRAW)
+
+    # Atribui as luzes aos clusters do quadro e envia as listas para a GPU
+    #   view, projection -> matrizes do quadro no formato de np.array(glm.mat4)
+    #   Retorna os valores do bloco Lights (ver LightBlock)
+    def assign(self, lights, view, projection, width, height):
+        start = time.perf_counter()
+        projection = np.asarray(projection, dtype=np.float64)
+        near = projection[2, 3] / (projection[2, 2] - 1)
+        far = projection[2, 3] / (projection[2, 2] + 1)
+
+        positions = lights.world_positions()
+        view = np.asarray(view, dtype=np.float64)
+        centers = positions @ view[:3, :3].T + view[:3, 3]
+        radii = lights.radii
+        reaching = lights.intensities > 0
+        ranges, mask = LightClusters.cluster_ranges(centers, radii, projection, near, far)
+        mask &= reaching
+        selected = np.flatnonzero(mask)
+        cluster_ranges, indices = LightClusters.bin_lights(ranges[selected])
+
+        data = np.column_stack([positions[selected], radii[selected], lights.colors[selected], lights.intensities[selected]])
+        self.upload('lightData', data.astype(np.float32))
+        self.upload('clusterRanges', cluster_ranges)
+        self.upload('lightIndices', indices)
+        self.light_count = len(selected)
+        self.pair_count = len(indices)
+        self.max_lights = int(cluster_ranges[:, 1].max()) if len(selected) else 0
+        self.assign_ms = (time.perf_counter() - start) * 1000
+
+        scale, bias = LightClusters.slice_scale()
+        return (
+            (LightClusters.tiles_x, LightClusters.tiles_y, LightClusters.slices, self.light_count),
+            (width / LightClusters.tiles_x, height / LightClusters.tiles_y, scale, bias),
+        )
+
+    # Ativa os buffer textures nas unidades reservadas (SAMPLER_UNITS)
+    def bind(self):
+        for name, texture in self.textures.items():
+            glActiveTexture(GL_TEXTURE0 + SAMPLER_UNITS[name])
+            glBindTexture(GL_TEXTURE_BUFFER, texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    # Retorna e exibe as estatísticas do último quadro
+    def report(self, total):
+        stats = {
+            'lights': total,
+            'visible': self.light_count,
+            'clusters': self.cluster_count,
+            'pairs': self.pair_count,
+            'max_per_cluster': self.max_lights,
+            'assign_ms': round(self.assign_ms, 3),
+        }
+        print(f'Lights: {self.light_count}/{total} visible, {self.pair_count} cluster entries in {self.cluster_count} clusters '
+              f'(max {self.max_lights} per cluster), assigned in {self.assign_ms:.2f} ms')
+        return stats
@@ -7,23 +7,43 @@ import math
 from glfw_instance import GlfwInstance as GI
 from model import *
 from model_manager import ModelManager
+from scenes import load_scene
+from mesh_cache import MeshCache
+from texture_manager import TextureManager
+from shader_manager import ShaderManager
+from gl_counter import GLCounter
+from profiler import FrameProfiler
+from streaming import StreamingLoader
+from hot_reload import SceneWatcher
+from spatial_index import SpatialIndex
+import sys, model, model_manager, gpu_buffer, shader_program, render_queue, texture_manager, lights
+
+count_gl_calls = False # Exibe a quantidade de chamadas OpenGL por quadro
+profile_frames = False # Mede o tempo de CPU/GPU das fases e dos modelos (título da janela e profile.json)
+stream_models = False # Carrega os modelos grandes em segundo plano, começando por caixas (ver streaming.py)
+archive_path = None # Arquivo .pack gerado por "python scene_archive.py bake" (None: lê models/)
+hot_reload = False # Aplica as mudanças de scene_files/ e models/ sem reiniciar (ver hot_reload.py)
 
 GI.initialize()
+if archive_path != None:
+    ModelManager.use_archive(archive_path)
 
-ModelManager.load_model('sky')
-ModelManager.load_model('terrain2', t=Coord3d(40, .35, -15), s=Coord3d(10, 10, 10) )
-ModelManager.load_model('terrain5', t=Coord3d(-5, 0.35, 6), s=Coord3d(1, 1, 1) )
-
-ModelManager.load_model('watchtower', r=Coord3d(0, 1, 0), t=Coord3d(0, 0, 0))
-ModelManager.load_model('ranger', r=Coord3d(0, 1, 0), s=Coord3d(0.5, 0.5, 0.5))
-ModelManager.load_model('stool', r=Coord3d(0, 1, 0), t=Coord3d(0, 6.5, 0), s=Coord3d(0.1, 0.1, 0.1))
-ModelManager.load_model('moon', light_source=True, r=Coord3d(-1, 0, -1), s=Coord3d(0.01, 0.01, 0.01))
-ModelManager.load_model('lata', r=Coord3d(0, 1, 0), t=Coord3d(0, 6.9, 0), s=Coord3d(0.06, 0.06, 0.06))
-ModelManager.load_model('pinheiro', r=Coord3d(0, 1, 0), t=Coord3d(0, 0.3, 5), s=Coord3d(1, 1, 1))
-ModelManager.load_model('toquinho', r=Coord3d(0, 1, 0), t=Coord3d(-3.5, 0.6, -2.5), s=Coord3d(1, 1, 1))
-ModelManager.load_model('cerca', r=Coord3d(0, 1, 0), t=Coord3d(5, 1.68, -2.5), s=Coord3d(0.45, 0.45, 0.45))
-ModelManager.load_model('arvore', r=Coord3d(0, 1, 0), t=Coord3d(5, 0.65, 0), s=Coord3d(0.06, 0.06, 0.06))
+scene = load_scene('main', streaming=stream_models)
 ModelManager.send_to_GPU()
+ShaderManager.report()
+MeshCache.report()
+TextureManager.report()
+ModelManager.geometry_report()
+ModelManager.lod_report()
+ModelManager.light_report()
+ModelManager.memory_report()
+
+# Índice dos triângulos estáticos da cena (com streaming, construído quando todos carregarem)
+spatial_index = None
+if not stream_models:
+    spatial_index = SpatialIndex.from_models(scene['colliders'])
+watcher = SceneWatcher(scene) if hot_reload else None
+colliders_changed = False # Índice desatualizado até as tarefas do watcher terminarem
 
 """
     CAMERA E MOUSE
@@ -35,6 +55,24 @@ camera_front = glm.vec3(0,  1, -1)
 camera_up    = glm.vec3(0,  1,  0)
 polygonal_mode = False
 fovy = 45
+camera_radius = 0.25 # Raio da esfera de colisão da câmera
+eye_height = 0.6 # Altura mínima da câmera sobre o chão
+follow_ground = False # Mantém a câmera a eye_height do chão (SPACE e SHIFT deixam de subir/descer)
+
+# Move a câmera sem atravessar os modelos nem descer abaixo do chão
+#   Fora dos modelos, o chão fica em y = 0; os limites horizontais e o teto do cenário continuam
+def move_camera(old_pos, new_pos):
+    if not (-10 < new_pos[0] < 10 and new_pos[1] < 10 and -10 < new_pos[2] < 10):
+        return old_pos
+    if spatial_index == None:
+        return new_pos if new_pos[1] > eye_height else old_pos
+
+    position = spatial_index.move_sphere(tuple(old_pos), tuple(new_pos), camera_radius)
+    ground = spatial_index.ground_height(position)[0]
+    ground = 0 if np.isnan(ground) else max(ground, 0)
+    if follow_ground or position[1] < ground + eye_height:
+        position[1] = ground + eye_height
+    return glm.vec3(*position)
 
 def key_event(window,key,scancode,action,mods):
 
@@ -57,8 +95,8 @@ def key_event(window,key,scancode,action,mods):
     if key == glfw.KEY_LEFT_SHIFT and action in (glfw.PRESS, glfw.REPEAT):
          new_pos = (camera_pos - camera_speed * camera_up)
 
-    if new_pos[0] > -10 and new_pos[0] < 10 and new_pos[1] > .6 and  new_pos[1] < 10 and new_pos[2] > -10 and new_pos[2] < 10:
-        camera_pos = new_pos
+    if new_pos != camera_pos:
+        camera_pos = move_camera(camera_pos, new_pos)
 
     if key == glfw.KEY_P and action==glfw.PRESS:
         polygonal_mode = not polygonal_mode
@@ -107,8 +145,17 @@ def mouse_event(window, xpos, ypos):
     front.z = math.sin(glm.radians(yaw)) * math.cos(glm.radians(pitch))
     camera_front = glm.normalize(front)
     
+# Clique esquerdo: seleciona o modelo no centro da tela
+def mouse_button_event(window, button, action, mods):
+    if button == glfw.MOUSE_BUTTON_LEFT and action == glfw.PRESS and spatial_index != None:
+        hit = spatial_index.pick(tuple(camera_pos), tuple(camera_front))
+        if hit != None:
+            name, distance, point = hit
+            print(f'Picked {name} at {distance:.2f} ({point[0]:.2f}, {point[1]:.2f}, {point[2]:.2f})')
+
 glfw.set_key_callback(GI.window,key_event)
 glfw.set_cursor_pos_callback(GI.window, mouse_event)
+glfw.set_mouse_button_callback(GI.window, mouse_button_event)
 glfw.set_input_mode(GI.window, glfw.CURSOR, glfw.CURSOR_DISABLED); 
 
 # Matriz view
@@ -130,6 +177,11 @@ def projection():
     EXECUCAO DO PROGRAMA
 """
 
+if count_gl_calls:
+    GLCounter.install(sys.modules[__name__], model, model_manager, gpu_buffer, shader_program, render_queue, texture_manager, lights)
+if profile_frames:
+    FrameProfiler.enable(sys.modules[__name__], model, model_manager, gpu_buffer, shader_program, render_queue, texture_manager, lights)
+
 # Exibir a janela
 glfw.show_window(GI.window)
 glfw.set_cursor_pos(GI.window, lastX, lastY)
@@ -140,7 +192,10 @@ ns_inc = 1
     
 while not glfw.window_should_close(GI.window):
 
-    glfw.poll_events() 
+    FrameProfiler.begin_frame()
+
+    with FrameProfiler.scope('poll'):
+        glfw.poll_events() 
     ang += 0.001
     
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -152,35 +207,55 @@ while not glfw.window_should_close(GI.window):
     if polygonal_mode==False:
         glPolygonMode(GL_FRONT_AND_BACK,GL_FILL)
     
-    ang += .2
-    ModelManager.models['ranger'].transform( 
-        t=Coord3d( math.cos(ang*0.02)*0.5, 6.5, math.sin(ang*0.02)*0.5 )
-    )
-    ModelManager.models['ranger'].rotate( 
-        ang * -1.14,
-    )
-    ModelManager.models['moon'].transform(
-        t=Coord3d(math.cos(ang*0.01)*20, 10, math.sin(ang*0.01)*20)
-    )
-    ModelManager.draw_models(
-        ka=0.1, 
-        kd=0.1, 
-        ks=0.9, 
-        ns=ns_inc
-    )
-    
-    mat_view = view()
-    loc_view = glGetUniformLocation(GI.program, "view")
-    glUniformMatrix4fv(loc_view, 1, GL_TRUE, mat_view)
+    if stream_models:
+        with FrameProfiler.scope('streaming'):
+            StreamingLoader.update(camera_pos)
+        if spatial_index == None and StreamingLoader.pending() == 0:
+            spatial_index = SpatialIndex.from_models(scene['colliders'])
 
-    mat_projection = projection()
-    loc_projection = glGetUniformLocation(GI.program, "projection")
-    glUniformMatrix4fv(loc_projection, 1, GL_TRUE, mat_projection)    
-    
-    # atualizando a posicao da camera/observador na GPU para calculo da reflexao especular
-    loc_view_pos = glGetUniformLocation(GI.program, "viewPos") # recuperando localizacao da variavel viewPos na GPU
-    glUniform3f(loc_view_pos, camera_pos[0], camera_pos[1], camera_pos[2]) # posicao da camera/observador (x,y,z)
+    if watcher != None:
+        with FrameProfiler.scope('hot reload'):
+            colliders_changed |= bool(watcher.update() & set(scene['colliders']))
+        if colliders_changed and spatial_index != None and watcher.pending() == 0:
+            spatial_index = SpatialIndex.from_models([name for name in scene['colliders'] if name in ModelManager.models])
+            colliders_changed = False
+
+    with FrameProfiler.scope('animate'):
+        ang += .2
+        scene['animate'](ang)
+
+    # atualizando view, projection, posicao da camera/observador (reflexao especular)
+    # e posicao da luz na GPU, uma unica vez por quadro
+    with FrameProfiler.scope('uniforms'):
+        mat_view = view()
+        mat_projection = projection()
+        GI.frame.set(mat_view, mat_projection, camera_pos, ModelManager.light_position())
+        ModelManager.update_lights(mat_view, mat_projection) # Luzes pontuais por cluster
+
+    # intensidades da luz da cena, multiplicadas pelos coeficientes dos materiais (.mtl)
+    with FrameProfiler.scope('draw'):
+        ModelManager.draw_models(
+            ka=0.3, 
+            kd=0.9, 
+            ks=0.9, 
+            ns=ns_inc,
+            view_projection=mat_projection @ mat_view
+        )
     
-    glfw.swap_buffers(GI.window)
+    with FrameProfiler.scope('swap'):
+        glfw.swap_buffers(GI.window)
+
+    if GLCounter.installed:
+        GLCounter.end_frame()
+    FrameProfiler.end_frame()
+
+    if count_gl_calls and GLCounter.frames % 100 == 0:
+        GLCounter.report()
+    if profile_frames and FrameProfiler.frame % 100 == 0:
+        glfw.set_window_title(GI.window, FrameProfiler.overlay_text())
+        FrameProfiler.export('profile.json')
 
-glfw.terminate()
\ No newline at end of file
+StreamingLoader.shutdown()
+if watcher != None:
+    watcher.shutdown()
+glfw.terminate()
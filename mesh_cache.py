@@ -0,0 +1,163 @@
+import os
+import json
+import threading
+import shutil
+import hashlib
+import uuid
+import numpy as np
+
+CACHE_VERSION = 6
+
+# Calcula o hash do conteúdo de um arquivo
+def file_hash(filepath):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class MeshCache:
+
+    "static"
+    cache_dir = 'cache'
+    enabled = True
+    hits = 0
+    misses = 0
+    lock = threading.Lock()
+
+    # Diretório da entrada do cache correspondente a um arquivo .obj
+    @staticmethod
+    def entry_dir(filepath):
+        name = os.path.relpath(os.path.abspath(filepath)).replace(os.sep, '__')
+        return os.path.join(MeshCache.cache_dir, name)
+
+    # Carrega os arrays de um .obj do cache por mmap
+    #   options -> argumentos de build_mesh usados ao gerar a entrada
+    #   Retorna None se não houver entrada válida (arquivo de origem ou options alterados)
+    #   Pode ser chamado de várias threads ao mesmo tempo
+    @staticmethod
+    def lookup(filepath, options=None):
+        if not MeshCache.enabled:
+            return None
+        mesh = MeshCache.read_entry(filepath, options)
+        with MeshCache.lock:
+            if mesh == None:
+                MeshCache.misses += 1
+            else:
+                MeshCache.hits += 1
+        return mesh
+
+    # Lê uma entrada do cache, conferindo se o arquivo de origem não mudou
+    @staticmethod
+    def read_entry(filepath, options=None):
+        entry = MeshCache.entry_dir(filepath)
+        meta_path = os.path.join(entry, 'meta.json')
+        try:
+            with open(meta_path, 'r') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION or meta.get('options') != (options or {}):
+            return None
+
+        # Tamanho e data de modificação iguais: considera o arquivo inalterado
+        # Caso contrário, compara o hash do conteúdo antes de invalidar
+        stat = os.stat(filepath)
+        if (stat.st_size, stat.st_mtime_ns) != (meta['size'], meta['mtime_ns']):
+            if stat.st_size != meta['size'] or file_hash(filepath) != meta['sha1']:
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            MeshCache.write_meta(entry, meta)
+
+        mesh = {}
+        try:
+            for name in meta['arrays']:
+                mesh[name] = np.load(os.path.join(entry, meta['files'][name]), mmap_mode='r')
+        except OSError: # Versão substituída por outro store() entre a leitura do meta.json e dos arrays
+            return None
+        return mesh
+
+    # Substitui o meta.json de uma entrada de uma vez (leitores veem o antigo ou o novo)
+    @staticmethod
+    def write_meta(entry, meta):
+        temp_path = os.path.join(entry, f'meta.json.{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temp_path, os.path.join(entry, 'meta.json'))
+
+    # Guarda os arrays de um .obj no cache
+    #   Cada versão usa arquivos com nomes novos: os arrays de versões anteriores podem
+    #   estar mapeados por read_entry (nesta ou em outra instância) e nunca são reescritos
+    @staticmethod
+    def store(filepath, mesh, options=None):
+        if not MeshCache.enabled:
+            return
+        entry = MeshCache.entry_dir(filepath)
+        os.makedirs(entry, exist_ok=True)
+        try:
+            with open(os.path.join(entry, 'meta.json'), 'r') as file:
+                previous = json.load(file)
+            previous = previous.get('files') or {name: name + '.npy' for name in previous.get('arrays', [])} # Entradas anteriores à versão 6
+        except (OSError, ValueError):
+            previous = {}
+        suffix = uuid.uuid4().hex[:12]
+        files = {name: f'{name}.{suffix}.npy' for name in mesh}
+        for name, array in mesh.items():
+            np.save(os.path.join(entry, files[name]), np.ascontiguousarray(array))
+
+        # Os metadados são escritos por último, marcando a entrada como completa
+        stat = os.stat(filepath)
+        meta = {
+            'version': CACHE_VERSION,
+            'source': filepath,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': file_hash(filepath),
+            'arrays': list(mesh.keys()),
+            'files': files,
+            'options': options or {},
+        }
+        MeshCache.write_meta(entry, meta)
+
+        # Apaga os arquivos da versão anterior; mapeamentos abertos continuam válidos
+        # (no Windows a remoção falha enquanto estiverem mapeados e eles ficam para depois)
+        for filename in set(previous.values()) - set(files.values()):
+            try:
+                os.remove(os.path.join(entry, filename))
+            except OSError:
+                pass
+
+    # Apaga o cache inteiro ou apenas a entrada de um arquivo
+    @staticmethod
+    def purge(filepath=None):
+        path = MeshCache.cache_dir if filepath == None else MeshCache.entry_dir(filepath)
+        shutil.rmtree(path, ignore_errors=True)
+
+    # Retorna e exibe as estatísticas do cache
+    @staticmethod
+    def report():
+        entries = 0
+        size = 0
+        if os.path.isdir(MeshCache.cache_dir):
+            for entry in os.listdir(MeshCache.cache_dir):
+                entry = os.path.join(MeshCache.cache_dir, entry)
+                if not os.path.exists(os.path.join(entry, 'meta.json')):
+                    continue # Outros caches no mesmo diretório (ex.: cache/shaders)
+                entries += 1
+                size += sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        stats = {'hits': MeshCache.hits, 'misses': MeshCache.misses, 'entries': entries, 'bytes': size}
+        print(f'Mesh cache: {stats["hits"]} hits, {stats["misses"]} misses, {entries} entries, {size / 2**20:.1f} MB')
+        return stats
+
+if __name__ == '__main__':
+    import sys
+    from model_manager import ModelManager
+    from mesh_cache import MeshCache # Mesma classe usada pelo ModelManager
+
+    # Uso: python mesh_cache.py [prewarm|purge|report] [modelos...]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command == 'prewarm':
+        ModelManager.prewarm_cache(sys.argv[2:] or None)
+    elif command == 'purge':
+        MeshCache.purge()
+    MeshCache.report()
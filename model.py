@@ -1,47 +1,159 @@
 import numpy as np
 import glm
 import math
+import mmap
 from OpenGL.GL import *
 from glfw_instance import GlfwInstance as GI
+from gpu_buffer import BufferArena
+from culling import world_bounds
+from scene_graph import SceneGraph
+from shader_manager import ShaderManager
 from collections import namedtuple
 
 Coord3d = namedtuple('Coord3d', 'x y z') # ? Talvez substituir por glm.vec3
 
+# Material de uma parte do modelo, lido do arquivo .mtl
+#   ka, kd, ks -> multiplicam os coeficientes da cena; ns -> multiplica o expoente
+#   texture -> Texture do material (None: usa a textura do modelo)
+Material = namedtuple('Material', 'name ka kd ks ns texture')
+DEFAULT_MATERIAL = Material(None, 1.0, 1.0, 1.0, 1.0, None)
+
+# Bytes ocupados por arrays, contando uma vez as vistas de um mesmo buffer
+#   Retorna (bytes na memória do processo, bytes mapeados de arquivos por mmap)
+def array_bytes(arrays):
+    counted = []
+    heap = mapped = 0
+    for array in arrays:
+        if array is None or any(np.may_share_memory(array, other) for other in counted):
+            continue
+        counted.append(array)
+        base = array
+        while base is not None and not isinstance(base, (np.memmap, mmap.mmap)):
+            base = getattr(base, 'base', None)
+        if base is None:
+            heap += array.nbytes
+        else:
+            mapped += array.nbytes
+    return heap, mapped
+
+# Registro de um modelo: intervalos na arena, volumes envolventes, materiais e transformação
+#   Os arrays da malha (vertices, texture_coords, normals, indices, lods) só são
+#   necessários até o envio para a GPU; release_geometry os descarta (ver
+#   ModelManager.keep_geometry para os modelos usados na colisão)
 class Model:
 
-    def __init__(self, obj, start_vertex, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0)):
-
-        self.vertices = []
-        self.texture_coords = []
-        self.normals = []
-        for face in obj['faces']:
-            for vertex_index in face[0]:
-                self.vertices.append( obj['vertices'][vertex_index-1] )
-            for texture_coord_index in face[1]:
-                self.texture_coords.append( obj['texture_coords'][texture_coord_index-1] )
-            for normal_index in face[2]:
-                self.normals.append( obj['normals'][normal_index-1] )
-        self.start_vertex = start_vertex
+    __slots__ = (
+        'vertices', 'texture_coords', 'normals', 'indices', 'packed', 'quantized', 'uv_transform',
+        'vertex_count', 'index_count', 'lods', 'lod', 'lod_ranges', 'materials', 'lod_materials', 'lod_parts',
+        'bounds_min', 'bounds_max', 'sphere_center', 'sphere_radius', 'arena', 'start_vertex', 'start_index',
+        'angle', 'r', 't', 's', 'parent', 'node', 'texture',
+    )
+
+    # Tamanho na tela (fração da metade da altura da janela) abaixo do qual cada
+    # nível de detalhe passa para o seguinte e margem para evitar trocas repetidas
+    lod_thresholds = (0.25, 0.1, 0.04)
+    lod_hysteresis = 0.15
+
+    # parent -> modelo ao qual a transformação é relativa (None: relativa ao mundo)
+    # node -> nó do grafo de cena de um modelo que este substitui (ver streaming.py)
+    def __init__(self, mesh, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0), parent=None, node=None):
+
+        self.vertices = mesh['vertices']
+        self.texture_coords = mesh['texture_coords']
+        self.normals = mesh['normals']
+        self.indices = mesh['indices']
+
+        # Vértices compactados de um arquivo .pack (ver scene_archive.py) e a transformação
+        # (x0, y0, largura, altura) que recupera as coordenadas de textura quantizadas
+        self.packed = mesh['packed'] if 'packed' in mesh else None
+        self.quantized = self.packed is not None
+        self.uv_transform = tuple(mesh['uv_transform']) if 'uv_transform' in mesh else (0.0, 0.0, 1.0, 1.0)
         self.vertex_count = len(self.vertices)
+        self.index_count = len(self.indices)
+
+        # Níveis de detalhe: índices sobre os mesmos vértices, do mais ao menos detalhado
+        self.lods = [self.indices]
+        while f'lod{len(self.lods)}' in mesh:
+            self.lods.append(mesh[f'lod{len(self.lods)}'])
+        self.lod = 0
+        self.lod_ranges = None # (índice inicial, quantidade) de cada nível na arena
+
+        # Materiais: o índice 0 é o das faces sem material e os demais seguem os nomes
+        # do .obj (ver ModelManager.read_model_dir). Os triângulos de cada nível já
+        # estão agrupados por material (ver geometry.build_mesh)
+        names = mesh['material_names'] if 'material_names' in mesh else []
+        self.materials = [DEFAULT_MATERIAL] + [DEFAULT_MATERIAL._replace(name=str(name)) for name in names]
+        self.lod_materials = [mesh['materials'] if 'materials' in mesh else np.zeros(0, dtype=np.int32)]
+        for level in range(1, len(self.lods)):
+            self.lod_materials.append(mesh[f'lod{level}_materials'] if f'lod{level}_materials' in mesh else np.zeros(0, dtype=np.int32))
+        self.lod_parts = None # (material, índice inicial, quantidade) de cada nível na arena
+
+        # Volumes envolventes no espaço do modelo: caixa alinhada aos eixos e esfera
+        if self.vertex_count > 0:
+            self.bounds_min = np.asarray(self.vertices).min(axis=0).astype(np.float64)
+            self.bounds_max = np.asarray(self.vertices).max(axis=0).astype(np.float64)
+        else:
+            self.bounds_min = np.zeros(3)
+            self.bounds_max = np.zeros(3)
+        self.sphere_center = (self.bounds_min + self.bounds_max) / 2
+        self.sphere_radius = float(np.linalg.norm(self.vertices - self.sphere_center, axis=1).max()) if self.vertex_count > 0 else 0.0
+
+        # Definidos quando o modelo é enviado para uma BufferArena
+        self.arena = None
+        self.start_vertex = None
+        self.start_index = None
         
         self.angle = angle
         self.r = r
         self.t = t
         self.s = s
 
+        # Nó do grafo de cena que guarda as matrizes local e do mundo
+        self.parent = parent
+        self.node = node if node != None else SceneGraph.add(angle, r, t, s, parent.node if parent != None else -1)
+
         self.texture = None
     
     def add_texture(self, texture):
         self.texture = texture
 
+    # Descarta os arrays da malha (os dados continuam na arena da GPU)
+    def release_geometry(self):
+        self.vertices = None
+        self.texture_coords = None
+        self.normals = None
+        self.packed = None
+        self.indices = None
+        self.lods = None
+        self.lod_materials = None
+
+    # Os arrays da malha ainda estão na memória (necessários para colisão e scatter_on_model)
+    def has_geometry(self):
+        return self.vertices is not None
+
+    def require_geometry(self):
+        if not self.has_geometry():
+            raise RuntimeError('Model geometry was released after the upload; add the model to ModelManager.keep_geometry')
+
+    # Memória ocupada pelo modelo: arrays na CPU (na memória do processo e mapeados
+    # de arquivos) e geometria na GPU; as texturas são compartilhadas e contadas à parte
+    def memory(self):
+        lods = self.lods if self.lods != None else []
+        lod_materials = self.lod_materials if self.lod_materials != None else []
+        cpu, mapped = array_bytes([self.vertices, self.texture_coords, self.normals, self.packed, self.indices, *lods, *lod_materials])
+        gpu = 0
+        if self.arena != None:
+            gpu = self.vertex_count * self.arena.vertex_size + sum(count for _, count in self.lod_ranges) * 4
+        return {'cpu_bytes': cpu, 'mapped_bytes': mapped, 'gpu_bytes': gpu}
+
+    # Texturas usadas pelo modelo (a do modelo e as dos materiais)
+    def textures(self):
+        textures = [self.texture] + [material.texture for material in self.materials]
+        return [texture for texture in dict.fromkeys(textures) if texture not in (None, 0)]
+
+    # Matriz do mundo (já multiplicada pelas matrizes dos pais), calculada pelo grafo de cena
     def model_matrix(self):
-        angle_rad = math.radians(self.angle)
-        matrix_transform = glm.mat4(1.0) # Matriz identidade
-        matrix_transform = glm.translate(matrix_transform, glm.vec3(self.t.x, self.t.y, self.t.z)) # Translação
-        matrix_transform = glm.rotate(matrix_transform, angle_rad, glm.vec3(self.r.x, self.r.y, self.r.z)) # Rotação
-        matrix_transform = glm.scale(matrix_transform, glm.vec3(self.s.x, self.s.y, self.s.z)) # Escala
-        matrix_transform = np.array(matrix_transform)
-        return matrix_transform
+        return SceneGraph.world_matrix(self.node)
     
     def transform(self, r=None, t=None, s=None):
         if r != None:
@@ -50,66 +162,250 @@ class Model:
             self.t = t
         if s != None:
             self.s = s
+        SceneGraph.set_transform(self.node, r=r, t=t, s=s)
     
     def rotate(self, angle):
         self.angle = angle
+        SceneGraph.set_transform(self.node, angle=angle)
+
+    # Escolhe o nível de detalhe a partir do tamanho do modelo na tela
+    #   A troca só acontece quando o tamanho ultrapassa o limite com uma margem
+    def select_lod(self, size):
+        level = self.lod
+        thresholds = Model.lod_thresholds
+        while level + 1 < len(self.lod_ranges) and level < len(thresholds) and size < thresholds[level] * (1 - Model.lod_hysteresis):
+            level += 1
+        while level > 0 and size > thresholds[level - 1] * (1 + Model.lod_hysteresis):
+            level -= 1
+        self.lod = level
+        return level
+
+    # Quantidade de triângulos desenhados no nível de detalhe atual
+    def triangle_count(self):
+        return self.lod_ranges[self.lod][1] // 3
+
+    # Divide o intervalo de cada nível em partes contíguas de mesmo material
+    #   Chamado quando o modelo é enviado para a arena (ver BufferArena.upload)
+    def build_parts(self):
+        self.lod_parts = []
+        for (start_index, index_count), materials in zip(self.lod_ranges, self.lod_materials):
+            materials = np.asarray(materials)
+            if len(materials) * 3 != index_count or index_count == 0:
+                self.lod_parts.append([(0, start_index, index_count)])
+                continue
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(materials)) + 1])
+            ends = np.append(starts[1:], len(materials))
+            self.lod_parts.append([
+                (int(materials[first]), start_index + 3 * int(first), 3 * int(last - first))
+                for first, last in zip(starts, ends)
+            ])
+
+    # Partes (material, índice inicial, quantidade) do nível de detalhe atual
+    def parts(self):
+        return self.lod_parts[self.lod]
+
+    # Renderiza os triângulos do modelo a partir do buffer de índices
+    #   start_index, index_count -> intervalo a desenhar (todo o nível atual por padrão)
+    def draw_elements(self, start_index=None, index_count=None):
+        self.arena.bind()
+        GI.shader.set_int("instanced", 0)
+        if start_index == None:
+            start_index, index_count = self.lod_ranges[self.lod]
+        offset = ctypes.c_void_p(start_index * 4) # Índices de 32 bits
+        glDrawElements(GL_TRIANGLES, index_count, GL_UNSIGNED_INT, offset)
     
-    # Desenha o modelo
-    #   ka -> Coeficiente de reflexao ambiente do modelo
-    #   kd -> Coeficiente de reflexao difusa do modelo
-    #   ks -> Coeficiente de reflexao especular do modelo
-    #   ns -> Expoente de reflexao especular
+    # Coeficientes (ka, kd, ks, ns) de um material do modelo
+    #   Os coeficientes da cena são multiplicados pelos valores do .mtl
+    def material(self, index, ka, kd, ks, ns):
+        material = self.materials[index]
+        return (ka * material.ka, kd * material.kd, ks * material.ks, ns * material.ns)
+
+    # Textura de um material (None mantém a textura atual)
+    def draw_texture(self, index):
+        texture = self.materials[index].texture
+        return texture if texture != None else self.texture
+
+    # Variante do shader de um material (ver shader_manager.py)
+    #   Materiais sem textura (draw_texture igual a 0) não amostram textura e
+    #   modelos do arquivo .pack decodificam os vértices compactados
+    def shader_defines(self, index):
+        defines = () if self.draw_texture(index) == 0 else ('TEXTURED',)
+        return defines + ('QUANTIZED',) if self.quantized else defines
+
+    def shader(self, index):
+        return ShaderManager.get(*self.shader_defines(index))
+
+    # Ativa uma textura retornada por draw_texture
+    @staticmethod
+    def bind_texture(texture):
+        if texture == 0:
+            glBindTexture(GL_TEXTURE_2D, 0)
+        elif texture != None:
+            texture.bind()
+
+    # Desenha o modelo, com uma chamada por material
+    #   ka -> Coeficiente de reflexao ambiente da cena
+    #   kd -> Coeficiente de reflexao difusa da cena
+    #   ks -> Coeficiente de reflexao especular da cena
+    #   ns -> Expoente de reflexao especular da cena
     def draw(self, ka, kd, ks, ns):
 
         mat_model = self.model_matrix()
-        loc_model = glGetUniformLocation(GI.program, "model")
-        glUniformMatrix4fv(loc_model, 1, GL_TRUE, mat_model)
-        
-        ka = 0.1 # Coeficiente de reflexao ambiente do modelo
-        kd = 0.1 # Coeficiente de reflexao difusa do modelo
-        ks = 0.9 # Coeficiente de reflexao especular do modelo
-        ns = ns # Expoente de reflexao especular
-        
-        # Recupera localização das variáveis na GPU
-        loc_ka = glGetUniformLocation(GI.program, "ka")
-        loc_kd = glGetUniformLocation(GI.program, "kd")
-        loc_ks = glGetUniformLocation(GI.program, "ks")
-        loc_ns = glGetUniformLocation(GI.program, "ns")
-        
-        # Insere o valor das variáveis
-        glUniform1f(loc_ka, ka)
-        glUniform1f(loc_kd, kd)
-        glUniform1f(loc_ks, ks)
-        glUniform1f(loc_ns, ns)
-        
-        if self.texture != None:
-            glBindTexture(GL_TEXTURE_2D, self.texture) # Define id da textura do modelo
 
-        glDrawArrays(GL_TRIANGLES, self.start_vertex, self.vertex_count) # Renderiza
+        for material, start_index, index_count in self.parts():
+            GI.use(self.shader(material)) # Variante do shader do material
+            GI.shader.set_mat4("model", mat_model)
+            GI.shader.set_vec4("uv_transform", *self.uv_transform)
+
+            # Insere o valor das variáveis (localizações resolvidas em GI.shader)
+            material_ka, material_kd, material_ks, material_ns = self.material(material, ka, kd, ks, ns)
+            GI.shader.set_float("ka", material_ka)
+            GI.shader.set_float("kd", material_kd)
+            GI.shader.set_float("ks", material_ks)
+            GI.shader.set_float("ns", material_ns)
+
+            Model.bind_texture(self.draw_texture(material)) # Define a textura do material
+            self.draw_elements(start_index, index_count) # Renderiza
 
+# Fonte de luz: desenhada com a variante emissiva do shader e sem textura se não tiver uma
 class LightModel(Model):
 
-    def draw(self, ka, kd, ks, ns):
-        
-        mat_model = self.model_matrix()
-        loc_model = glGetUniformLocation(GI.program, "model")
-        glUniformMatrix4fv(loc_model, 1, GL_TRUE, mat_model)
-        
-        # Recupera localização das variáveis na GPU
-        loc_ka = glGetUniformLocation(GI.program, "ka")
-        loc_kd = glGetUniformLocation(GI.program, "kd")
-        loc_ks = glGetUniformLocation(GI.program, "ks")
-        loc_ns = glGetUniformLocation(GI.program, "ns")
-        
-        # Insere o valor das variáveis
-        glUniform1f(loc_ka, ka)
-        glUniform1f(loc_kd, kd)
-        glUniform1f(loc_ks, ks)
-        glUniform1f(loc_ns, ns)
-
-        # Se objeto produzir luz, inserir luz
-        loc_light_pos = glGetUniformLocation(GI.program, "lightPos") # Localizacao da variavel lightPos na GPU
-        glUniform3f(loc_light_pos, self.t.x, self.t.y, self.t.z) # Define a posição da luz
-        
-        glBindTexture(GL_TEXTURE_2D, self.texture) # Define id da textura do modelo
-        glDrawArrays(GL_TRIANGLES, self.start_vertex, self.vertex_count) # Renderiza
\ No newline at end of file
+    __slots__ = ()
+
+    # Posição da luz no mundo, enviada a GPU no bloco de dados do quadro
+    def light_position(self):
+        return Coord3d(*self.model_matrix()[:3, 3])
+
+    def material(self, index, ka, kd, ks, ns):
+        return (ka, kd, ks, ns)
+
+    def draw_texture(self, index):
+        texture = super().draw_texture(index)
+        return texture if texture != None else 0
+
+    def shader_defines(self, index):
+        return super().shader_defines(index) + ('EMISSIVE',)
+
+# Malha desenhada várias vezes em uma única chamada, com uma matriz model por instância
+#   As matrizes ficam em um buffer de instâncias ligado a um VAO próprio, que
+#   reaproveita os buffers de vértices e índices da arena
+#   A matriz model do próprio objeto (angle, r, t, s) é aplicada a todas as instâncias
+class InstancedModel(Model):
+
+    __slots__ = ('mesh_bounds_min', 'mesh_bounds_max', 'vao', 'arena_generation', 'instance_buffer', 'instance_capacity', 'instance_matrices')
+
+    def __init__(self, mesh, transforms, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0), parent=None):
+        super().__init__(mesh, angle, r, t, s, parent)
+        self.mesh_bounds_min = self.bounds_min
+        self.mesh_bounds_max = self.bounds_max
+        self.vao = None
+        self.arena_generation = None
+        self.instance_buffer = glGenBuffers(1)
+        self.instance_capacity = 0
+        self.instance_matrices = np.zeros((0, 4, 4), dtype=np.float32)
+        self.set_instances(transforms)
+
+    @property
+    def instance_count(self):
+        return len(self.instance_matrices)
+
+    # Converte as transformações (array (n, 4, 4) ou iterável de matrizes) em float32
+    @staticmethod
+    def as_matrices(transforms):
+        if not isinstance(transforms, np.ndarray):
+            transforms = [np.asarray(matrix) for matrix in transforms]
+        return np.asarray(transforms, dtype=np.float32).reshape(-1, 4, 4)
+
+    # Envia um intervalo de matrizes ao buffer de instâncias
+    #   As colunas de cada matriz são atributos consecutivos no shader
+    def upload_instances(self, start, count):
+        data = np.ascontiguousarray(self.instance_matrices[start:start + count].transpose(0, 2, 1))
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, start * 64, data.nbytes, data)
+
+    # Substitui todas as instâncias
+    def set_instances(self, transforms):
+        self.instance_matrices = InstancedModel.as_matrices(transforms)
+        if self.instance_count > self.instance_capacity:
+            self.instance_capacity = max(self.instance_count, 2 * self.instance_capacity)
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.instance_capacity * 64, None, GL_DYNAMIC_DRAW)
+        self.upload_instances(0, self.instance_count)
+        self.update_bounds()
+
+    # Acrescenta instâncias ao final
+    def add_instances(self, transforms):
+        start = self.instance_count
+        matrices = InstancedModel.as_matrices(transforms)
+        if start + len(matrices) > self.instance_capacity:
+            self.set_instances(np.concatenate([self.instance_matrices, matrices]))
+            return
+        self.instance_matrices = np.concatenate([self.instance_matrices, matrices])
+        self.upload_instances(start, len(matrices))
+        self.update_bounds()
+
+    # Altera as instâncias a partir de start, enviando apenas o intervalo alterado
+    def update_instances(self, start, transforms):
+        matrices = InstancedModel.as_matrices(transforms)
+        end = start + len(matrices)
+        if end > self.instance_count:
+            self.instance_matrices = np.concatenate([self.instance_matrices[:start], matrices])
+            if end > self.instance_capacity:
+                self.set_instances(self.instance_matrices)
+                return
+        else:
+            self.instance_matrices[start:end] = matrices
+        self.upload_instances(start, len(matrices))
+        self.update_bounds()
+
+    # Volumes envolventes de todas as instâncias juntas, usados no descarte pelo frustum
+    def update_bounds(self):
+        if self.instance_count == 0:
+            self.bounds_min = self.bounds_max = self.sphere_center = np.zeros(3)
+            self.sphere_radius = 0.0
+            return
+        count = self.instance_count
+        centers, extents, _, _ = world_bounds(
+            self.instance_matrices.astype(np.float64),
+            np.tile(self.mesh_bounds_min, (count, 1)),
+            np.tile(self.mesh_bounds_max, (count, 1)),
+            np.zeros((count, 3)),
+            np.zeros(count),
+        )
+        self.bounds_min = (centers - extents).min(axis=0)
+        self.bounds_max = (centers + extents).max(axis=0)
+        self.sphere_center = (self.bounds_min + self.bounds_max) / 2
+        self.sphere_radius = float(np.linalg.norm(self.bounds_max - self.bounds_min) / 2)
+
+    # Ativa o VAO do modelo, refazendo-o se os buffers da arena foram recriados
+    def bind(self):
+        if self.vao == None:
+            self.vao = glGenVertexArrays(1)
+        if self.arena_generation != self.arena.generation:
+            glBindVertexArray(self.vao)
+            self.arena.setup_attributes()
+            BufferArena.setup_instance_attribute(self.instance_buffer)
+            self.arena_generation = self.arena.generation
+            BufferArena.bound = self
+        elif BufferArena.bound is not self:
+            glBindVertexArray(self.vao)
+            BufferArena.bound = self
+
+    def triangle_count(self):
+        return super().triangle_count() * self.instance_count
+
+    def memory(self):
+        memory = super().memory()
+        memory['cpu_bytes'] += self.instance_matrices.nbytes
+        memory['gpu_bytes'] += self.instance_capacity * 64
+        return memory
+
+    def draw_elements(self, start_index=None, index_count=None):
+        if self.instance_count == 0:
+            return
+        self.bind()
+        GI.shader.set_int("instanced", 1)
+        if start_index == None:
+            start_index, index_count = self.lod_ranges[self.lod]
+        offset = ctypes.c_void_p(start_index * 4)
+        glDrawElementsInstanced(GL_TRIANGLES, index_count, GL_UNSIGNED_INT, offset, self.instance_count)
@@ -1,158 +1,542 @@
 import os
+import time
 import numpy as np
-import io
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from OpenGL.GL import *
-from PIL import Image
 from model import *
+from geometry import build_mesh
+from mesh_cache import MeshCache
+from gpu_buffer import BufferArena, PACKED_FORMAT
+from texture_manager import TextureManager
+from shader_manager import ShaderManager, QUANTIZED_VARIANTS
+from scene_archive import SceneArchive
+from lights import LightList, LightClusters
+from profiler import FrameProfiler
+from scene_graph import SceneGraph
+from render_queue import RenderQueue
+from culling import frustum_planes, world_bounds, visible, screen_sizes
 from glfw_instance import GlfwInstance as GI
 
+# Converte um grupo de registros numéricos ("x y z", ...) em um array (n, width)
+def parse_float_records(records, width):
+    if not records:
+        return np.zeros((0, width), dtype=np.float32)
+    values = np.array(' '.join(records).split(), dtype=np.float64)
+    if values.size != len(records) * width: # Linhas com componentes extras (ex.: "v x y z w")
+        values = np.array([record.split()[:width] for record in records], dtype=np.float64)
+    return values.reshape(-1, width).astype(np.float32)
+
+# Converte os vértices das faces ("v/vt/vn", "v//vn", "v/vt" ou "v") em um array (n, 3) de índices
+#   Índices ausentes são representados por 0
+def parse_face_corners(corners):
+    if not corners:
+        return np.zeros((0, 3), dtype=np.int32)
+    text = ' '.join(corners).replace('//', '/0/')
+    if text.count('/') == 2 * len(corners): # Caso comum: todos os vértices no formato v/vt/vn
+        indices = np.array(text.replace('/', ' ').split(), dtype=np.int64)
+    else:
+        indices = []
+        for corner in text.split():
+            w = corner.split('/') + ['0', '0']
+            indices += [w[0], w[1] or '0', w[2] or '0']
+        indices = np.array(indices, dtype=np.int64)
+    return indices.reshape(-1, 3).astype(np.int32)
+
 # Carrega os dados de um arquivo .obj
+#   O arquivo é lido de uma vez, os registros são agrupados pelo prefixo e
+#   convertidos em bloco para arrays float32/int32
 def load_obj(filepath):
 
-    vertices = []
-    normals = []
-    texture_coords = []
-    faces = []
-    material = None
+    records = {'v': [], 'vt': [], 'vn': [], 'f': []}
+    materials = []
+    material_changes = [] # (primeira face, índice do material)
 
-    for line in open(filepath, "r"): # para cada linha do arquivo .obj
-        if line.startswith('#'): # Comentários
-            continue
-        values = line.split() # quebra a linha por espaço
-        if not values:
+    with open(filepath, 'r') as file:
+        lines = file.read().splitlines()
+
+    for line in lines:
+        values = line.split(None, 1) # separa o prefixo do restante da linha
+        if len(values) < 2 or values[0].startswith('#'): # Comentários e linhas vazias
             continue
-        if values[0] == 'v': # Vertices
-            vertices.append(values[1:4])
-        if values[0] == 'vn': # Normais
-            normals.append(values[1:4])
-        elif values[0] == 'vt': # Vertices das texturas
-            texture_coords.append(values[1:3])
-        elif values[0] in ('usemtl', 'usemat'): # Materiais
-            material = values[1]
-        elif values[0] == 'f': # Faces
-            face = []
-            face_texture = []
-            face_normals = []
-            for v in values[1:]:
-                w = v.split('/')
-                face.append(int(w[0]))
-                face_normals.append(int(w[2]))
-                if len(w) >= 2 and len(w[1]) > 0:
-                    face_texture.append(int(w[1]))
-                else:
-                    face_texture.append(0)
-            faces.append((face, face_texture, face_normals, material))
+        prefix, rest = values
+        if prefix in records:
+            records[prefix].append(rest)
+        elif prefix in ('usemtl', 'usemat'): # Materiais
+            material = rest.strip()
+            if material not in materials:
+                materials.append(material)
+            material_changes.append((len(records['f']), materials.index(material)))
+
+    faces = records['f']
+    corners = ' '.join(faces).split()
+    face_sizes = np.array([len(face.split()) for face in faces], dtype=np.int32)
+
+    # Material de cada face (-1 para faces sem material)
+    face_materials = np.full(len(faces), -1, dtype=np.int32)
+    for first_face, material_index in material_changes:
+        face_materials[first_face:] = material_index
 
     obj = {}
-    obj['vertices'] = vertices
-    obj['normals'] = normals
-    obj['texture_coords'] = texture_coords
-    obj['faces'] = faces
+    obj['vertices'] = parse_float_records(records['v'], 3)
+    obj['normals'] = parse_float_records(records['vn'], 3)
+    obj['texture_coords'] = parse_float_records(records['vt'], 2)
+    obj['indices'] = parse_face_corners(corners) # Colunas: v, vt, vn (a partir de 1)
+    obj['face_sizes'] = face_sizes
+    obj['face_materials'] = face_materials
+    obj['materials'] = materials
 
     return obj
 
-# Carrega uma imagem de textura
-def load_texture(texture_id, img_filepath):
-    glBindTexture(GL_TEXTURE_2D, texture_id)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    img = Image.open(img_filepath)
-    img_width = img.size[0]
-    img_height = img.size[1]
-    img = img.convert('RGB') # Caso seja .png
-    image_data = img.tobytes("raw", "RGB", 0, -1)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, img_width, img_height, 0, GL_RGB, GL_UNSIGNED_BYTE, image_data)
+# Carrega os materiais de um arquivo .mtl
+#   Retorna {nome: Material}; as cores Ka, Kd e Ks viram a média dos seus componentes,
+#   já que o shader usa coeficientes escalares. Valores ausentes valem 1 (neutros)
+#   map_Kd guarda apenas o nome do arquivo, procurado no diretório do modelo
+def load_mtl(filepath):
+    materials = {}
+    name = None
+    with open(filepath, 'r') as file:
+        lines = file.read().splitlines()
+    for line in lines:
+        values = line.split(None, 1)
+        if len(values) < 2 or values[0].startswith('#'):
+            continue
+        prefix, rest = values
+        if prefix == 'newmtl':
+            name = rest.strip()
+            materials[name] = DEFAULT_MATERIAL._replace(name=name)
+        elif name == None:
+            continue
+        elif prefix in ('Ka', 'Kd', 'Ks'):
+            value = float(np.mean(np.array(rest.split()[:3], dtype=np.float64)))
+            materials[name] = materials[name]._replace(**{prefix.lower(): value})
+        elif prefix == 'Ns':
+            materials[name] = materials[name]._replace(ns=float(rest.split()[0]))
+        elif prefix == 'map_Kd':
+            materials[name] = materials[name]._replace(texture=os.path.basename(rest.strip().replace('\\', '/')))
+    return materials
+
+# Indica se uma imagem é um mapa de normais (não serve como textura de cor)
+def is_normal_map(filepath):
+    stem = os.path.splitext(os.path.basename(filepath))[0].lower()
+    return '-nm' in stem or '_nm' in stem or 'normal' in stem
 
 class ModelManager:
 
     "static"
     main_dir = 'models'
     models = {}
-    vertices = []
-    texture_coords = []
-    normals = []
-    vertex_count = 0
-    texture_count = 0
+    arena = None # Criada em send_to_GPU
+    packed_arena = None # Arena com os vértices compactados dos modelos do arquivo .pack
+    archive = None # SceneArchive aberto por use_archive
+    pending = [] # (nome, modelo) ainda não enviados para a GPU
+    release_arrays = True # Descarta os arrays das malhas depois do envio para a GPU
+    keep_geometry = set() # Modelos cujos arrays são mantidos (ex.: colisão, ver scenes.py)
+    culling = True # Descarta modelos fora do frustum da câmera
+    lod = True # Escolhe o nível de detalhe pelo tamanho do modelo na tela
+    drawn_count = 0 # Modelos desenhados no último quadro
+    draw_call_count = 0 # Chamadas de desenho do último quadro (lotes da RenderQueue ou partes dos modelos)
+    culled_count = 0 # Modelos descartados no último quadro
+    triangle_count = 0 # Triângulos desenhados no último quadro
+    sort_draws = True # Ordena os desenhos por estado e agrupa em lotes (ver render_queue.py)
+    queue = None # RenderQueue, criada no primeiro quadro
+    lights = LightList() # Luzes pontuais da cena (ver lights.py)
+    clusters = None # LightClusters, criado na primeira chamada de update_lights com luzes
+    mesh_options = {'normals': 'smooth', 'weighting': 'angle', 'tangents': False} # Argumentos de geometry.build_mesh
 
-    # Carrega um modelo
+    # Carrega os arrays de um .obj, usando o cache em disco quando o arquivo e
+    # mesh_options não mudaram
+    @staticmethod
+    def load_mesh(filepath):
+        mesh = MeshCache.lookup(filepath, ModelManager.mesh_options)
+        if mesh == None:
+            mesh = build_mesh(load_obj(filepath), **ModelManager.mesh_options)
+            MeshCache.store(filepath, mesh, ModelManager.mesh_options)
+        return mesh
+
+    # Preenche o cache com os .obj dos modelos (todos os diretórios de main_dir por padrão)
+    #   Não depende de contexto OpenGL
+    @staticmethod
+    def prewarm_cache(model_dirs=None):
+        if model_dirs == None:
+            model_dirs = sorted(os.listdir(ModelManager.main_dir))
+        for model_dir in model_dirs:
+            model_dir = os.path.join(ModelManager.main_dir, model_dir)
+            for filepath in os.listdir(model_dir):
+                if filepath.endswith('.obj'):
+                    ModelManager.load_mesh(os.path.join(model_dir, filepath))
+
+    # Passa a ler os modelos presentes em um arquivo .pack (ver scene_archive.py) em
+    # vez dos arquivos de models/; os demais continuam sendo lidos normalmente
+    @staticmethod
+    def use_archive(path):
+        ModelManager.archive = SceneArchive(path)
+        ShaderManager.preload(QUANTIZED_VARIANTS)
+        print(f'Using archive {path} ({len(ModelManager.archive.toc["models"])} models)')
+
+    @staticmethod
+    def in_archive(model_dir):
+        return ModelManager.archive != None and model_dir in ModelManager.archive
+
+    # Lê o .obj, os materiais (.mtl) e as texturas do diretório de um modelo
+    #   create -> função que recebe a malha do .obj e cria o modelo
+    #   jobs -> resultados já em andamento (Future) de load_mesh/TextureManager.read por arquivo
+    #   loaded -> {arquivo: Texture} de texturas já carregadas (ex.: pelo StreamingLoader)
+    #   textures -> {material: arquivo} para materiais cujo .mtl não indica a textura
+    #   materials -> {material: {ka, kd, ks, ns}} que substituem os valores do .mtl
+    #   Modelos do arquivo .pack (ver use_archive) vêm do arquivo mapeado, sem jobs
     @staticmethod
-    def load_model(model_dir, light_source=False, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0)):
+    def read_model_dir(model_dir, create, jobs=None, textures=None, materials=None, loaded=None):
+        overrides = materials
+        if ModelManager.in_archive(model_dir):
+            print(f'Loading model {model_dir} from {ModelManager.archive.path}')
+            model = create(ModelManager.archive.mesh(model_dir))
+            materials, images = ModelManager.archive.model_files(model_dir, os.path.join(ModelManager.main_dir, model_dir))
+            materials = {name: Material(name, *values) for name, values in materials.items()}
+            return ModelManager.assign_materials(model, materials, images, textures, overrides)
+
         print(f'Loading model {model_dir}')
-        model_name = model_dir
         model_dir = os.path.join(ModelManager.main_dir, model_dir)
-        texture = None
+        model = None
+        images = {}
+        materials = {}
         for filepath in os.listdir(model_dir):
             print(f'\tLoading {filepath}')
             filepath = os.path.join(model_dir, filepath)
 
             # Carregamento de arquivo .obj
             if filepath.endswith('.obj'):
-                obj = load_obj(filepath)
-                start_vertex = ModelManager.vertex_count
-                if not light_source:
-                    model = Model(obj, start_vertex, angle, r, t, s)
+                if jobs != None and filepath in jobs:
+                    mesh = jobs[filepath].result()
                 else:
-                    model = LightModel(obj, start_vertex, angle, r, t, s)
-                ModelManager.vertex_count += model.vertex_count
+                    mesh = ModelManager.load_mesh(filepath)
+                model = create(mesh)
+
+            # Materiais (o nome em mtllib nem sempre corresponde ao arquivo, então
+            # todos os .mtl do diretório são lidos)
+            elif filepath.endswith('.mtl'):
+                materials.update(load_mtl(filepath))
             
-            # Carregamento de textura
+            # Carregamento de textura (texturas com o mesmo conteúdo são compartilhadas)
             elif filepath.endswith(('.jpg', '.png')):
-                load_texture(ModelManager.texture_count, filepath)
-                texture = ModelManager.texture_count
-                ModelManager.texture_count += 1
-        
-        if texture != None:
-            model.add_texture(texture)
-        
-        # Adiciona o modelo na lista e guarda suas informações
+                if loaded != None and filepath in loaded:
+                    images[os.path.basename(filepath)] = loaded[filepath]
+                elif jobs != None and filepath in jobs:
+                    images[os.path.basename(filepath)] = TextureManager.load(filepath, *jobs[filepath].result())
+                else:
+                    images[os.path.basename(filepath)] = TextureManager.load(filepath)
+
+        if model == None:
+            raise FileNotFoundError(f'No .obj file found in {model_dir}')
+        return ModelManager.assign_materials(model, materials, images, textures, overrides)
+
+    # Define a textura do modelo e os materiais de cada parte
+    #   materials -> {nome: Material} lidos dos .mtl
+    #   images -> {arquivo: Texture} das imagens do diretório, na ordem em que foram lidas
+    #   A textura de cada material vem de textures, do map_Kd do .mtl ou de uma imagem
+    #   cujo nome contém o nome do material; sem nenhuma delas, o material usa a
+    #   textura do modelo (a última imagem do diretório que não é um mapa de normais)
+    #   overrides -> {material: {ka, kd, ks, ns}} aplicados sobre os valores do .mtl
+    @staticmethod
+    def assign_materials(model, materials, images, textures=None, overrides=None):
+        colors = [image for filename, image in images.items() if not is_normal_map(filename)]
+        if colors:
+            model.add_texture(colors[-1])
+
+        textures = textures or {}
+        overrides = overrides or {}
+        for index, material in enumerate(model.materials):
+            if material.name == None:
+                continue
+            material = materials.get(material.name, material)._replace(**overrides.get(material.name, {}))
+            filename = textures.get(material.name, material.texture)
+            if filename not in images:
+                matches = [image for image in sorted(images) if material.name.lower() in image.lower() and not is_normal_map(image)]
+                filename = matches[0] if matches else None
+            model.materials[index] = material._replace(texture=images.get(filename))
+        return model
+
+    # Adiciona o modelo na lista e guarda suas informações
+    @staticmethod
+    def add_model(model_name, model):
         ModelManager.models[model_name] = model
-        ModelManager.vertices += model.vertices
-        ModelManager.texture_coords += model.texture_coords
-        ModelManager.normals += model.normals
+
+        # Depois de send_to_GPU os modelos são enviados assim que carregados
+        ModelManager.pending.append((model_name, model))
+        if ModelManager.arena != None:
+            ModelManager.send_to_GPU()
+
+    # Remove um modelo da cena, liberando seu espaço na arena
+    #   Os nós filhos continuam no grafo de cena, presos ao nó do modelo removido
+    @staticmethod
+    def remove_model(model_name):
+        model = ModelManager.models.pop(model_name)
+        ModelManager.pending = [(name, pending) for name, pending in ModelManager.pending if pending is not model]
+        if model.arena != None:
+            model.arena.free(model)
+        return model
+
+    # Troca um modelo da cena por uma nova versão (ex.: .obj alterado, ver hot_reload.py)
+    #   A geometria nova é escrita no intervalo da antiga quando cabe nele (ver
+    #   BufferArena.replace); os demais modelos da arena não são tocados
+    @staticmethod
+    def replace_model(model_name, model):
+        old = ModelManager.models[model_name]
+        if ModelManager.arena == None or old.arena == None:
+            ModelManager.remove_model(model_name)
+            ModelManager.add_model(model_name, model)
+            return model
+        arena = ModelManager.arena_for(model)
+        if old.arena is arena:
+            arena.replace(old, model)
+        else:
+            old.arena.free(old)
+            arena.upload(model)
+        ModelManager.release_geometry(model_name, model)
+        ModelManager.models[model_name] = model
+        return model
+
+    # Carrega um modelo
+    #   parent -> nome de um modelo já carregado; a transformação passa a ser relativa a ele
+    #   name -> nome do modelo na cena (o nome do diretório por padrão)
+    @staticmethod
+    def load_model(model_dir, light_source=False, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0), parent=None, textures=None, materials=None, name=None):
+        model_class = LightModel if light_source else Model
+        parent = ModelManager.models[parent] if parent != None else None
+        model = ModelManager.read_model_dir(model_dir, lambda mesh: model_class(mesh, angle, r, t, s, parent), textures=textures, materials=materials)
+        ModelManager.add_model(name or model_dir, model)
+        return model
+
+    # Inicia a leitura do .obj e a decodificação das texturas de um modelo em um executor
+    #   jobs -> dicionário arquivo -> Future, preenchido com os arquivos do modelo
+    @staticmethod
+    def submit_jobs(executor, model_dir, jobs):
+        if ModelManager.in_archive(model_dir):
+            return jobs # Lido do arquivo mapeado, sem decodificação
+        model_dir = os.path.join(ModelManager.main_dir, model_dir)
+        for filepath in os.listdir(model_dir):
+            filepath = os.path.join(model_dir, filepath)
+            if filepath.endswith('.obj'):
+                jobs[filepath] = executor.submit(ModelManager.load_mesh, filepath)
+            elif filepath.endswith(('.jpg', '.png')):
+                jobs[filepath] = executor.submit(TextureManager.read, filepath)
+        return jobs
+
+    # Carrega vários modelos, lendo as malhas e decodificando as texturas em paralelo
+    #   models -> lista de (model_dir, argumentos de load_model)
+    #   processes -> usa processos em vez de threads (a leitura dos .obj não fica
+    #   limitada pelo GIL, mas os contadores do MeshCache dos processos se perdem)
+    #   Apenas os envios para a GPU acontecem na thread que possui o contexto OpenGL
+    @staticmethod
+    def load_models(models, workers=None, processes=False):
+        start = time.perf_counter()
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            jobs = {}
+            for model_dir, _ in models:
+                ModelManager.submit_jobs(executor, model_dir, jobs)
+
+            # Cria os modelos na ordem pedida, conforme os arquivos ficam prontos
+            loaded = []
+            for model_dir, kwargs in models:
+                light_source = kwargs.get('light_source', False)
+                transform = {key: value for key, value in kwargs.items() if key not in ('light_source', 'textures', 'materials', 'name')}
+                if transform.get('parent') != None:
+                    transform['parent'] = ModelManager.models[transform['parent']]
+                model_class = LightModel if light_source else Model
+                model = ModelManager.read_model_dir(model_dir, lambda mesh: model_class(mesh, **transform), jobs, kwargs.get('textures'), kwargs.get('materials'))
+                ModelManager.add_model(kwargs.get('name', model_dir), model)
+                loaded.append(model)
+        print(f'Loaded {len(models)} models in {time.perf_counter() - start:.2f} s')
+        return loaded
+
+    # Carrega um modelo uma única vez e o desenha em várias posições com instanciação
+    #   transforms -> matrizes model (n, 4, 4) das instâncias (ver instancing.py)
+    #   name -> nome do modelo na cena (o nome do diretório por padrão)
+    @staticmethod
+    def load_instanced_model(model_dir, transforms, name=None, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0), parent=None, textures=None):
+        parent = ModelManager.models[parent] if parent != None else None
+        model = ModelManager.read_model_dir(model_dir, lambda mesh: InstancedModel(mesh, transforms, angle, r, t, s, parent), textures=textures)
+        ModelManager.add_model(name or model_dir, model)
+        return model
     
+    # Arena do formato dos vértices de um modelo (a compacta é criada quando necessária)
+    @staticmethod
+    def arena_for(model):
+        if not model.quantized:
+            return ModelManager.arena
+        if ModelManager.packed_arena == None:
+            ModelManager.packed_arena = BufferArena(max(model.vertex_count, 1), max(sum(len(lod) for lod in model.lods), 1), PACKED_FORMAT)
+        return ModelManager.packed_arena
+
+    # Envia os modelos pendentes para a arena de buffers da GPU
+    #   Na primeira chamada a arena é criada com espaço para todos os modelos
+    #   carregados até então; as chamadas seguintes apenas acrescentam dados
+    #   Modelos do arquivo .pack vão para a arena compacta, direto do arquivo mapeado
     def send_to_GPU():
+        if ModelManager.arena == None:
+            for packed in (False, True):
+                models = [model for _, model in ModelManager.pending if model.quantized == packed]
+                vertex_count = sum(model.vertex_count for model in models)
+                index_count = sum(len(lod) for model in models for lod in model.lods)
+                if not packed:
+                    ModelManager.arena = BufferArena(max(vertex_count, 1), max(index_count, 1))
+                elif models:
+                    ModelManager.packed_arena = BufferArena(vertex_count, index_count, PACKED_FORMAT)
+        for name, model in ModelManager.pending:
+            ModelManager.arena_for(model).upload(model)
+            ModelManager.release_geometry(name, model)
+        ModelManager.pending = []
 
-        # Requisitar três slots para a GPU:
-        #   Um para enviar coordenadas dos vértices.
-        #   Um para enviar coordenadas de texturas.
-        #   Um para enviar coordenadas de normals para iluminação.
-        buffer = glGenBuffers(3)
-
-        # Enviando coordenadas de vértices para a GPU
-        vertices = np.zeros(len(ModelManager.vertices), [("position", np.float32, 3)])
-        vertices['position'] = ModelManager.vertices
-        glBindBuffer(GL_ARRAY_BUFFER, buffer[0])
-        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
-        stride = vertices.strides[0]
-        offset = ctypes.c_void_p(0)
-        loc_vertices = glGetAttribLocation(GI.program, "position")
-        glEnableVertexAttribArray(loc_vertices)
-        glVertexAttribPointer(loc_vertices, 3, GL_FLOAT, False, stride, offset)
-
-        # Enviando coordenadas de textura para a GPU
-        textures = np.zeros(len(ModelManager.texture_coords), [("position", np.float32, 2)])
-        textures['position'] = ModelManager.texture_coords
-        glBindBuffer(GL_ARRAY_BUFFER, buffer[1])
-        glBufferData(GL_ARRAY_BUFFER, textures.nbytes, textures, GL_STATIC_DRAW)
-        stride = textures.strides[0]
-        offset = ctypes.c_void_p(0)
-        loc_texture_coord = glGetAttribLocation(GI.program, "texture_coord")
-        glEnableVertexAttribArray(loc_texture_coord)
-        glVertexAttribPointer(loc_texture_coord, 2, GL_FLOAT, False, stride, offset)
-
-        # Enviando dados de Iluminação a GPU
-        normals = np.zeros(len(ModelManager.normals), [("position", np.float32, 3)])
-        normals['position'] = ModelManager.normals
-        glBindBuffer(GL_ARRAY_BUFFER, buffer[2])
-        glBufferData(GL_ARRAY_BUFFER, normals.nbytes, normals, GL_STATIC_DRAW)
-        stride = normals.strides[0]
-        offset = ctypes.c_void_p(0)
-        loc_normals_coord = glGetAttribLocation(GI.program, "normals")
-        glEnableVertexAttribArray(loc_normals_coord)
-        glVertexAttribPointer(loc_normals_coord, 3, GL_FLOAT, False, stride, offset)
-    
-    def draw_models(ka, kd, ks, ns):
+    # Descarta os arrays de um modelo já enviado, a menos que estejam em keep_geometry
+    @staticmethod
+    def release_geometry(name, model):
+        if ModelManager.release_arrays and name not in ModelManager.keep_geometry:
+            model.release_geometry()
+
+    # Exibe, para cada modelo, a quantidade de vértices antes e depois da
+    # indexação e a memória de vídeo economizada
+    def geometry_report():
+        report = {}
+        for key, model in ModelManager.models.items():
+            vertex_size = model.arena.vertex_size if model.arena != None else 8 * 4 # float32 até o envio
+            before = model.index_count * vertex_size
+            after = model.vertex_count * vertex_size + model.index_count * 4
+            report[key] = {
+                'vertices_before': model.index_count,
+                'vertices_after': model.vertex_count,
+                'bytes_saved': before - after,
+            }
+            print(f'{key}: {model.index_count} -> {model.vertex_count} vertices, {(before - after) / 1024:.1f} KB saved')
+        return report
+
+    # Exibe a memória de cada modelo: arrays na CPU (na memória do processo e mapeados
+    # de arquivos), geometria na GPU e texturas, além dos totais das arenas e texturas
+    def memory_report():
+        report = {}
+        for key, model in ModelManager.models.items():
+            report[key] = model.memory()
+            report[key]['texture_bytes'] = sum(texture.nbytes for texture in model.textures() if texture.id != None)
+            print(f'{key}: CPU {report[key]["cpu_bytes"] / 1024:.1f} KB (+{report[key]["mapped_bytes"] / 1024:.1f} KB mapped), '
+                  f'GPU {report[key]["gpu_bytes"] / 1024:.1f} KB geometry, {report[key]["texture_bytes"] / 1024:.1f} KB textures')
+        arenas = [arena for arena in (ModelManager.arena, ModelManager.packed_arena) if arena != None]
+        totals = {
+            'cpu_bytes': sum(memory['cpu_bytes'] for memory in report.values()),
+            'mapped_bytes': sum(memory['mapped_bytes'] for memory in report.values()),
+            'gpu_bytes': sum(memory['gpu_bytes'] for memory in report.values()),
+            'arena_bytes': sum(arena.vertex_capacity * arena.vertex_size + arena.index_capacity * 4 for arena in arenas),
+            'texture_bytes': TextureManager.resident_bytes,
+        }
+        print(f'Total: CPU {totals["cpu_bytes"] / 2**20:.2f} MB (+{totals["mapped_bytes"] / 2**20:.2f} MB mapped), '
+              f'GPU {totals["gpu_bytes"] / 2**20:.2f} MB geometry in {totals["arena_bytes"] / 2**20:.2f} MB of arenas, '
+              f'{totals["texture_bytes"] / 2**20:.1f} MB textures')
+        report['total'] = totals
+        return report
+
+    # Exibe a quantidade de triângulos de cada nível de detalhe dos modelos
+    def lod_report():
+        report = {}
+        for key, model in ModelManager.models.items():
+            counts = [count for _, count in model.lod_ranges] if model.lod_ranges != None else [len(lod) for lod in model.lods]
+            report[key] = [count // 3 for count in counts]
+            print(f'{key}: ' + ' / '.join(str(triangles) for triangles in report[key]) + ' triangles')
+        return report
+
+    # Acrescenta uma luz pontual
+    #   parent -> nome de um modelo já carregado; a posição passa a ser relativa a ele
+    @staticmethod
+    def add_light(name, position, color=(1.0, 1.0, 1.0), intensity=1.0, radius=5.0, parent=None):
+        ModelManager.add_lights([name], [tuple(position)], color, intensity, radius, parent)
+
+    # Acrescenta várias luzes pontuais de uma vez
+    #   positions -> (n, 3); colors, intensities e radii aceitam um valor por luz ou um único valor
+    @staticmethod
+    def add_lights(names, positions, colors=(1.0, 1.0, 1.0), intensities=1.0, radii=5.0, parent=None):
+        node = ModelManager.models[parent].node if parent != None else -1
+        ModelManager.lights.add(names, positions, colors, intensities, radii, node)
+
+    @staticmethod
+    def remove_light(name):
+        ModelManager.lights.remove(name)
+
+    # Altera uma luz pontual (None mantém o valor atual)
+    @staticmethod
+    def set_light(name, position=None, color=None, intensity=None, radius=None):
+        ModelManager.lights.set(name, position, color, intensity, radius)
+
+    # Atribui as luzes pontuais aos clusters da tela e as envia para a GPU
+    #   Chamada uma vez por quadro, com as mesmas matrizes de GI.frame
+    @staticmethod
+    def update_lights(view, projection):
+        if ModelManager.clusters == None:
+            if len(ModelManager.lights) == 0:
+                return
+            ModelManager.clusters = LightClusters()
+        grid, scale = ModelManager.clusters.assign(ModelManager.lights, view, projection, GI.width, GI.height)
+        GI.lights.set(grid, scale)
+        ModelManager.clusters.bind()
+
+    # Exibe a quantidade de luzes e de entradas nos clusters do último quadro
+    def light_report():
+        if ModelManager.clusters == None:
+            print(f'Lights: {len(ModelManager.lights)} point lights, none assigned')
+            return {'lights': len(ModelManager.lights)}
+        return ModelManager.clusters.report(len(ModelManager.lights))
+
+    # Posição da fonte de luz da cena (a última LightModel carregada)
+    def light_position():
+        position = Coord3d(0.0, 0.0, 0.0)
         for key, model in ModelManager.models.items():
-            model.draw(ka, kd, ks, ns)
\ No newline at end of file
+            if isinstance(model, LightModel):
+                position = model.light_position()
+        return position
+
+    # Retorna a máscara dos modelos visíveis pela câmera e o tamanho de cada um na tela
+    #   view_projection -> matriz projection * view do quadro
+    def visible_models(models, view_projection):
+        matrices = SceneGraph.world_matrices([model.node for model in models])
+        bounds = world_bounds(
+            matrices,
+            np.array([model.bounds_min for model in models]),
+            np.array([model.bounds_max for model in models]),
+            np.array([model.sphere_center for model in models]),
+            np.array([model.sphere_radius for model in models]),
+        )
+        mask = visible(frustum_planes(view_projection), *bounds)
+        sizes = screen_sizes(view_projection, bounds[2], bounds[3])
+        return mask, sizes
+
+    # Desenha os modelos
+    #   view_projection -> se fornecida, descarta os modelos fora do frustum e
+    #   escolhe o nível de detalhe de cada modelo pelo seu tamanho na tela
+    def draw_models(ka, kd, ks, ns, view_projection=None):
+        names = list(ModelManager.models.keys())
+        models = list(ModelManager.models.values())
+        with FrameProfiler.scope('transforms'):
+            SceneGraph.update() # Matrizes de todos os modelos que se moveram, de uma vez
+        with FrameProfiler.scope('cull'):
+            if view_projection is not None and models:
+                mask, sizes = ModelManager.visible_models(models, view_projection)
+                if ModelManager.lod:
+                    for model, size in zip(models, sizes):
+                        model.select_lod(size)
+                if ModelManager.culling:
+                    names = [name for name, is_visible in zip(names, mask) if is_visible]
+                    models = [model for model, is_visible in zip(models, mask) if is_visible]
+            TextureManager.next_frame()
+        ModelManager.drawn_count = len(models)
+        ModelManager.culled_count = len(ModelManager.models) - len(models)
+        ModelManager.triangle_count = sum(model.triangle_count() for model in models)
+        if ModelManager.sort_draws:
+            if ModelManager.queue == None:
+                ModelManager.queue = RenderQueue()
+            ModelManager.queue.draw(names, models, ka, kd, ks, ns)
+            ModelManager.draw_call_count = ModelManager.queue.batch_count
+        elif FrameProfiler.enabled:
+            for name, model in zip(names, models):
+                with FrameProfiler.scope('model:' + name):
+                    model.draw(ka, kd, ks, ns)
+        else:
+            for model in models:
+                model.draw(ka, kd, ks, ns)
+        if not ModelManager.sort_draws:
+            ModelManager.draw_call_count = sum(len(model.parts()) for model in models) # Uma chamada por parte
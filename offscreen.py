@@ -0,0 +1,110 @@
+import ctypes
+from OpenGL.GL import *
+
+# Criação de contextos OpenGL sem janela, para execução sem monitor ou GPU
+#   A plataforma do PyOpenGL é escolhida na primeira importação de OpenGL.GL,
+#   então PYOPENGL_PLATFORM deve valer 'egl' ou 'osmesa' antes de qualquer import
+#   (ver benchmark.py)
+#     egl -> EGL sem superfície (Mesa llvmpipe ou drivers de GPU)
+#     osmesa -> Mesa OSMesa, renderização inteiramente na CPU
+
+# Cria e ativa um contexto OpenGL 3.3+ (perfil de compatibilidade)
+def create_context(backend, width, height):
+    if backend == 'egl':
+        return create_egl_context()
+    if backend == 'osmesa':
+        return create_osmesa_context(width, height)
+    raise ValueError(f'Unknown offscreen backend: {backend}')
+
+def create_egl_context():
+    from OpenGL import EGL
+
+    # Prefere a plataforma sem superfície do Mesa, que não depende de X11 ou Wayland
+    EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+    display = EGL.EGL_NO_DISPLAY
+    try:
+        display = EGL.eglGetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+    except Exception:
+        pass
+    if not display:
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    if not EGL.eglInitialize(display, None, None):
+        raise RuntimeError('Could not initialize EGL')
+
+    attributes = (EGL.EGLint * 9)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_DEPTH_SIZE, 24,
+        EGL.EGL_RED_SIZE, 8,
+        EGL.EGL_NONE,
+    )
+    config = EGL.EGLConfig()
+    count = EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) or count.value == 0:
+        raise RuntimeError('No suitable EGL config')
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not context:
+        raise RuntimeError('Could not create EGL context')
+
+    # Sem superfície: toda a renderização acontece em um framebuffer (Framebuffer)
+    if not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context):
+        raise RuntimeError('Could not make EGL context current')
+    return display, context
+
+def create_osmesa_context(width, height):
+    from OpenGL import osmesa, arrays
+
+    context = None
+    if hasattr(osmesa, 'OSMesaCreateContextAttribs'):
+        attributes = (ctypes.c_int * 11)(
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_COMPAT_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3,
+            0,
+        )
+        context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+    if not context:
+        context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    if not context:
+        raise RuntimeError('Could not create OSMesa context')
+
+    # O OSMesa precisa de um buffer na memória, mesmo que se desenhe em um framebuffer
+    buffer = arrays.GLubyteArray.zeros((height, width, 4))
+    if not osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, width, height):
+        raise RuntimeError('Could not make OSMesa context current')
+    return context, buffer
+
+# Framebuffer com cor e profundidade em renderbuffers, usado como destino da renderização
+class Framebuffer:
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.fbo = glGenFramebuffers(1)
+        self.color, self.depth = glGenRenderbuffers(2)
+
+        glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('Incomplete framebuffer')
+
+    def bind(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+
+    # Lê a imagem renderizada como um array (altura, largura, 3), de cima para baixo
+    def read_pixels(self):
+        import numpy as np
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)[::-1]
@@ -0,0 +1,209 @@
+import time
+import json
+import ctypes
+import numpy as np
+from collections import deque
+from OpenGL.GL import *
+# O wrapper do PyOpenGL para glGetQueryObjectui64v falha com GL_UNSIGNED_INT64;
+# a versão "raw" recebe um ponteiro ctypes diretamente
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+from gl_counter import GLCounter
+
+# Trecho medido do quadro (fase do laço principal ou modelo), usado como "with"
+class ProfileScope:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        FrameProfiler.push(self.name)
+
+    def __exit__(self, *exc):
+        FrameProfiler.pop(self.name)
+        return False
+
+# Trecho vazio usado quando o perfilador está desligado
+class NullScope:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+# Perfilador de quadros opcional (FrameProfiler.enabled = False não tem custo além de um "if")
+#   Tempo de CPU por trecho com time.perf_counter
+#   Tempo de GPU por trecho com consultas GL_TIME_ELAPSED. Só uma consulta pode estar
+#   ativa por vez, então ao abrir um trecho interno a consulta atual é encerrada e uma
+#   nova começa; cada segmento é somado a todos os trechos abertos naquele momento
+#   As consultas de um quadro são lidas `latency` quadros depois, em um anel de
+#   conjuntos de consultas, e só se o resultado já estiver disponível (sem esperar a GPU)
+#   Chamadas de desenho e mudanças de estado vêm do GLCounter
+class FrameProfiler:
+
+    "static"
+    enabled = False
+    gpu = True # Mede também o tempo de GPU
+    latency = 4 # Quadros entre o envio de uma consulta e a sua leitura
+    window = 120 # Quadros considerados nas estatísticas
+    null_scope = NullScope()
+
+    frame = 0
+    frame_start = 0.0
+    stack = []
+    cpu_start = {}
+    cpu = {}
+    segments = [] # (consulta, nomes dos trechos abertos) do quadro atual
+    ring = [] # [quadro, pool de consultas, segmentos] por posição do anel
+    pool = []
+    history = deque() # Registros dos quadros, mais recentes no fim
+    pending = {} # Quadro -> registro ainda sem tempos de GPU
+    dropped = 0 # Quadros cujas consultas não ficaram prontas a tempo
+
+    # Liga o perfilador; as chamadas GL dos módulos passados são contadas
+    @staticmethod
+    def enable(*modules, gpu=True):
+        FrameProfiler.enabled = True
+        FrameProfiler.gpu = gpu
+        FrameProfiler.history = deque(maxlen=FrameProfiler.window)
+        if modules:
+            GLCounter.install(*modules)
+
+    @staticmethod
+    def scope(name):
+        if FrameProfiler.enabled:
+            return ProfileScope(name)
+        return FrameProfiler.null_scope
+
+    # Consulta livre da posição atual do anel
+    @staticmethod
+    def next_query():
+        slot = FrameProfiler.ring[FrameProfiler.frame % FrameProfiler.latency]
+        pool = slot[1]
+        index = len(FrameProfiler.segments)
+        if index >= len(pool):
+            pool.extend(int(query) for query in np.atleast_1d(glGenQueries(max(len(pool), 8))))
+        return pool[index]
+
+    @staticmethod
+    def begin_segment():
+        if FrameProfiler.gpu and FrameProfiler.stack:
+            query = FrameProfiler.next_query()
+            glBeginQuery(GL_TIME_ELAPSED, query)
+            FrameProfiler.segments.append((query, tuple(FrameProfiler.stack)))
+
+    @staticmethod
+    def end_segment():
+        if FrameProfiler.gpu and FrameProfiler.stack:
+            glEndQuery(GL_TIME_ELAPSED)
+
+    @staticmethod
+    def push(name):
+        FrameProfiler.end_segment()
+        FrameProfiler.stack.append(name)
+        FrameProfiler.cpu_start[name] = time.perf_counter()
+        FrameProfiler.begin_segment()
+
+    @staticmethod
+    def pop(name):
+        FrameProfiler.end_segment()
+        elapsed = (time.perf_counter() - FrameProfiler.cpu_start.pop(name)) * 1000
+        FrameProfiler.cpu[name] = FrameProfiler.cpu.get(name, 0.0) + elapsed
+        FrameProfiler.stack.pop()
+        FrameProfiler.begin_segment()
+
+    # Lê os tempos de GPU de uma posição do anel, se já estiverem disponíveis
+    @staticmethod
+    def collect(slot):
+        frame, pool, segments = slot
+        if frame is None or frame not in FrameProfiler.pending:
+            return
+        record = FrameProfiler.pending.pop(frame)
+        if segments and not glGetQueryObjectiv(segments[-1][0], GL_QUERY_RESULT_AVAILABLE):
+            FrameProfiler.dropped += 1 # A GPU está mais de `latency` quadros atrasada
+            return
+        gpu = {}
+        result = ctypes.c_uint64()
+        for query, names in segments:
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(result))
+            for name in names:
+                gpu[name] = gpu.get(name, 0.0) + result.value / 1e6
+        record['gpu'] = gpu
+
+    @staticmethod
+    def begin_frame():
+        if not FrameProfiler.enabled:
+            return
+        while len(FrameProfiler.ring) < FrameProfiler.latency:
+            FrameProfiler.ring.append([None, [], []])
+        slot = FrameProfiler.ring[FrameProfiler.frame % FrameProfiler.latency]
+        if FrameProfiler.gpu:
+            FrameProfiler.collect(slot)
+        slot[0] = FrameProfiler.frame
+        FrameProfiler.segments = slot[2] = []
+        FrameProfiler.cpu = {}
+        FrameProfiler.frame_start = time.perf_counter()
+        FrameProfiler.push('frame')
+
+    @staticmethod
+    def end_frame():
+        if not FrameProfiler.enabled:
+            return
+        FrameProfiler.pop('frame')
+        calls = GLCounter.last_frame if GLCounter.installed else {}
+        record = {
+            'frame': FrameProfiler.frame,
+            'cpu': FrameProfiler.cpu,
+            'gpu': None,
+            'draw_calls': sum(count for name, count in calls.items() if name.startswith(('glDraw', 'glMultiDraw'))),
+            'state_changes': sum(count for name, count in calls.items() if name.startswith(('glBind', 'glUse', 'glUniform', 'glEnable', 'glDisable', 'glPolygonMode'))),
+            'gl_calls': sum(calls.values()),
+        }
+        FrameProfiler.history.append(record)
+        if FrameProfiler.gpu:
+            FrameProfiler.pending[FrameProfiler.frame] = record
+        FrameProfiler.frame += 1
+
+    # Estatísticas dos últimos `window` quadros: média e p95 (ms) de cada trecho
+    @staticmethod
+    def stats():
+        records = list(FrameProfiler.history)
+        result = {'frames': len(records), 'dropped_gpu_frames': FrameProfiler.dropped, 'cpu': {}, 'gpu': {}}
+        for kind in ('cpu', 'gpu'):
+            samples = {}
+            for record in records:
+                for name, value in (record[kind] or {}).items():
+                    samples.setdefault(name, []).append(value)
+            for name, values in samples.items():
+                result[kind][name] = {'mean': round(float(np.mean(values)), 4), 'p95': round(float(np.percentile(values, 95)), 4)}
+        for key in ('draw_calls', 'state_changes', 'gl_calls'):
+            result[key] = round(float(np.mean([record[key] for record in records])), 2) if records else 0
+        frame = result['cpu'].get('frame')
+        result['fps'] = round(1000 / frame['mean'], 1) if frame and frame['mean'] > 0 else 0
+        return result
+
+    # Texto curto para a barra de título da janela
+    @staticmethod
+    def overlay_text():
+        stats = FrameProfiler.stats()
+        cpu = stats['cpu'].get('frame', {}).get('mean', 0)
+        gpu = stats['gpu'].get('frame', {}).get('mean', 0)
+        return f"{stats['fps']:.0f} fps | CPU {cpu:.2f} ms | GPU {gpu:.2f} ms | {stats['draw_calls']:.0f} draws | {stats['state_changes']:.0f} state changes"
+
+    @staticmethod
+    def report():
+        stats = FrameProfiler.stats()
+        print(f"Profile ({stats['frames']} frames): {FrameProfiler.overlay_text()}")
+        names = sorted(stats['cpu'], key=lambda name: -stats['cpu'][name]['mean'])
+        for name in names:
+            cpu = stats['cpu'][name]
+            gpu = stats['gpu'].get(name)
+            gpu_text = f"GPU {gpu['mean']:8.3f} ms (p95 {gpu['p95']:.3f})" if gpu else 'GPU        -'
+            print(f"  {name:24} CPU {cpu['mean']:8.3f} ms (p95 {cpu['p95']:.3f})  {gpu_text}")
+        return stats
+
+    # Grava as estatísticas em JSON
+    @staticmethod
+    def export(path):
+        with open(path, 'w') as file:
+            json.dump(FrameProfiler.stats(), file, indent=2)
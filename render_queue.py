@@ -0,0 +1,159 @@
+import numpy as np
+from OpenGL.GL import *
+from glfw_instance import GlfwInstance as GI
+from gpu_buffer import BufferArena
+from scene_graph import SceneGraph
+from model import InstancedModel
+from profiler import FrameProfiler
+
+COMMAND_SIZE = 20 # DrawElementsIndirectCommand: count, instanceCount, firstIndex, baseVertex, baseInstance
+IDENTITY = np.eye(4, dtype=np.float32)
+
+# Versão do OpenGL do contexto atual, como (maior, menor)
+def gl_version():
+    return (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION))
+
+# Fila de desenho ordenada por estado
+#   Cada parte (intervalo de um material) dos modelos visíveis vira um item com a chave
+#   (programa, textura, material); os itens são ordenados pela chave e os itens
+#   vizinhos com a mesma chave formam um lote
+#   Cada lote troca textura e material uma única vez e é desenhado com uma chamada
+#   glMultiDrawElementsIndirect sobre a arena compartilhada. A matriz model de cada
+#   desenho fica em um buffer de transformações lido pelo atributo instance_model:
+#   o baseInstance de cada comando é o índice do desenho nesse buffer
+#   Sem OpenGL 4.3, os lotes são desenhados item a item (mesma ordenação)
+class RenderQueue:
+
+    def __init__(self):
+        self.indirect = gl_version() >= (4, 3)
+        self.vao = None
+        self.arena = None
+        self.arena_generation = None
+        self.transform_buffer = glGenBuffers(1)
+        self.transform_capacity = 0
+        self.transforms = None
+        self.command_buffer = glGenBuffers(1)
+        self.command_capacity = 0
+        self.commands = None
+        self.batch_count = 0 # Lotes (chamadas de desenho) do último quadro
+        self.state_changes = 0 # Trocas de textura ou material do último quadro
+
+    # Chave de estado de uma parte de um modelo: programa (variante), textura e material
+    #   O material inclui a uv_transform dos modelos com vértices compactados
+    #   Modelos instanciados possuem VAO próprio e nunca são agrupados
+    @staticmethod
+    def state_key(model, material, ka, kd, ks, ns):
+        texture = model.draw_texture(material)
+        texture_key = -1 if texture == None else 0 if texture == 0 else id(texture)
+        return (model.shader(material).program, texture_key, model.material(material, ka, kd, ks, ns) + model.uv_transform, isinstance(model, InstancedModel), id(model.arena))
+
+    # Divide as partes dos modelos em lotes de mesmo estado, ordenados pela chave
+    #   Retorna uma lista de (chave, [(nome, modelo, material, índice inicial, quantidade), ...])
+    @staticmethod
+    def build_batches(names, models, ka, kd, ks, ns):
+        items = []
+        for name, model in zip(names, models):
+            for material, start_index, index_count in model.parts():
+                key = RenderQueue.state_key(model, material, ka, kd, ks, ns)
+                items.append((key, len(items), (name, model, material, start_index, index_count)))
+        items.sort(key=lambda item: item[:2])
+        batches = []
+        for key, _, item in items:
+            if batches and batches[-1][0] == key and not key[3]:
+                batches[-1][1].append(item)
+            else:
+                batches.append((key, [item]))
+        return batches
+
+    # Envia dados a um buffer, crescendo-o se necessário e pulando envios repetidos
+    def upload(self, target, buffer, capacity, data, previous):
+        if previous is not None and previous.shape == data.shape and np.array_equal(previous, data):
+            return capacity
+        glBindBuffer(target, buffer)
+        if data.nbytes > capacity:
+            capacity = max(data.nbytes, 2 * capacity)
+            glBufferData(target, capacity, None, GL_DYNAMIC_DRAW)
+        glBufferSubData(target, 0, data.nbytes, data)
+        return capacity
+
+    # VAO com os atributos da arena e o buffer de transformações como instance_model
+    def bind(self, arena):
+        if self.vao == None:
+            self.vao = glGenVertexArrays(1)
+        if self.arena is not arena or self.arena_generation != arena.generation:
+            glBindVertexArray(self.vao)
+            arena.setup_attributes()
+            BufferArena.setup_instance_attribute(self.transform_buffer)
+            self.arena = arena
+            self.arena_generation = arena.generation
+            BufferArena.bound = self
+        elif BufferArena.bound is not self:
+            glBindVertexArray(self.vao)
+            BufferArena.bound = self
+
+    # Ativa o programa, a textura e o material de um lote
+    #   Os uniforms pertencem a cada programa, então o material é reenviado ao trocar de programa
+    def apply_state(self, key, model, material, previous):
+        if previous == None or previous[0] != key[0]:
+            GI.use(model.shader(material))
+            self.state_changes += 1
+        if previous == None or previous[1] != key[1]:
+            model.bind_texture(model.draw_texture(material))
+            self.state_changes += 1
+        if previous == None or previous[0] != key[0] or previous[2] != key[2]:
+            ka, kd, ks, ns = key[2][:4]
+            GI.shader.set_float("ka", ka)
+            GI.shader.set_float("kd", kd)
+            GI.shader.set_float("ks", ks)
+            GI.shader.set_float("ns", ns)
+            GI.shader.set_vec4("uv_transform", *key[2][4:])
+            self.state_changes += 1
+
+    # Desenha os modelos ordenados por estado
+    def draw(self, names, models, ka, kd, ks, ns):
+        batches = RenderQueue.build_batches(names, models, ka, kd, ks, ns)
+        self.batch_count = 0
+        self.state_changes = 0
+
+        # Transformações e comandos de todas as partes agrupáveis, na ordem dos lotes
+        grouped = [item for key, items in batches if not key[3] for item in items]
+        if self.indirect and grouped:
+            transforms = SceneGraph.world_matrices([model.node for _, model, _, _, _ in grouped])
+            transforms = np.ascontiguousarray(transforms.transpose(0, 2, 1), dtype=np.float32)
+            self.transform_capacity = self.upload(GL_ARRAY_BUFFER, self.transform_buffer, self.transform_capacity, transforms, self.transforms)
+            self.transforms = transforms
+
+            commands = np.zeros((len(grouped), 5), dtype=np.uint32)
+            commands[:, 0] = [index_count for _, _, _, _, index_count in grouped]
+            commands[:, 1] = 1
+            commands[:, 2] = [start_index for _, _, _, start_index, _ in grouped]
+            commands[:, 4] = np.arange(len(grouped))
+            self.command_capacity = self.upload(GL_DRAW_INDIRECT_BUFFER, self.command_buffer, self.command_capacity, commands, self.commands)
+            self.commands = commands
+            glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.command_buffer)
+
+        previous = None
+        first = 0
+        for key, items in batches:
+            _, model, material, _, _ = items[0]
+            # O nome do trecho só é montado com o perfilador ligado
+            scope = FrameProfiler.scope('batch:' + '+'.join(item[0] for item in items)) if FrameProfiler.enabled else FrameProfiler.null_scope
+            with scope:
+                self.apply_state(key, model, material, previous)
+                if key[3]:
+                    GI.shader.set_mat4("model", model.model_matrix())
+                    model.draw_elements(items[0][3], items[0][4])
+                    self.batch_count += 1
+                elif self.indirect:
+                    self.bind(model.arena)
+                    GI.shader.set_mat4("model", IDENTITY)
+                    GI.shader.set_int("instanced", 1)
+                    glMultiDrawElementsIndirect(GL_TRIANGLES, GL_UNSIGNED_INT, ctypes.c_void_p(first * COMMAND_SIZE), len(items), 0)
+                    first += len(items)
+                    self.batch_count += 1
+                else:
+                    for _, model, _, start_index, index_count in items:
+                        GI.shader.set_mat4("model", model.model_matrix())
+                        model.draw_elements(start_index, index_count)
+                        self.batch_count += 1
+            previous = key
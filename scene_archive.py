@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+from PIL import Image
+from texture_manager import TextureManager, decode_texture
+
+MAGIC = b'CGPACK\0\0'
+ARCHIVE_VERSION = 1
+HEADER_SIZE = 32 # MAGIC, versão (uint32), reservado (uint32), posição e tamanho do sumário (uint64)
+ALIGNMENT = 16
+DEFAULT_PATH = os.path.join('cache', 'models.pack')
+PACKED_VERTEX_SIZE = 16 # posição (4 x float16), textura (2 x uint16), normal (2 x int16)
+
+# Codifica normais unitárias (n, 3) em 2 componentes (projeção octaédrica), int16 normalizado
+#   A decodificação é feita no vertex shader (decode_normal, variante QUANTIZED)
+def encode_octahedral(normals):
+    normals = np.asarray(normals, dtype=np.float64)
+    length = np.abs(normals).sum(axis=1, keepdims=True)
+    normals = np.where(length > 0, normals / np.where(length > 0, length, 1), [0.0, 0.0, 1.0])
+    xy = normals[:, :2]
+    folded = (1 - np.abs(xy[:, ::-1])) * np.where(xy >= 0, 1.0, -1.0) # Hemisfério de baixo
+    xy = np.where(normals[:, 2:3] < 0, folded, xy)
+    return np.round(np.clip(xy, -1, 1) * 32767).astype(np.int16)
+
+# Quantiza as coordenadas de textura no intervalo do modelo com uint16 normalizado
+#   Retorna os valores e a transformação (x0, y0, largura, altura) que os recupera:
+#   uv = valor / 65535 * (largura, altura) + (x0, y0)
+def quantize_texture_coords(texture_coords):
+    texture_coords = np.asarray(texture_coords, dtype=np.float64).reshape(-1, 2)
+    low = texture_coords.min(axis=0) if len(texture_coords) else np.zeros(2)
+    scale = np.maximum(texture_coords.max(axis=0) - low, 1e-6) if len(texture_coords) else np.ones(2)
+    quantized = np.round((texture_coords - low) / scale * 65535).astype(np.uint16)
+    return quantized, tuple(float(value) for value in (*low, *scale))
+
+# Vértices no formato compacto da arena (ver gpu_buffer.PACKED_FORMAT), um registro de 16 bytes por vértice
+def pack_vertices(vertices, texture_coords, normals):
+    count = len(vertices)
+    packed = np.zeros((count, PACKED_VERTEX_SIZE // 2), dtype=np.uint16)
+    positions = np.ones((count, 4), dtype=np.float16)
+    positions[:, :3] = vertices
+    packed[:, 0:4] = positions.view(np.uint16)
+    quantized, uv_transform = quantize_texture_coords(texture_coords)
+    packed[:, 4:6] = quantized
+    packed[:, 6:8] = encode_octahedral(normals).view(np.uint16)
+    return packed.view(np.uint8).reshape(count, PACKED_VERTEX_SIZE), uv_transform
+
+# Níveis de mipmap de uma imagem decodificada por decode_texture, do maior para 1x1
+#   Cada nível é a média de blocos 2x2 do anterior (como glGenerateMipmap)
+def mipmap_levels(image):
+    width, height, data = image
+    img = Image.frombytes('RGB', (width, height), data)
+    levels = [(width, height, data)]
+    while width > 1 or height > 1:
+        width, height = max(width // 2, 1), max(height // 2, 1)
+        img = img.resize((width, height), Image.BOX)
+        levels.append((width, height, img.tobytes()))
+    return levels
+
+# Grava o arquivo compactado (.pack) com todos os modelos de main_dir
+#   Os dados (vértices, índices e níveis das texturas) ficam alinhados a 16 bytes e o
+#   sumário em JSON no fim do arquivo; texturas com os mesmos pixels são gravadas uma vez
+#   max_size -> reduz as texturas (como TextureManager.max_size)
+def bake(output=DEFAULT_PATH, main_dir='models', max_size=None):
+    from model_manager import ModelManager, load_mtl
+
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    toc = {'version': ARCHIVE_VERSION, 'max_size': max_size, 'models': {}, 'textures': {}, 'source_bytes': 0}
+    with open(output + '.tmp', 'wb') as file:
+        file.write(b'\0' * HEADER_SIZE)
+
+        # Escreve um bloco alinhado e retorna [posição, tamanho]
+        def write(data):
+            data = np.ascontiguousarray(data)
+            file.write(b'\0' * (-file.tell() % ALIGNMENT))
+            offset = file.tell()
+            file.write(data.tobytes())
+            return [offset, data.nbytes]
+
+        for model_dir in sorted(os.listdir(main_dir)):
+            directory = os.path.join(main_dir, model_dir)
+            if not os.path.isdir(directory):
+                continue
+            mesh = None
+            materials = {}
+            sources = []
+            for filename in os.listdir(directory):
+                filepath = os.path.join(directory, filename)
+                if filename.endswith(('.obj', '.mtl', '.jpg', '.png')):
+                    sources.append(filepath)
+                if filename.endswith('.obj'):
+                    mesh = ModelManager.load_mesh(filepath)
+                elif filename.endswith('.mtl'):
+                    materials.update(load_mtl(filepath))
+            if mesh == None:
+                continue # Diretório sem .obj (ex.: ranger): nem as imagens entram no arquivo
+
+            toc['source_bytes'] += sum(os.path.getsize(filepath) for filepath in sources)
+            images = []
+            for filepath in sources:
+                if filepath.endswith(('.jpg', '.png')):
+                    image = decode_texture(filepath, max_size)
+                    key = hashlib.sha1(f'{image[0]}x{image[1]}'.encode() + image[2]).hexdigest()
+                    if key not in toc['textures']:
+                        toc['textures'][key] = {'file': filepath, 'levels': [[width, height] + write(np.frombuffer(data, dtype=np.uint8)) for width, height, data in mipmap_levels(image)]}
+                    images.append([os.path.basename(filepath), key])
+
+            packed, uv_transform = pack_vertices(mesh['vertices'], mesh['texture_coords'], mesh['normals'])
+            lods = [mesh['indices']]
+            while f'lod{len(lods)}' in mesh:
+                lods.append(mesh[f'lod{len(lods)}'])
+            lod_materials = [mesh['materials'] if 'materials' in mesh else np.zeros(0, dtype=np.int32)]
+            lod_materials += [mesh[f'lod{level}_materials'] for level in range(1, len(lods))]
+            toc['models'][model_dir] = {
+                'vertex_count': len(packed),
+                'vertices': write(packed),
+                'uv_transform': uv_transform,
+                'lods': [write(np.asarray(lod, dtype=np.uint32)) for lod in lods],
+                'lod_materials': [write(np.asarray(face_materials, dtype=np.int32)) for face_materials in lod_materials],
+                'material_names': [str(name) for name in mesh['material_names']] if 'material_names' in mesh else [],
+                'materials': {name: list(material[1:]) for name, material in materials.items()},
+                'images': images,
+            }
+
+        toc_bytes = json.dumps(toc).encode()
+        file.write(b'\0' * (-file.tell() % ALIGNMENT))
+        toc_offset = file.tell()
+        file.write(toc_bytes)
+        file.seek(0)
+        file.write(MAGIC + np.array([ARCHIVE_VERSION, 0], dtype='<u4').tobytes() + np.array([toc_offset, len(toc_bytes)], dtype='<u8').tobytes())
+    os.replace(output + '.tmp', output)
+    print(f'Baked {len(toc["models"])} models and {len(toc["textures"])} textures into {output} in {time.perf_counter() - start:.2f} s')
+    return SceneArchive.report(output)
+
+# Arquivo compactado aberto por mmap
+#   Os arrays devolvidos são vistas do arquivo mapeado: os vértices e os índices vão
+#   para a GPU sem conversão e sem abrir os arquivos de cada modelo
+class SceneArchive:
+
+    def __init__(self, path):
+        start = time.perf_counter()
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a scene archive')
+        version = int(self.data[8:12].view('<u4')[0])
+        if version != ARCHIVE_VERSION:
+            raise ValueError(f'{path}: archive version {version}, expected {ARCHIVE_VERSION} (bake it again)')
+        toc_offset, toc_size = (int(value) for value in self.data[16:32].view('<u8'))
+        self.toc = json.loads(bytes(self.data[toc_offset:toc_offset + toc_size]))
+        self.open_time = time.perf_counter() - start
+
+    def __contains__(self, model_dir):
+        return model_dir in self.toc['models']
+
+    # Vista de um bloco do arquivo com o tipo pedido
+    def view(self, block, dtype):
+        offset, size = block
+        return self.data[offset:offset + size].view(dtype)
+
+    # Malha no formato de geometry.build_mesh, com os vértices compactados em 'packed'
+    #   'vertices' são as posições em float16; 'texture_coords' e 'normals' ficam
+    #   quantizadas (decodificadas no vertex shader, variante QUANTIZED)
+    def mesh(self, model_dir):
+        entry = self.toc['models'][model_dir]
+        packed = self.view(entry['vertices'], np.uint8).reshape(-1, PACKED_VERTEX_SIZE)
+        fields = packed.view(np.uint16).reshape(-1, PACKED_VERTEX_SIZE // 2)
+        mesh = {
+            'packed': packed,
+            'vertices': fields.view(np.float16)[:, 0:3],
+            'texture_coords': fields[:, 4:6],
+            'normals': fields.view(np.int16)[:, 6:8],
+            'uv_transform': tuple(entry['uv_transform']),
+            'indices': self.view(entry['lods'][0], np.uint32),
+            'materials': self.view(entry['lod_materials'][0], np.int32),
+            'material_names': np.array(entry['material_names']),
+        }
+        for level in range(1, len(entry['lods'])):
+            mesh[f'lod{level}'] = self.view(entry['lods'][level], np.uint32)
+            mesh[f'lod{level}_materials'] = self.view(entry['lod_materials'][level], np.int32)
+        return mesh
+
+    # Textura pré-decodificada, enviada com todos os níveis de mipmap
+    #   filepath -> arquivo de origem registrado no TextureManager (o primeiro com esses
+    #   pixels por padrão)
+    def texture(self, key, filepath=None):
+        entry = self.toc['textures'][key]
+        levels = [(width, height, self.view(block, np.uint8)) for width, height, *block in entry['levels']]
+        return TextureManager.load_levels(filepath or entry['file'], key, levels)
+
+    # Materiais (.mtl) e imagens de um modelo, como lidos por ModelManager.read_model_dir
+    #   directory -> diretório de origem do modelo, usado nos caminhos das texturas
+    #   Retorna ({nome: (ka, kd, ks, ns, map_Kd)}, {arquivo: Texture}) na ordem do diretório
+    def model_files(self, model_dir, directory):
+        entry = self.toc['models'][model_dir]
+        images = {filename: self.texture(key, os.path.join(directory, filename)) for filename, key in entry['images']}
+        return entry['materials'], images
+
+    # Tamanho do arquivo e dos arquivos de origem
+    @staticmethod
+    def report(path):
+        archive = SceneArchive(path)
+        toc = archive.toc
+        vertex_bytes = sum(entry['vertices'][1] for entry in toc['models'].values())
+        vertex_count = sum(entry['vertex_count'] for entry in toc['models'].values())
+        index_bytes = sum(block[1] for entry in toc['models'].values() for block in entry['lods'])
+        texture_bytes = sum(level[3] for entry in toc['textures'].values() for level in entry['levels'])
+        stats = {
+            'models': len(toc['models']),
+            'textures': len(toc['textures']),
+            'archive_bytes': os.path.getsize(path),
+            'source_bytes': toc['source_bytes'],
+            'vertex_bytes': vertex_bytes,
+            'float_vertex_bytes': vertex_count * 32, # Mesmos vértices no formato float da arena
+            'index_bytes': index_bytes,
+            'texture_bytes': texture_bytes,
+            'open_s': round(archive.open_time, 6),
+        }
+        print(f'Archive {path}: {stats["archive_bytes"] / 2**20:.1f} MB (sources {stats["source_bytes"] / 2**20:.1f} MB), '
+              f'{stats["models"]} models, vertices {vertex_bytes / 2**20:.2f} MB (float: {stats["float_vertex_bytes"] / 2**20:.2f} MB), '
+              f'indices {index_bytes / 2**20:.2f} MB, {stats["textures"]} textures {texture_bytes / 2**20:.1f} MB with mipmaps, '
+              f'opened in {archive.open_time * 1000:.2f} ms')
+        return stats
+
+if __name__ == '__main__':
+    # Uso: python scene_archive.py [bake|report] [arquivo.pack] [--max-size N]
+    arguments = sys.argv[1:]
+    max_size = None
+    if '--max-size' in arguments:
+        position = arguments.index('--max-size')
+        max_size = int(arguments[position + 1])
+        del arguments[position:position + 2]
+    command = arguments[0] if arguments else 'report'
+    path = arguments[1] if len(arguments) > 1 else DEFAULT_PATH
+    if command == 'bake':
+        bake(path, max_size=max_size)
+    else:
+        SceneArchive.report(path)
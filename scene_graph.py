@@ -0,0 +1,117 @@
+import numpy as np
+from instancing import instance_matrices
+
+# Hierarquia de transformações dos modelos (nós com pai e filhos)
+#   Cada nó guarda translação, eixo e ângulo de rotação e escala locais, a matriz local
+#   e a matriz do mundo (matriz do mundo do pai @ matriz local)
+#   Alterar um nó o marca como sujo; update() recalcula, em uma única passada vetorizada,
+#   as matrizes locais dos nós sujos e as matrizes do mundo das suas subárvores
+#   Os pais são sempre criados antes dos filhos, então os índices já estão em ordem
+#   topológica; os nós são agrupados por profundidade para multiplicar cada nível de uma vez
+class SceneGraph:
+
+    "static"
+    count = 0
+    parents = np.zeros(0, dtype=np.int64) # -1 para as raízes
+    depths = np.zeros(0, dtype=np.int64)
+    translations = np.zeros((0, 3))
+    axes = np.zeros((0, 3))
+    angles = np.zeros(0)
+    scales = np.zeros((0, 3))
+    local = np.zeros((0, 4, 4), dtype=np.float32)
+    world = np.zeros((0, 4, 4), dtype=np.float32)
+    dirty = np.zeros(0, dtype=bool)
+    levels = [] # Índices dos nós de cada profundidade
+    pending = False # Algum nó sujo desde o último update()
+    updated_count = 0 # Matrizes do mundo recalculadas no último update()
+
+    # Cria um nó e retorna o seu índice
+    @staticmethod
+    def add(angle, r, t, s, parent=-1):
+        node = SceneGraph.count
+        depth = SceneGraph.depths[parent] + 1 if parent >= 0 else 0
+        SceneGraph.parents = np.append(SceneGraph.parents, parent)
+        SceneGraph.depths = np.append(SceneGraph.depths, depth)
+        SceneGraph.translations = np.vstack([SceneGraph.translations, [tuple(t)]])
+        SceneGraph.axes = np.vstack([SceneGraph.axes, [tuple(r)]])
+        SceneGraph.angles = np.append(SceneGraph.angles, angle)
+        SceneGraph.scales = np.vstack([SceneGraph.scales, [tuple(s)]])
+        SceneGraph.local = np.concatenate([SceneGraph.local, np.eye(4, dtype=np.float32)[None]])
+        SceneGraph.world = np.concatenate([SceneGraph.world, np.eye(4, dtype=np.float32)[None]])
+        SceneGraph.dirty = np.append(SceneGraph.dirty, True)
+        SceneGraph.count += 1
+        SceneGraph.levels = [np.flatnonzero(SceneGraph.depths == d) for d in range(SceneGraph.depths.max() + 1)]
+        SceneGraph.pending = True
+        return node
+
+    # Altera a transformação local de um nó (None mantém o valor atual)
+    @staticmethod
+    def set_transform(node, angle=None, r=None, t=None, s=None):
+        if angle != None:
+            SceneGraph.angles[node] = angle
+        if r != None:
+            SceneGraph.axes[node] = tuple(r)
+        if t != None:
+            SceneGraph.translations[node] = tuple(t)
+        if s != None:
+            SceneGraph.scales[node] = tuple(s)
+        SceneGraph.dirty[node] = True
+        SceneGraph.pending = True
+
+    # Troca o pai de um nó (-1 para virar raiz), recalculando as profundidades
+    @staticmethod
+    def set_parent(node, parent=-1):
+        SceneGraph.parents[node] = parent
+        depths = np.zeros(SceneGraph.count, dtype=np.int64)
+        for _ in range(SceneGraph.count + 1):
+            new_depths = np.where(SceneGraph.parents >= 0, depths[SceneGraph.parents] + 1, 0)
+            if np.array_equal(new_depths, depths):
+                break
+            depths = new_depths
+        else:
+            raise ValueError(f'Node {node} cannot be a descendant of itself')
+        SceneGraph.depths = depths
+        SceneGraph.levels = [np.flatnonzero(SceneGraph.depths == d) for d in range(SceneGraph.depths.max() + 1)]
+        SceneGraph.dirty[node] = True
+        SceneGraph.pending = True
+
+    # Recalcula as matrizes dos nós sujos e dos seus descendentes
+    @staticmethod
+    def update():
+        if not SceneGraph.pending:
+            SceneGraph.updated_count = 0
+            return 0
+        dirty = np.flatnonzero(SceneGraph.dirty)
+        SceneGraph.local[dirty] = instance_matrices(
+            SceneGraph.translations[dirty], SceneGraph.angles[dirty], SceneGraph.axes[dirty], SceneGraph.scales[dirty]
+        )
+
+        # Um nó muda se ele ou algum ancestral estiver sujo
+        changed = SceneGraph.dirty.copy()
+        for level in SceneGraph.levels[1:]:
+            changed[level] |= changed[SceneGraph.parents[level]]
+
+        for depth, level in enumerate(SceneGraph.levels):
+            nodes = level[changed[level]]
+            if len(nodes) == 0:
+                continue
+            if depth == 0:
+                SceneGraph.world[nodes] = SceneGraph.local[nodes]
+            else:
+                SceneGraph.world[nodes] = SceneGraph.world[SceneGraph.parents[nodes]] @ SceneGraph.local[nodes]
+
+        SceneGraph.dirty[:] = False
+        SceneGraph.pending = False
+        SceneGraph.updated_count = int(changed.sum())
+        return SceneGraph.updated_count
+
+    # Matrizes do mundo atualizadas de vários nós (n, 4, 4)
+    @staticmethod
+    def world_matrices(nodes):
+        SceneGraph.update()
+        return SceneGraph.world[nodes]
+
+    @staticmethod
+    def world_matrix(node):
+        SceneGraph.update()
+        return SceneGraph.world[node]
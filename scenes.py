@@ -0,0 +1,95 @@
+import os
+import json
+import math
+from model import Coord3d
+from model_manager import ModelManager
+
+# Anima os modelos da cena principal
+#   ang -> relógio da animação, incrementado a cada quadro
+#   O ranger fica sobre a torre (filho de watchtower), com posição relativa a ela
+def animate_main(ang):
+    if 'ranger' in ModelManager.models:
+        ModelManager.models['ranger'].transform( 
+            t=Coord3d( math.cos(ang*0.02)*0.5, 6.5, math.sin(ang*0.02)*0.5 )
+        )
+        ModelManager.models['ranger'].rotate( 
+            ang * -1.14,
+        )
+    ModelManager.models['moon'].transform(
+        t=Coord3d(math.cos(ang*0.01)*20, 10, math.sin(ang*0.01)*20)
+    )
+    if 'fogueira' in ModelManager.lights:
+        ModelManager.set_light('fogueira', intensity=1.6 + 0.4 * math.sin(ang * 0.37) * math.sin(ang * 0.11))
+
+# Funções de animação que os arquivos de cena podem usar (chave "animate")
+ANIMATIONS = {
+    'main': animate_main,
+    None: lambda ang: None, # Cena sem animação
+}
+
+scene_dir = 'scene_files'
+
+# Arquivo de uma cena: scene_dir/<nome>.json ou .toml
+def scene_path(name):
+    for extension in ('.json', '.toml'):
+        path = os.path.join(scene_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f'No scene file for {name} in {scene_dir}')
+
+# Nome de um modelo da cena na lista ModelManager.models (o diretório por padrão)
+def model_name(model_dir, kwargs):
+    return kwargs.get('name', model_dir)
+
+# Lê um arquivo de cena (JSON ou TOML, mesmas chaves)
+#   models -> lista de {dir, name, parent, light_source, angle, r, t, s, textures, materials},
+#   com os mesmos argumentos de ModelManager.load_model (dir é o diretório em models/)
+#   lights -> lista de {name, position, color, intensity, radius, parent} (ver ModelManager.add_light)
+#   colliders -> modelos usados na colisão da câmera, no chão e na seleção (ver
+#   spatial_index.py); seus arrays continuam na memória depois do envio para a GPU
+#   stream -> modelos grandes, carregados em segundo plano com load_scene(streaming=True)
+#   animate -> nome da função em ANIMATIONS chamada a cada quadro
+#   Retorna a cena com os modelos como (diretório, argumentos de load_model) e as
+#   luzes como (nome, argumentos de add_light)
+#   terrain2 e ranger não possuem arquivo .obj no repositório, por isso ficam de fora
+def read_scene(path):
+    with open(path, 'rb') as file:
+        if path.endswith('.toml'):
+            import tomllib # Python 3.11+
+            data = tomllib.load(file)
+        else:
+            data = json.load(file)
+    models = []
+    for entry in data.get('models', []):
+        kwargs = {key: value for key, value in entry.items() if key != 'dir'}
+        for key in ('r', 't', 's'):
+            if key in kwargs:
+                kwargs[key] = Coord3d(*kwargs[key])
+        models.append((entry['dir'], kwargs))
+    lights = [(light['name'], {key: value for key, value in light.items() if key != 'name'}) for light in data.get('lights', [])]
+    return {
+        'path': path,
+        'models': models,
+        'lights': lights,
+        'colliders': tuple(data.get('colliders', ())),
+        'stream': tuple(data.get('stream', ())),
+        'animation': data.get('animate'),
+        'animate': ANIMATIONS[data.get('animate')],
+    }
+
+# Carrega os modelos e as luzes de uma cena e retorna a cena (ver read_scene)
+#   streaming -> os modelos em scene['stream'] começam como caixas e são carregados
+#   aos poucos por StreamingLoader.update (ver streaming.py)
+def load_scene(name, streaming=False):
+    scene = read_scene(scene_path(name))
+    ModelManager.keep_geometry.update(scene['colliders']) # Usados pelo SpatialIndex depois do envio
+    streamed = scene['stream'] if streaming else ()
+    ModelManager.load_models([(model_dir, kwargs) for model_dir, kwargs in scene['models'] if model_name(model_dir, kwargs) not in streamed])
+    if streamed:
+        from streaming import StreamingLoader
+        for model_dir, kwargs in scene['models']:
+            if model_name(model_dir, kwargs) in streamed:
+                StreamingLoader.request(model_dir, **kwargs)
+    for name, kwargs in scene['lights']:
+        ModelManager.add_light(name, **kwargs)
+    return scene
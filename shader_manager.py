@@ -0,0 +1,351 @@
+import os
+import time
+import ctypes
+import hashlib
+from OpenGL.GL import *
+from OpenGL.error import GLError
+# Os wrappers do PyOpenGL para binários de programa mudam de formato entre versões;
+# as versões "raw" recebem ponteiros ctypes diretamente
+from OpenGL.raw.GL.VERSION.GL_4_1 import glGetProgramBinary, glProgramBinary
+from OpenGL.raw.GL.VERSION.GL_1_0 import glGetIntegerv as raw_glGetIntegerv
+from shader_program import ShaderProgram
+
+# Localizações fixas dos atributos, iguais em todas as variantes, para que os VAOs
+# sirvam a qualquer programa (instance_model ocupa 4 localizações)
+ATTRIBUTE_LOCATIONS = {'position': 0, 'texture_coord': 1, 'normals': 2, 'instance_model': 3}
+
+# Unidades de textura dos samplers: a textura dos materiais e os buffer textures das
+# luzes pontuais (ver lights.py)
+SAMPLER_UNITS = {'samplerTexture': 0, 'lightData': 1, 'clusterRanges': 2, 'lightIndices': 3}
+
+# Variantes criadas na inicialização
+#   TEXTURED -> amostra a textura do material (sem ela, a cor base é branca)
+#   EMISSIVE -> fonte de luz: usa a cor da luz, sem calcular iluminação
+#   QUANTIZED -> vértices compactados do arquivo .pack (ver QUANTIZED_VARIANTS)
+VARIANTS = [('TEXTURED',), (), ('EMISSIVE',), ('EMISSIVE', 'TEXTURED')]
+QUANTIZED_VARIANTS = [defines + ('QUANTIZED',) for defines in VARIANTS]
+
+# GLSL vertex shader
+VERTEX_SOURCE = """
+#version 330
+in vec3 position;
+in vec2 texture_coord;
+#ifdef QUANTIZED
+in vec2 normals; // normal octaedrica (ver scene_archive.encode_octahedral)
+uniform vec4 uv_transform; // (x0, y0, largura, altura) das coordenadas de textura quantizadas
+#else
+in vec3 normals;
+#endif
+in mat4 instance_model; // matriz model de cada instancia
+
+out vec2 out_texture;
+out vec3 out_fragPos;
+out vec3 out_normal;
+out float out_viewDepth; // distancia ate a camera ao longo da direcao de visao
+
+uniform mat4 model;
+uniform bool instanced; // desenho instanciado: combina model com instance_model
+
+// dados da camera e da luz, atualizados uma vez por quadro
+layout(std140) uniform Frame {
+    mat4 view;
+    mat4 projection;
+    vec3 viewPos;
+    vec3 lightPos;
+};
+
+#ifdef QUANTIZED
+vec3 decode_normal(vec2 encoded){
+    vec3 n = vec3(encoded, 1.0 - abs(encoded.x) - abs(encoded.y));
+    float t = max(-n.z, 0.0);
+    n.xy -= vec2(n.x >= 0.0 ? t : -t, n.y >= 0.0 ? t : -t);
+    return normalize(n);
+}
+#endif
+
+void main(){
+    mat4 world = instanced ? model * instance_model : model;
+    gl_Position = projection * view * world * vec4(position,1.0);
+#ifdef QUANTIZED
+    out_texture = texture_coord * uv_transform.zw + uv_transform.xy;
+    vec3 normal = decode_normal(normals);
+#else
+    out_texture = vec2(texture_coord);
+    vec3 normal = normals;
+#endif
+    out_fragPos = vec3(  world * vec4(position, 1.0));
+    out_normal = vec3( world *vec4(normal, 1.0));
+    out_viewDepth = -(view * vec4(out_fragPos, 1.0)).z;
+}
+"""
+
+# Glsl fragment shader
+FRAGMENT_SOURCE = """
+#version 330
+layout(std140) uniform Frame {
+    mat4 view;
+    mat4 projection;
+    vec3 viewPos; // define coordenadas com a posicao da camera/observador
+    vec3 lightPos; // define coordenadas de posicao da luz
+};
+const vec3 lightColor = vec3(1.0, 1.0, 1.0);
+
+// luzes pontuais agrupadas por cluster da tela (ver lights.py)
+layout(std140) uniform Lights {
+    vec4 clusterGrid; // tiles em x e y, fatias de profundidade, quantidade de luzes
+    vec4 clusterScale; // tamanho de um tile em pixels, escala e deslocamento da fatia
+};
+uniform samplerBuffer lightData; // 2 texels por luz: (posicao, raio), (cor, intensidade)
+uniform usamplerBuffer clusterRanges; // (primeira posicao em lightIndices, quantidade) de cada cluster
+uniform usamplerBuffer lightIndices; // luzes de cada cluster, em sequencia
+
+uniform float ka; // coeficiente de reflexao ambiente
+uniform float kd; // coeficiente de reflexao difusa
+
+uniform float ks; // coeficiente de reflexao especular
+uniform float ns; // expoente de reflexao especular
+
+in vec2 out_texture; // recebido do vertex shader
+in vec3 out_normal; // recebido do vertex shader
+in vec3 out_fragPos; // recebido do vertex shader
+in float out_viewDepth; // recebido do vertex shader
+uniform sampler2D samplerTexture;
+
+out vec4 fragColor;
+
+void main(){
+
+#ifdef TEXTURED
+    vec4 color = texture(samplerTexture, out_texture);
+#else
+    vec4 color = vec4(1.0);
+#endif
+
+#ifdef EMISSIVE
+    fragColor = vec4(lightColor, 1.0) * color; // fonte de luz: brilha com a cor da luz
+#else
+    vec3 ambient = ka * lightColor; // reflexão ambiente
+
+    vec3 norm = normalize(out_normal); // normaliza vetores perpendiculares
+    vec3 lightDir = normalize(lightPos - out_fragPos); // direcao da luz
+    float diff = max(dot(norm, lightDir), 0.0); // verifica limite angular (entre 0 e 90)
+    vec3 diffuse = kd * diff * lightColor; // iluminacao difusa
+
+    vec3 viewDir = normalize(viewPos - out_fragPos); // direcao do observador/camera
+    vec3 reflectDir = normalize(reflect(-lightDir, norm)); // direcao da reflexao
+    float spec = pow(max(dot(viewDir, reflectDir), 0.0), ns);
+    vec3 specular = ks * spec * lightColor; // reflexão especular
+
+    // luzes pontuais do cluster do fragmento, com atenuacao ate o raio de cada uma
+    if (clusterGrid.w > 0.0) {
+        ivec3 cell = ivec3(vec3(gl_FragCoord.xy / clusterScale.xy, log(max(out_viewDepth, 1e-4)) * clusterScale.z + clusterScale.w));
+        cell = clamp(cell, ivec3(0), ivec3(clusterGrid.xyz) - 1);
+        int cluster = (cell.z * int(clusterGrid.y) + cell.y) * int(clusterGrid.x) + cell.x;
+        uvec2 range = texelFetch(clusterRanges, cluster).xy;
+        for (uint i = 0u; i < range.y; i++) {
+            int light = int(texelFetch(lightIndices, int(range.x + i)).r);
+            vec4 positionRadius = texelFetch(lightData, 2 * light);
+            vec4 colorIntensity = texelFetch(lightData, 2 * light + 1);
+            vec3 toLight = positionRadius.xyz - out_fragPos;
+            float dist = length(toLight);
+            float falloff = clamp(1.0 - dist / positionRadius.w, 0.0, 1.0);
+            vec3 radiance = colorIntensity.rgb * colorIntensity.a * falloff * falloff;
+            vec3 pointDir = toLight / max(dist, 1e-4);
+            diffuse += kd * max(dot(norm, pointDir), 0.0) * radiance;
+            specular += ks * pow(max(dot(viewDir, reflect(-pointDir, norm)), 0.0), ns) * radiance;
+        }
+    }
+
+    vec4 result = vec4((ambient + diffuse + specular),1.0) * color; // aplica iluminacao
+    fragColor = result; // modelo de iluminação
+#endif
+}
+"""
+
+# Variantes dos shaders, compiladas a partir das mesmas fontes com #defines diferentes
+#   Os programas ligados são guardados em disco (glGetProgramBinary) com uma chave
+#   formada pelo hash das fontes e pelo driver (fabricante, renderizador e versão);
+#   nas execuções seguintes são carregados com glProgramBinary, e se o driver
+#   recusar o binário (ou não houver suporte) o programa é compilado de novo
+class ShaderManager:
+
+    "static"
+    cache_dir = os.path.join('cache', 'shaders')
+    enabled = True # Usa o cache de binários
+    programs = {} # Variante (defines ordenados) -> ShaderProgram
+    blocks = [] # UniformBlocks ligados a todos os programas
+    compiled = 0
+    cached = 0 # Programas carregados do cache
+    rejected = 0 # Binários recusados pelo driver
+    binary_formats = None # Formatos de binário aceitos pelo driver (lidos no primeiro uso)
+    compile_time = 0.0
+    load_time = 0.0
+
+    # Fonte com os #defines da variante logo após a linha #version
+    @staticmethod
+    def source(code, defines):
+        version, body = code.strip().split('\n', 1)
+        return '\n'.join([version] + [f'#define {name}' for name in defines] + [body])
+
+    # Identificação do driver: binários de outro driver (ou versão) não são válidos
+    @staticmethod
+    def driver():
+        return '|'.join(glGetString(name).decode() for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+
+    @staticmethod
+    def cache_path(vertex, fragment):
+        sha1 = hashlib.sha1()
+        for part in (ShaderManager.driver(), repr(sorted(ATTRIBUTE_LOCATIONS.items())), vertex, fragment):
+            sha1.update(part.encode() + b'\0')
+        return os.path.join(ShaderManager.cache_dir, sha1.hexdigest() + '.bin')
+
+    @staticmethod
+    def supports_binaries():
+        return bool(glGetProgramBinary) and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+    @staticmethod
+    def compile_shader(kind, code, name):
+        shader = glCreateShader(kind)
+        glShaderSource(shader, code)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            error = glGetShaderInfoLog(shader).decode()
+            print(error)
+            raise RuntimeError(f"Erro de compilacao do {name}")
+        return shader
+
+    # Compila e liga as fontes no programa
+    @staticmethod
+    def link(program, vertex_code, fragment_code):
+        vertex = ShaderManager.compile_shader(GL_VERTEX_SHADER, vertex_code, 'Vertex Shader')
+        fragment = ShaderManager.compile_shader(GL_FRAGMENT_SHADER, fragment_code, 'Fragment Shader')
+        glAttachShader(program, vertex)
+        glAttachShader(program, fragment)
+        for name, location in ATTRIBUTE_LOCATIONS.items():
+            glBindAttribLocation(program, location, name)
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            print(glGetProgramInfoLog(program))
+            raise RuntimeError('Linking error')
+        glDetachShader(program, vertex)
+        glDetachShader(program, fragment)
+        glDeleteShader(vertex)
+        glDeleteShader(fragment)
+
+    # Formatos de binário de programa aceitos pelo driver
+    @staticmethod
+    def supported_formats():
+        if ShaderManager.binary_formats == None:
+            count = glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS)
+            formats = (GLint * max(int(count), 1))()
+            if count > 0:
+                raw_glGetIntegerv(GL_PROGRAM_BINARY_FORMATS, formats) # O wrapper retorna um só valor
+            ShaderManager.binary_formats = set(formats[:int(count)])
+        return ShaderManager.binary_formats
+
+    # Carrega um binário do cache no programa; retorna False se não houver ou for recusado
+    #   Arquivos curtos, de formato não suportado ou recusados pelo glProgramBinary são
+    #   apagados, e o programa é compilado de novo
+    @staticmethod
+    def load_binary(program, path):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return False
+        if len(data) >= 4:
+            binary_format = int.from_bytes(data[:4], 'little')
+            binary = data[4:]
+            if binary_format in ShaderManager.supported_formats():
+                try:
+                    glProgramBinary(program, binary_format, binary, len(binary))
+                    if glGetProgramiv(program, GL_LINK_STATUS):
+                        return True
+                except GLError:
+                    pass
+        ShaderManager.rejected += 1
+        os.remove(path)
+        return False
+
+    # Grava o binário de um programa ligado (escrito em um arquivo temporário e renomeado)
+    @staticmethod
+    def store_binary(program, path):
+        size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if size <= 0:
+            return
+        binary = (ctypes.c_ubyte * size)()
+        length = ctypes.c_int()
+        binary_format = ctypes.c_uint()
+        glGetProgramBinary(program, size, ctypes.byref(length), ctypes.byref(binary_format), binary)
+        os.makedirs(ShaderManager.cache_dir, exist_ok=True)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(binary_format.value.to_bytes(4, 'little'))
+            file.write(bytes(binary)[:length.value])
+        os.replace(path + '.tmp', path)
+
+    # Programa de uma variante (criado na primeira vez)
+    #   defines -> nomes definidos no pré-processador, em qualquer ordem
+    @staticmethod
+    def get(*defines):
+        key = tuple(sorted(defines))
+        shader = ShaderManager.programs.get(key)
+        if shader == None:
+            shader = ShaderManager.programs[key] = ShaderManager.build(key)
+        return shader
+
+    @staticmethod
+    def build(defines):
+        vertex = ShaderManager.source(VERTEX_SOURCE, defines)
+        fragment = ShaderManager.source(FRAGMENT_SOURCE, defines)
+        use_cache = ShaderManager.enabled and ShaderManager.supports_binaries()
+        path = ShaderManager.cache_path(vertex, fragment) if use_cache else None
+
+        program = glCreateProgram()
+        start = time.perf_counter()
+        if use_cache and ShaderManager.load_binary(program, path):
+            ShaderManager.cached += 1
+            ShaderManager.load_time += time.perf_counter() - start
+        else:
+            if use_cache:
+                glDeleteProgram(program) # Um programa que recusou um binário não é reutilizado
+                program = glCreateProgram()
+            ShaderManager.link(program, vertex, fragment)
+            ShaderManager.compiled += 1
+            ShaderManager.compile_time += time.perf_counter() - start
+            if use_cache:
+                ShaderManager.store_binary(program, path)
+
+        shader = ShaderProgram(program)
+        shader.bind_samplers(SAMPLER_UNITS)
+        for block in ShaderManager.blocks:
+            shader.bind_block(block)
+        return shader
+
+    # Cria antecipadamente as variantes usadas pela cena (evita compilar durante um quadro)
+    @staticmethod
+    def preload(variants=VARIANTS):
+        for defines in variants:
+            ShaderManager.get(*defines)
+
+    # Apaga os binários guardados
+    @staticmethod
+    def purge():
+        if os.path.isdir(ShaderManager.cache_dir):
+            for name in os.listdir(ShaderManager.cache_dir):
+                os.remove(os.path.join(ShaderManager.cache_dir, name))
+
+    # Retorna e exibe o tempo gasto compilando e carregando programas do cache
+    @staticmethod
+    def report():
+        stats = {
+            'programs': len(ShaderManager.programs),
+            'compiled': ShaderManager.compiled,
+            'cached': ShaderManager.cached,
+            'rejected': ShaderManager.rejected,
+            'compile_s': round(ShaderManager.compile_time, 4),
+            'load_s': round(ShaderManager.load_time, 4),
+        }
+        print(f'Shaders: {stats["programs"]} variants, {stats["compiled"]} compiled in {ShaderManager.compile_time * 1000:.1f} ms, '
+              f'{stats["cached"]} loaded from cache in {ShaderManager.load_time * 1000:.1f} ms, {stats["rejected"]} rejected')
+        return stats
@@ -0,0 +1,120 @@
+import numpy as np
+from OpenGL.GL import *
+
+# Buffer de uniforms (std140) compartilhado pelos shaders através de um ponto de ligação
+#   Os dados só são reenviados quando mudam
+class UniformBlock:
+
+    def __init__(self, name, binding, size):
+        self.name = name
+        self.binding = binding
+        self.size = size
+        self.data = None
+        self.ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.ubo)
+
+    def update(self, data):
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if self.data is not None and np.array_equal(self.data, data):
+            return
+        self.data = data.copy()
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+
+# Dados da câmera e da luz, atualizados uma vez por quadro
+#   layout(std140): view (64 bytes), projection (64), viewPos (16), lightPos (16)
+class FrameBlock(UniformBlock):
+
+    def __init__(self, binding=0):
+        super().__init__('Frame', binding, 160)
+
+    # view e projection no formato de np.array(glm.mat4) (linha por linha)
+    def set(self, view, projection, view_pos, light_pos):
+        data = np.zeros(40, dtype=np.float32)
+        data[0:16] = np.asarray(view, dtype=np.float32).T.ravel() # std140 guarda matrizes por coluna
+        data[16:32] = np.asarray(projection, dtype=np.float32).T.ravel()
+        data[32:35] = tuple(view_pos)
+        data[36:39] = tuple(light_pos)
+        self.update(data)
+
+# Parâmetros das luzes pontuais do quadro (ver lights.py)
+#   layout(std140): clusterGrid (tiles em x e y, fatias, quantidade de luzes) e
+#   clusterScale (tamanho de um tile em pixels, escala e deslocamento da fatia)
+class LightBlock(UniformBlock):
+
+    def __init__(self, binding=1):
+        super().__init__('Lights', binding, 32)
+
+    def set(self, grid, scale):
+        self.update(np.array(tuple(grid) + tuple(scale), dtype=np.float32))
+
+# Programa GLSL com as localizações dos uniforms resolvidas na construção
+#   Os valores enviados ficam guardados para evitar envios repetidos
+class ShaderProgram:
+
+    def __init__(self, program):
+        self.program = program
+        self.locations = {}
+        self.values = {}
+        count = glGetProgramiv(program, GL_ACTIVE_UNIFORMS)
+        for i in range(count):
+            name = glGetActiveUniform(program, i)[0].decode()
+            location = glGetUniformLocation(program, name)
+            if location >= 0: # Uniforms de blocos não possuem localização
+                self.locations[name] = location
+
+    def use(self):
+        glUseProgram(self.program)
+
+    # Liga um bloco de uniforms do programa ao ponto de ligação do UniformBlock
+    def bind_block(self, block):
+        index = glGetUniformBlockIndex(self.program, block.name)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(self.program, index, block.binding)
+
+    # Associa os samplers do programa às unidades de textura {nome: unidade}
+    #   Ativa o programa temporariamente, restaurando o programa atual
+    def bind_samplers(self, units):
+        current = glGetIntegerv(GL_CURRENT_PROGRAM)
+        glUseProgram(self.program)
+        for name, unit in units.items():
+            if name in self.locations:
+                glUniform1i(self.locations[name], unit)
+        glUseProgram(current)
+
+    # Retorna True se o valor mudou desde o último envio
+    def changed(self, name, value):
+        if name not in self.locations:
+            return False
+        if self.values.get(name) == value:
+            return False
+        self.values[name] = value
+        return True
+
+    def set_float(self, name, value):
+        value = float(value)
+        if self.changed(name, value):
+            glUniform1f(self.locations[name], value)
+
+    def set_int(self, name, value):
+        value = int(value)
+        if self.changed(name, value):
+            glUniform1i(self.locations[name], value)
+
+    def set_vec3(self, name, x, y, z):
+        value = (float(x), float(y), float(z))
+        if self.changed(name, value):
+            glUniform3f(self.locations[name], *value)
+
+    def set_vec4(self, name, x, y, z, w):
+        value = (float(x), float(y), float(z), float(w))
+        if self.changed(name, value):
+            glUniform4f(self.locations[name], *value)
+
+    # matrix no formato de np.array(glm.mat4) (linha por linha)
+    def set_mat4(self, name, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if self.changed(name, matrix.tobytes()):
+            glUniformMatrix4fv(self.locations[name], 1, GL_TRUE, matrix)
@@ -0,0 +1,305 @@
+import numpy as np
+from model import InstancedModel
+from model_manager import ModelManager
+from scene_graph import SceneGraph
+
+# Combinações (0/1 por eixo) dos cantos de um bloco de 2x2x2 células
+CORNERS = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=np.int64)
+
+# Expande intervalos [start, start + count) em um único array de índices
+#   Retorna (índice do intervalo de cada elemento, índices)
+def expand_ranges(starts, counts):
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+# Produto vetorial linha a linha de arrays (n, 3) (np.cross tem custo fixo alto para arrays pequenos)
+def cross(x, y):
+    result = np.empty(np.broadcast_shapes(x.shape, y.shape))
+    result[:, 0] = x[:, 1] * y[:, 2] - x[:, 2] * y[:, 1]
+    result[:, 1] = x[:, 2] * y[:, 0] - x[:, 0] * y[:, 2]
+    result[:, 2] = x[:, 0] * y[:, 1] - x[:, 1] * y[:, 0]
+    return result
+
+# Interseção de raios com triângulos (Möller–Trumbore), um par raio/triângulo por linha
+#   Retorna a distância ao longo de cada raio (inf se não houver interseção); os dois lados contam
+def intersect_triangles(origins, directions, a, b, c):
+    e1 = b - a
+    e2 = c - a
+    p = cross(directions, e2)
+    det = np.einsum('ij,ij->i', e1, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = 1.0 / det
+        s = origins - a
+        u = np.einsum('ij,ij->i', s, p) * inv
+        q = cross(s, e1)
+        v = np.einsum('ij,ij->i', directions, q) * inv
+        t = np.einsum('ij,ij->i', e2, q) * inv
+        hit = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+# Ponto de cada triângulo mais próximo de cada ponto p (Ericson, Real-Time Collision Detection)
+#   As regiões são aplicadas da última para a primeira, então a primeira que vale prevalece
+def closest_points(p, a, b, c):
+    dot = lambda x, y: np.einsum('ij,ij->i', x, y)
+    ab, ac = b - a, c - a
+    ap, bp, cp = p - a, p - b, p - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = 1.0 / (va + vb + vc)
+        result = a + ab * (vb * denom)[:, None] + ac * (vc * denom)[:, None] # Interior
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        result = np.where(((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0))[:, None], b + (c - b) * w[:, None], result) # Aresta BC
+        w = d2 / (d2 - d6)
+        result = np.where(((vb <= 0) & (d2 >= 0) & (d6 <= 0))[:, None], a + ac * w[:, None], result) # Aresta AC
+        result = np.where(((d6 >= 0) & (d5 <= d6))[:, None], c, result) # Vértice C
+        v = d1 / (d1 - d3)
+        result = np.where(((vc <= 0) & (d1 >= 0) & (d3 <= 0))[:, None], a + ab * v[:, None], result) # Aresta AB
+        result = np.where(((d3 >= 0) & (d4 <= d3))[:, None], b, result) # Vértice B
+        result = np.where(((d1 <= 0) & (d2 <= 0))[:, None], a, result) # Vértice A
+    return result
+
+# Índice espacial dos triângulos dos modelos estáticos, em coordenadas do mundo
+#   Grade uniforme sobre a caixa envolvente da cena: cada triângulo é registrado em
+#   todas as células que a sua caixa envolvente toca, e as listas das células ficam
+#   em um único array (cell_start/cell_triangles)
+#   As consultas são vetorizadas: as células percorridas pelos raios (ou tocadas pela
+#   esfera) são reunidas, os triângulos candidatos são extraídos de uma vez e
+#   testados com as funções acima
+#   A câmera faz as mesmas consultas em posições próximas a cada quadro: os candidatos da
+#   coluna de células abaixo dela (ground_height) e do bloco de células tocado pela esfera
+#   (sphere_contacts) são guardados e reaproveitados enquanto ela não muda de célula
+class SpatialIndex:
+
+    # triangles -> array (n, 3, 3) de triângulos no mundo
+    # owners -> índice em names do modelo de cada triângulo
+    # target -> quantidade média de triângulos desejada por célula
+    def __init__(self, triangles, owners, names, target=2, max_cells=128):
+        self.triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.names = list(names)
+        count = len(self.triangles)
+
+        self.low = self.triangles.min(axis=(0, 1)) - 1e-4 if count else np.zeros(3)
+        self.high = self.triangles.max(axis=(0, 1)) + 1e-4 if count else np.ones(3)
+        extent = self.high - self.low
+        cell = (np.prod(extent) * target / max(count, 1)) ** (1 / 3)
+        self.dims = np.clip(np.ceil(extent / cell), 1, max_cells).astype(np.int64)
+        self.cell_size = extent / self.dims
+
+        # Células tocadas pela caixa envolvente de cada triângulo
+        first = self.cell_coords(self.triangles.min(axis=1))
+        last = self.cell_coords(self.triangles.max(axis=1))
+        span = last - first + 1
+        triangle, offsets = expand_ranges(np.zeros(count, dtype=np.int64), np.prod(span, axis=1))
+        span = span[triangle]
+        coords = first[triangle] + np.stack([
+            offsets % span[:, 0],
+            offsets // span[:, 0] % span[:, 1],
+            offsets // (span[:, 0] * span[:, 1]),
+        ], axis=1)
+        cells = self.cell_ids(coords)
+        self.cell_triangles = triangle[np.argsort(cells, kind='stable')]
+        self.cell_start = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=int(np.prod(self.dims))))])
+        self.column = (None, None) # (x e z da coluna, triângulos) da última consulta de chão
+        self.block = (None, None) # (primeira e última célula, triângulos) da última esfera
+
+    # Constrói o índice com os modelos da cena (ModelManager.models) de nomes dados
+    #   Modelos instanciados contribuem com todas as instâncias
+    #   Os modelos precisam manter seus arrays (ModelManager.keep_geometry)
+    @staticmethod
+    def from_models(names):
+        SceneGraph.update()
+        triangles = []
+        owners = []
+        for owner, name in enumerate(names):
+            model = ModelManager.models[name]
+            model.require_geometry()
+            local = np.asarray(model.vertices, dtype=np.float64)[np.asarray(model.indices).reshape(-1, 3)]
+            matrices = model.model_matrix()[None]
+            if isinstance(model, InstancedModel):
+                matrices = matrices @ model.instance_matrices.astype(np.float64)
+            for matrix in matrices:
+                triangles.append(local @ matrix[:3, :3].T + matrix[:3, 3])
+                owners.append(np.full(len(local), owner))
+        if not triangles:
+            return SpatialIndex(np.zeros((0, 3, 3)), np.zeros(0), names)
+        return SpatialIndex(np.concatenate(triangles), np.concatenate(owners), names)
+
+    # Coordenadas inteiras (limitadas à grade) das células que contêm os pontos
+    def cell_coords(self, points):
+        coords = np.floor((points - self.low) / self.cell_size).astype(np.int64)
+        return np.clip(coords, 0, self.dims - 1)
+
+    def cell_ids(self, coords):
+        return (coords[:, 0] * self.dims[1] + coords[:, 1]) * self.dims[2] + coords[:, 2]
+
+    # Triângulos candidatos de pares (consulta, célula), sem repetições
+    #   Retorna (consulta, triângulo) de cada candidato
+    def gather(self, queries, cells):
+        starts = self.cell_start[cells]
+        pair, indices = expand_ranges(starts, self.cell_start[cells + 1] - starts)
+        count = len(self.triangles)
+        keys = np.unique(queries[pair] * count + self.cell_triangles[indices])
+        return keys // count, keys % count
+
+    # Células percorridas por segmentos de raio entre as distâncias t0 e t1
+    #   Os raios são amostrados de forma que amostras vizinhas avancem no máximo uma
+    #   célula em cada eixo; cada par de amostras vizinhas contribui com as células da
+    #   sua caixa envolvente (no máximo 2 por eixo)
+    #   Retorna (raio, célula) de cada par
+    def segment_cells(self, origins, directions, t0, t1):
+        with np.errstate(divide='ignore'):
+            step = (self.cell_size / np.abs(directions)).min(axis=1)
+        samples = np.ceil((t1 - t0) / step).astype(np.int64) + 1
+        ray, index = expand_ranges(np.zeros(len(samples), dtype=np.int64), samples)
+        t = np.minimum(t0[ray] + index * step[ray], t1[ray])
+        points = (origins[ray] + directions[ray] * t[:, None] - self.low) / self.cell_size
+        following = np.minimum(np.arange(len(ray)) + 1, len(ray) - 1)
+        same = ray[following] == ray
+        following = np.where(same, following, np.arange(len(ray)))
+        first = np.floor(np.minimum(points, points[following])).astype(np.int64)
+        last = np.floor(np.maximum(points, points[following])).astype(np.int64)
+        coords = first[:, None, :] + CORNERS[None] * (last - first)[:, None, :]
+        coords = np.clip(coords.reshape(-1, 3), 0, self.dims - 1)
+        keys = np.unique(np.repeat(ray, len(CORNERS)) * int(np.prod(self.dims)) + self.cell_ids(coords))
+        return keys // int(np.prod(self.dims)), keys % int(np.prod(self.dims))
+
+    # Lança vários raios de uma vez
+    #   origins, directions -> arrays (n, 3); as direções não precisam ser unitárias
+    #   max_distance -> distância máxima (escalar ou array)
+    #   only -> nomes dos modelos considerados (None: todos)
+    #   Retorna (distância, triângulo); raios sem interseção têm inf e -1
+    def raycast(self, origins, directions, max_distance=np.inf, only=None):
+        origins = np.atleast_2d(np.asarray(origins, dtype=np.float64))
+        directions = np.atleast_2d(np.asarray(directions, dtype=np.float64))
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        count = len(origins)
+        distances = np.full(count, np.inf)
+        triangles = np.full(count, -1)
+        if not len(self.triangles):
+            return distances, triangles
+
+        # Trecho de cada raio dentro da grade (teste das placas)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1.0 / directions
+            near = (self.low - origins) * inverse
+            far = (self.high - origins) * inverse
+        near = np.where(np.isnan(near), -np.inf, near)
+        far = np.where(np.isnan(far), np.inf, far)
+        t0 = np.maximum(np.minimum(near, far).max(axis=1), 0)
+        t1 = np.minimum(np.maximum(near, far).min(axis=1), np.broadcast_to(max_distance, (count,)))
+        rays = np.flatnonzero(t0 <= t1)
+        if not len(rays):
+            return distances, triangles
+
+        ray, cells = self.segment_cells(origins[rays], directions[rays], t0[rays], t1[rays])
+        ray, triangle = self.gather(ray, cells)
+        if only != None:
+            allowed = np.isin(self.owners[triangle], [self.names.index(name) for name in only])
+            ray, triangle = ray[allowed], triangle[allowed]
+        corners = self.triangles[triangle]
+        t = intersect_triangles(origins[rays][ray], directions[rays][ray], corners[:, 0], corners[:, 1], corners[:, 2])
+        hit = t <= t1[rays][ray]
+        ray, triangle, t = ray[hit], triangle[hit], t[hit]
+
+        # Interseção mais próxima de cada raio
+        order = np.lexsort((t, ray))
+        ray, triangle, t = ray[order], triangle[order], t[order]
+        first = np.concatenate([[True], ray[1:] != ray[:-1]]) if len(ray) else np.zeros(0, dtype=bool)
+        distances[rays[ray[first]]] = t[first]
+        triangles[rays[ray[first]]] = triangle[first]
+        return distances, triangles
+
+    # Triângulos da coluna de células que contém a posição (x e z), do chão ao teto da grade
+    def column_triangles(self, position):
+        coords = self.cell_coords(position[None])[0]
+        key = (coords[0], coords[2])
+        if self.column[0] != key:
+            column = np.zeros((self.dims[1], 3), dtype=np.int64)
+            column[:, 0], column[:, 1], column[:, 2] = coords[0], np.arange(self.dims[1]), coords[2]
+            cells = self.cell_ids(column)
+            self.column = (key, self.gather(np.zeros(len(cells), dtype=np.int64), cells)[1])
+        return self.column[1]
+
+    # Altura do chão abaixo de cada posição (array (n, 3)); nan onde não há chão
+    #   Uma única posição é testada contra os triângulos da sua coluna, sem percorrer o raio
+    def ground_height(self, positions, only=None):
+        positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        if len(positions) == 1 and only == None:
+            position = positions[0]
+            if not len(self.triangles) or np.any(position[[0, 2]] < self.low[[0, 2]]) or np.any(position[[0, 2]] > self.high[[0, 2]]):
+                return np.array([np.nan])
+            corners = self.triangles[self.column_triangles(position)]
+            down = np.broadcast_to(np.array([0.0, -1.0, 0.0]), (len(corners), 3))
+            t = intersect_triangles(np.broadcast_to(position, (len(corners), 3)), down, corners[:, 0], corners[:, 1], corners[:, 2])
+            return np.array([position[1] - t.min() if len(t) and np.isfinite(t.min()) else np.nan])
+        down = np.broadcast_to(np.array([0.0, -1.0, 0.0]), positions.shape)
+        distances, _ = self.raycast(positions, down, only=only)
+        return np.where(np.isfinite(distances), positions[:, 1] - distances, np.nan)
+
+    # Modelo atingido por um raio: (nome, distância, ponto) ou None
+    def pick(self, origin, direction, max_distance=np.inf):
+        distances, triangles = self.raycast(origin, direction, max_distance)
+        if triangles[0] < 0:
+            return None
+        direction = np.asarray(direction, dtype=np.float64)
+        point = np.asarray(origin, dtype=np.float64) + direction / np.linalg.norm(direction) * distances[0]
+        return self.names[self.owners[triangles[0]]], float(distances[0]), point
+
+    # Triângulos (e seus pontos mais próximos do centro) a menos de radius de uma esfera
+    #   Retorna (triângulos, pontos mais próximos, distâncias)
+    def sphere_contacts(self, center, radius):
+        center = np.asarray(center, dtype=np.float64)
+        if np.any(center + radius < self.low) or np.any(center - radius > self.high) or not len(self.triangles):
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros(0)
+        first = self.cell_coords((center - radius)[None])[0]
+        last = self.cell_coords((center + radius)[None])[0]
+        key = (tuple(first), tuple(last))
+        if self.block[0] != key:
+            coords = np.stack(np.meshgrid(*[np.arange(a, b + 1) for a, b in zip(first, last)], indexing='ij'), axis=-1).reshape(-1, 3)
+            cells = self.cell_ids(coords)
+            self.block = (key, self.gather(np.zeros(len(cells), dtype=np.int64), cells)[1])
+        triangle = self.block[1]
+        corners = self.triangles[triangle]
+        points = closest_points(np.broadcast_to(center, (len(triangle), 3)), corners[:, 0], corners[:, 1], corners[:, 2])
+        distances = np.linalg.norm(center - points, axis=1)
+        near = distances < radius
+        return triangle[near], points[near], distances[near]
+
+    # Move uma esfera de start até end sem atravessar a geometria
+    #   Passos maiores que o raio testam o trajeto do centro com um raio (para não
+    #   atravessar paredes finas); no destino, a esfera é empurrada para fora dos
+    #   triângulos que a penetram, o mais fundo primeiro
+    def move_sphere(self, start, end, radius, iterations=4):
+        start = np.asarray(start, dtype=np.float64)
+        end = np.asarray(end, dtype=np.float64)
+        delta = end - start
+        length = np.linalg.norm(delta)
+        if length >= radius:
+            distances, _ = self.raycast(start, delta, length + radius)
+            if np.isfinite(distances[0]):
+                end = start + delta / length * max(min(length, distances[0] - radius), 0)
+
+        position = end
+        for _ in range(iterations):
+            triangle, points, distances = self.sphere_contacts(position, radius)
+            if not len(triangle):
+                break
+            deepest = np.argmin(distances)
+            offset = position - points[deepest]
+            if distances[deepest] > 1e-9:
+                normal = offset / distances[deepest]
+            else:
+                a, b, c = self.triangles[triangle[deepest]]
+                normal = np.cross(b - a, c - a)
+                normal /= np.linalg.norm(normal)
+                normal = normal if np.dot(normal, start - a) >= 0 else -normal
+            position = position + normal * (radius - distances[deepest])
+        return position
@@ -0,0 +1,237 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from model import Model, LightModel, Coord3d
+from model_manager import ModelManager
+from texture_manager import TextureManager
+
+# Caixa unitária (vértice x * 4 + y * 2 + z) usada como malha provisória
+BOX_CORNERS = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float32)
+BOX_INDICES = np.array([
+    0, 1, 3, 0, 3, 2, # -x
+    4, 6, 7, 4, 7, 5, # +x
+    0, 4, 5, 0, 5, 1, # -y
+    2, 3, 7, 2, 7, 6, # +y
+    0, 2, 6, 0, 6, 4, # -z
+    1, 5, 7, 1, 7, 3, # +z
+], dtype=np.uint32)
+
+# Malha de uma caixa com os limites pedidos, no formato de geometry.build_mesh
+def box_mesh(low, high):
+    low = np.asarray(low, dtype=np.float32)
+    high = np.asarray(high, dtype=np.float32)
+    normals = BOX_CORNERS - 0.5
+    mesh = {}
+    mesh['vertices'] = low + BOX_CORNERS * (high - low)
+    mesh['texture_coords'] = np.zeros((8, 2), dtype=np.float32)
+    mesh['normals'] = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+    mesh['indices'] = BOX_INDICES
+    mesh['materials'] = np.zeros(len(BOX_INDICES) // 3, dtype=np.int32)
+    return mesh
+
+# Modelo provisório (caixa envolvente sem textura) desenhado enquanto o modelo real carrega
+class ProxyModel(Model):
+
+    __slots__ = ()
+
+    def material(self, index, ka, kd, ks, ns):
+        return (ka, kd, ks, ns)
+
+    def draw_texture(self, index):
+        return 0
+
+    # Ajusta a caixa aos limites do modelo real, assim que a malha é lida
+    def resize(self, low, high):
+        mesh = box_mesh(low, high)
+        self.vertices = mesh['vertices']
+        self.normals = mesh['normals']
+        self.bounds_min = np.asarray(low, dtype=np.float64)
+        self.bounds_max = np.asarray(high, dtype=np.float64)
+        self.sphere_center = (self.bounds_min + self.bounds_max) / 2
+        self.sphere_radius = float(np.linalg.norm(self.bounds_max - self.bounds_min) / 2)
+        if self.arena != None:
+            self.arena.write_vertices(self.start_vertex, self.arena.vertex_data(self))
+
+    # A caixa é pequena e reescrita por resize, então seus arrays são mantidos
+    def release_geometry(self):
+        pass
+
+# Provisório de uma fonte de luz: continua fornecendo a posição da luz
+class ProxyLightModel(ProxyModel, LightModel):
+    __slots__ = ()
+
+# Estado do carregamento de um modelo
+#   state -> 'loading' (lendo/enviando), 'ready' (modelo real na cena) ou 'unloaded'
+class StreamEntry:
+
+    def __init__(self, name, model_dir, kwargs):
+        self.name = name
+        self.model_dir = model_dir
+        self.kwargs = kwargs
+        self.state = 'loading'
+        self.jobs = {}
+        self.steps = None # Gerador com os passos do carregamento na thread do OpenGL
+        self.proxy = None
+        self.model = None
+
+# Carregamento de modelos em segundo plano
+#   request() coloca um modelo provisório na cena e lê o .obj e as texturas em threads
+#   update(), chamado uma vez por quadro, executa os envios para a GPU (uma textura ou
+#   um pedaço dos buffers por passo) até gastar budget_ms do quadro, e troca o
+#   provisório pelo modelo real quando tudo foi enviado
+#   Com unload_distance, modelos longe da câmera voltam a ser caixas e liberam seu
+#   espaço na arena e seus arrays; são carregados de novo ao se aproximar
+class StreamingLoader:
+
+    "static"
+    budget_ms = 2.0 # Tempo por quadro para envios à GPU (ao menos um passo por quadro)
+    chunk_vertices = 1 << 14 # Vértices por passo (índices: 3x)
+    workers = 2
+    unload_distance = None # Distância da câmera para descarregar (None: nunca)
+    reload_margin = 0.8 # Recarrega abaixo de unload_distance * reload_margin
+    executor = None
+    entries = {}
+    frame_ms = 0.0 # Tempo gasto no último update()
+    loads = 0
+    unloads = 0
+
+    # Pede o carregamento de um modelo (mesmos argumentos de ModelManager.load_model)
+    @staticmethod
+    def request(model_dir, name=None, light_source=False, angle=0, r=Coord3d(0.0,1.0,0.0), t=Coord3d(0.0,0.0,0.0), s=Coord3d(1.0,1.0,1.0), parent=None, textures=None, materials=None):
+        name = name or model_dir
+        if ModelManager.arena == None:
+            ModelManager.send_to_GPU()
+        parent = ModelManager.models[parent] if parent != None else None
+        proxy_class = ProxyLightModel if light_source else ProxyModel
+        proxy = proxy_class(box_mesh(np.zeros(3), np.zeros(3)), angle, r, t, s, parent)
+        ModelManager.add_model(name, proxy)
+
+        entry = StreamEntry(name, model_dir, {'light_source': light_source, 'textures': textures, 'materials': materials})
+        entry.proxy = proxy
+        StreamingLoader.entries[name] = entry
+        StreamingLoader.start(entry)
+        return proxy
+
+    @staticmethod
+    def start(entry):
+        if StreamingLoader.executor == None:
+            StreamingLoader.executor = ThreadPoolExecutor(max_workers=StreamingLoader.workers)
+        entry.state = 'loading'
+        entry.jobs = ModelManager.submit_jobs(StreamingLoader.executor, entry.model_dir, {})
+        entry.steps = StreamingLoader.load_steps(entry)
+
+    # Passos do carregamento de um modelo na thread do OpenGL
+    #   Cada yield encerra um passo; yield False indica que nada foi feito (esperando as threads)
+    @staticmethod
+    def load_steps(entry):
+        proxy = entry.proxy
+        obj = [job for filepath, job in entry.jobs.items() if filepath.endswith('.obj')]
+        while not all(job.done() for job in entry.jobs.values()):
+            yield False
+        if obj and proxy.sphere_radius == 0:
+            mesh = obj[0].result()
+            proxy.resize(np.min(mesh['vertices'], axis=0), np.max(mesh['vertices'], axis=0))
+            yield True
+
+        # Texturas, uma por passo (passadas para read_model_dir, que não as lê de novo)
+        loaded = {}
+        for filepath, job in entry.jobs.items():
+            if filepath.endswith(('.jpg', '.png')):
+                loaded[filepath] = TextureManager.load(filepath, *job.result())
+                yield True
+
+        model_class = LightModel if entry.kwargs['light_source'] else Model
+        model = ModelManager.read_model_dir(
+            entry.model_dir,
+            lambda mesh: model_class(mesh, proxy.angle, proxy.r, proxy.t, proxy.s, proxy.parent, node=proxy.node),
+            entry.jobs,
+            entry.kwargs['textures'],
+            entry.kwargs['materials'],
+            loaded,
+        )
+        yield True
+
+        # Geometria, em pedaços de chunk_vertices
+        arena = ModelManager.arena_for(model) # Arena compacta para modelos do arquivo .pack
+        vertices = arena.vertex_data(model)
+        indices = np.concatenate(model.lods)
+        vertex_start, index_start = arena.allocate(len(vertices), len(indices))
+        chunk = StreamingLoader.chunk_vertices
+        for first in range(0, len(vertices), chunk):
+            arena.write_vertices(vertex_start + first, vertices[first:first + chunk])
+            yield True
+        for first in range(0, len(indices), 3 * chunk):
+            arena.write_indices(index_start + first, indices[first:first + 3 * chunk] + np.uint32(vertex_start))
+            yield True
+        arena.assign(model, vertex_start, index_start)
+        ModelManager.release_geometry(entry.name, model)
+
+        # Troca o provisório pelo modelo real
+        ModelManager.models[entry.name] = model
+        proxy.arena.free(proxy)
+        entry.proxy = None
+        entry.model = model
+        entry.jobs = {}
+        entry.state = 'ready'
+        StreamingLoader.loads += 1
+
+    # Volta a desenhar a caixa no lugar de um modelo e libera seus dados
+    @staticmethod
+    def unload(entry):
+        model = entry.model
+        proxy_class = ProxyLightModel if entry.kwargs['light_source'] else ProxyModel
+        proxy = proxy_class(box_mesh(model.bounds_min, model.bounds_max), model.angle, model.r, model.t, model.s, model.parent, node=model.node)
+        ModelManager.arena.upload(proxy)
+        ModelManager.models[entry.name] = proxy
+        model.arena.free(model)
+        entry.proxy = proxy
+        entry.model = None
+        entry.state = 'unloaded'
+        StreamingLoader.unloads += 1
+
+    # Descarrega os modelos longe da câmera e recarrega os que voltaram a ficar perto
+    @staticmethod
+    def update_residency(camera_pos):
+        camera = np.asarray(tuple(camera_pos), dtype=np.float64)
+        for entry in StreamingLoader.entries.values():
+            model = ModelManager.models[entry.name]
+            matrix = model.model_matrix()
+            center = matrix[:3, :3] @ model.sphere_center + matrix[:3, 3]
+            distance = np.linalg.norm(center - camera)
+            if entry.state == 'ready' and distance > StreamingLoader.unload_distance:
+                StreamingLoader.unload(entry)
+            elif entry.state == 'unloaded' and distance < StreamingLoader.unload_distance * StreamingLoader.reload_margin:
+                StreamingLoader.start(entry)
+
+    # Executa os passos pendentes dentro do orçamento de tempo do quadro
+    #   camera_pos -> posição da câmera, usada para descarregar modelos distantes
+    @staticmethod
+    def update(camera_pos=None):
+        start = time.perf_counter()
+        deadline = start + StreamingLoader.budget_ms / 1000
+        for entry in StreamingLoader.entries.values():
+            while entry.steps != None:
+                try:
+                    worked = next(entry.steps)
+                except StopIteration:
+                    entry.steps = None
+                    break
+                if not worked or time.perf_counter() >= deadline:
+                    break
+            if time.perf_counter() >= deadline:
+                break
+        if camera_pos is not None and StreamingLoader.unload_distance != None:
+            StreamingLoader.update_residency(camera_pos)
+        StreamingLoader.frame_ms = (time.perf_counter() - start) * 1000
+
+    # Quantidade de modelos ainda carregando
+    @staticmethod
+    def pending():
+        return sum(entry.state == 'loading' for entry in StreamingLoader.entries.values())
+
+    # Encerra as threads de leitura
+    @staticmethod
+    def shutdown():
+        if StreamingLoader.executor != None:
+            StreamingLoader.executor.shutdown(wait=False, cancel_futures=True)
+            StreamingLoader.executor = None
@@ -0,0 +1,224 @@
+import hashlib
+from OpenGL.GL import *
+from PIL import Image
+from mesh_cache import file_hash
+
+# Decodifica uma imagem de textura (não depende de contexto OpenGL)
+#   max_size -> reduz a imagem para que o maior lado tenha no máximo max_size pixels
+#   Retorna largura, altura e os bytes RGB com as linhas de baixo para cima
+def decode_texture(img_filepath, max_size=None):
+    img = Image.open(img_filepath)
+    img = img.convert('RGB') # Caso seja .png
+    if max_size != None and max(img.size) > max_size:
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+    img_width = img.size[0]
+    img_height = img.size[1]
+    image_data = img.tobytes("raw", "RGB", 0, -1)
+    return img_width, img_height, image_data
+
+# Textura gerenciada pelo TextureManager
+#   id é None enquanto a textura não estiver na GPU (ainda não enviada ou descartada)
+class Texture:
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.id = None
+        self.width = 0
+        self.height = 0
+        self.nbytes = 0
+        self.last_used = -1 # Último quadro em que a textura foi usada
+        self.levels = None # Níveis pré-decodificados (ver scene_archive.py), reenviados após um descarte
+
+    # Ativa a textura, enviando-a de novo para a GPU se tiver sido descartada
+    def bind(self):
+        TextureManager.use(self)
+        glBindTexture(GL_TEXTURE_2D, self.id)
+
+class TextureManager:
+
+    "static"
+    mipmaps = True # Gera mipmaps (menos banda na leitura de texturas distantes)
+    max_size = None # Maior lado das texturas em pixels (versões reduzidas)
+    compressed = False # Deixa o driver comprimir as texturas na GPU
+    budget = None # Limite de memória de vídeo em bytes (None: sem limite)
+    idle_frames = 60 # Quadros sem uso para uma textura ser descartada ao fim de um quadro
+
+    by_file = {} # hash do arquivo -> Texture
+    by_pixels = {} # hash da imagem decodificada -> Texture
+    by_path = {} # arquivo -> Texture da última leitura (ver reload)
+    textures = [] # Texturas únicas
+    resident_bytes = 0
+    frame = 0
+    uploads = 0
+    evictions = 0
+    duplicates = 0
+
+    # Calcula o hash de um arquivo de textura e o decodifica se ele ainda não foi carregado
+    #   Não depende de contexto OpenGL (usado nas threads de carregamento)
+    #   Retorna (imagem ou None, hash do arquivo), os argumentos image e file_key de load
+    @staticmethod
+    def read(filepath):
+        file_key = file_hash(filepath)
+        if file_key in TextureManager.by_file:
+            return None, file_key
+        return decode_texture(filepath, TextureManager.max_size), file_key
+
+    # Carrega uma textura, reaproveitando texturas com o mesmo conteúdo
+    #   image, file_key -> imagem decodificada e hash do arquivo já calculados por read
+    #   (carregamento em paralelo)
+    @staticmethod
+    def load(filepath, image=None, file_key=None):
+        if file_key == None:
+            file_key = file_hash(filepath)
+        if file_key in TextureManager.by_file:
+            TextureManager.duplicates += 1
+            TextureManager.by_path[filepath] = TextureManager.by_file[file_key]
+            return TextureManager.by_file[file_key]
+
+        if image == None:
+            image = decode_texture(filepath, TextureManager.max_size)
+        width, height, data = image
+        pixels_key = hashlib.sha1(f'{width}x{height}'.encode() + data).hexdigest()
+        if pixels_key in TextureManager.by_pixels:
+            TextureManager.duplicates += 1
+            texture = TextureManager.by_pixels[pixels_key]
+        else:
+            texture = Texture(filepath)
+            TextureManager.upload(texture, image)
+            TextureManager.by_pixels[pixels_key] = texture
+            TextureManager.textures.append(texture)
+        TextureManager.by_file[file_key] = texture
+        TextureManager.by_path[filepath] = texture
+        return texture
+
+    # Lê de novo um arquivo de textura alterado (ver hot_reload.py)
+    #   Retorna (textura antiga, textura nova); quem usava a antiga deve passar a usar a
+    #   nova. A antiga é descartada da GPU quando nenhum outro arquivo a compartilha
+    @staticmethod
+    def reload(filepath, image=None, file_key=None):
+        old = TextureManager.by_path.pop(filepath, None)
+        texture = TextureManager.load(filepath, image, file_key)
+        if old != None and old is not texture and old not in TextureManager.by_path.values():
+            TextureManager.discard(old)
+        return old, texture
+
+    # Remove uma textura do gerenciador e da GPU
+    @staticmethod
+    def discard(texture):
+        if texture.id != None:
+            glDeleteTextures(1, [texture.id])
+            texture.id = None
+            TextureManager.resident_bytes -= texture.nbytes
+        TextureManager.textures.remove(texture)
+        for table in (TextureManager.by_file, TextureManager.by_pixels):
+            for key in [key for key, value in table.items() if value is texture]:
+                del table[key]
+
+    # Carrega uma textura já decodificada, com todos os níveis de mipmap (ver scene_archive.py)
+    #   key -> hash dos pixels do nível base, o mesmo usado por load()
+    #   levels -> [(largura, altura, bytes RGB)] do maior nível para o menor
+    @staticmethod
+    def load_levels(filepath, key, levels):
+        if key in TextureManager.by_pixels:
+            TextureManager.duplicates += 1
+            texture = TextureManager.by_pixels[key]
+        else:
+            texture = Texture(filepath)
+            texture.levels = levels
+            TextureManager.upload(texture, levels[0], levels[1:])
+            TextureManager.by_pixels[key] = texture
+            TextureManager.textures.append(texture)
+        TextureManager.by_path[filepath] = texture
+        return texture
+
+    # Envia a imagem para a GPU, descartando texturas antigas se o limite for ultrapassado
+    #   mipmaps -> níveis menores já calculados (sem eles, o driver gera os mipmaps)
+    @staticmethod
+    def upload(texture, image, mipmaps=None):
+        width, height, data = image
+        estimate = width * height * 3
+        if TextureManager.mipmaps:
+            estimate = estimate * 4 // 3
+        TextureManager.make_room(estimate)
+
+        texture.id = glGenTextures(1)
+        texture.width = width
+        texture.height = height
+        glBindTexture(GL_TEXTURE_2D, texture.id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR if TextureManager.mipmaps else GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1) # Linhas RGB sem preenchimento
+        internal_format = GL_COMPRESSED_RGB if TextureManager.compressed else GL_RGB
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, data)
+        if TextureManager.mipmaps and mipmaps:
+            for level, (level_width, level_height, level_data) in enumerate(mipmaps, 1):
+                glTexImage2D(GL_TEXTURE_2D, level, internal_format, level_width, level_height, 0, GL_RGB, GL_UNSIGNED_BYTE, level_data)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(mipmaps))
+        elif TextureManager.mipmaps:
+            glGenerateMipmap(GL_TEXTURE_2D)
+
+        # Tamanho na GPU: o nível base mais um terço para os mipmaps
+        size = width * height * 3
+        if TextureManager.compressed and glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_COMPRESSED):
+            size = glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_COMPRESSED_IMAGE_SIZE)
+        if TextureManager.mipmaps:
+            size = size * 4 // 3
+        texture.nbytes = size
+        texture.last_used = TextureManager.frame
+        TextureManager.resident_bytes += size
+        TextureManager.uploads += 1
+
+    # Descarta as texturas usadas há mais tempo até caber needed bytes no limite
+    #   Só são descartadas texturas sem uso há mais de idle quadros
+    @staticmethod
+    def make_room(needed, idle=0):
+        if TextureManager.budget == None:
+            return
+        resident = sorted((texture for texture in TextureManager.textures if texture.id != None), key=lambda texture: texture.last_used)
+        for texture in resident:
+            if TextureManager.resident_bytes + needed <= TextureManager.budget:
+                break
+            if TextureManager.frame - texture.last_used <= idle:
+                break
+            TextureManager.evict(texture)
+
+    @staticmethod
+    def evict(texture):
+        glDeleteTextures(1, [texture.id])
+        texture.id = None
+        TextureManager.resident_bytes -= texture.nbytes
+        TextureManager.evictions += 1
+
+    # Marca a textura como usada no quadro atual, reenviando-a se tiver sido descartada
+    @staticmethod
+    def use(texture):
+        texture.last_used = TextureManager.frame
+        if texture.id == None and texture.levels != None:
+            TextureManager.upload(texture, texture.levels[0], texture.levels[1:])
+        elif texture.id == None:
+            TextureManager.upload(texture, decode_texture(texture.filepath, TextureManager.max_size))
+
+    # Avança o quadro, descartando texturas sem uso recente se o limite foi ultrapassado
+    @staticmethod
+    def next_frame():
+        TextureManager.frame += 1
+        TextureManager.make_room(0, TextureManager.idle_frames)
+
+    # Retorna e exibe as estatísticas das texturas
+    @staticmethod
+    def report():
+        resident = [texture for texture in TextureManager.textures if texture.id != None]
+        stats = {
+            'textures': len(TextureManager.textures),
+            'resident': len(resident),
+            'resident_bytes': TextureManager.resident_bytes,
+            'duplicates': TextureManager.duplicates,
+            'uploads': TextureManager.uploads,
+            'evictions': TextureManager.evictions,
+        }
+        budget = 'no budget' if TextureManager.budget == None else f'budget {TextureManager.budget / 2**20:.1f} MB'
+        print(f'Textures: {stats["resident"]}/{stats["textures"]} resident, {stats["resident_bytes"] / 2**20:.1f} MB ({budget}), '
+              f'{stats["duplicates"]} duplicates, {stats["uploads"]} uploads, {stats["evictions"]} evictions')
+        return stats